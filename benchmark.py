@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    benchmark.py - Benchmarks for py9kw.py
+#
+#    Measures the client overhead of the hot paths and the end-to-end throughput against a local Py9kwSimulator.
+#    Results are written as json so that they can be compared between releases:
+#
+#        python3 benchmark.py --output before.json
+#        python3 benchmark.py --compare before.json
+#
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import py9kw
+import py9kw_simulator
+
+SMALL_IMAGE = b"\x89PNG\r\n\x1a\n" + os.urandom(2 * 1024)
+LARGE_IMAGE = b"\x89PNG\r\n\x1a\n" + os.urandom(64 * 1024)
+RESPONSE_NODATA = json.dumps(
+    {
+        "answer": "NO DATA",
+        "message": "OK",
+        "nodata": 1,
+        "try_again": 1,
+        "status": {"success": True, "https": 1},
+        "info": 1,
+    }
+).encode("utf-8")
+RESPONSE_ERROR = {"error": "0002 API key not found", "status": {"success": False}}
+RESPONSE_OK = {"captchaid": "1234", "message": "OK", "status": {"success": True}}
+
+
+class CannedPool:
+    """Stands in for HTTPConnectionPool and always returns the same body so that only client side work gets measured."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def request(self, url, method="GET", body=None, headers=None):
+        return self.body
+
+
+class PollNTimesSchedule(py9kw.PollSchedule):
+    """Polls without waiting and gives up after the given number of polls."""
+
+    def __init__(self, polls):
+        self.polls = polls
+
+    def getDelay(self, job, attempt):
+        return 0 if attempt < self.polls else float("inf")
+
+
+@contextlib.contextmanager
+def quiet():
+    """Hides the log messages of py9kw, e.g. warnings about failed requests, while a benchmark runs."""
+    level = py9kw.logger.level
+    py9kw.logger.setLevel(logging.ERROR)
+    try:
+        yield
+    finally:
+        py9kw.logger.setLevel(level)
+
+
+def microbenchmark(name, func, number=None):
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=5, number=number)) / number
+    return {"name": name, "unit": "us/call", "value": best * 1e6}
+
+
+def runMicrobenchmarks():
+    client = py9kw.Py9kw("benchmark", pool=CannedPool(RESPONSE_NODATA))
+    job = py9kw.CaptchaJob(client, 1234)
+    results = []
+    with quiet():
+        for mode in (py9kw.UPLOAD_MODE_BASE64, py9kw.UPLOAD_MODE_MULTIPART):
+            client.setUploadMode(mode)
+            for size, image in (("2k", SMALL_IMAGE), ("64k", LARGE_IMAGE)):
+                results.append(
+                    microbenchmark(
+                        "upload_prepare_%s_%s" % (mode, size),
+                        lambda: client._buildRequest(
+                            *client._buildUploadData(job, image)
+                        ),
+                    )
+                )
+        results.append(
+            microbenchmark(
+                "check_error_ok", lambda: client._parseError(RESPONSE_OK, False)
+            )
+        )
+        results.append(
+            microbenchmark(
+                "check_error_error", lambda: client._parseError(RESPONSE_ERROR, False)
+            )
+        )
+        results.append(
+            microbenchmark("json_decode_result", lambda: json.loads(RESPONSE_NODATA))
+        )
+        results.append(microbenchmark("poll_once", lambda: client.getresult(job)))
+        # CPU time of the sleepAndGetResult loop without the sleeping
+        polls = 2000
+        client.setPollSchedule(PollNTimesSchedule(polls))
+        started = time.process_time()
+        client.sleepAndGetResult(job=job)
+        elapsed = time.process_time() - started
+    results.append(
+        {"name": "poll_loop_cpu", "unit": "us/poll", "value": elapsed / polls * 1e6}
+    )
+    return results
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(name, concurrency, latencies, failed, elapsed):
+    result = {
+        "name": name,
+        "concurrency": concurrency,
+        "captchas": len(latencies) + failed,
+        "failed": failed,
+        "captchas_per_second": len(latencies) / elapsed,
+    }
+    for q in (0.5, 0.95, 0.99):
+        result["p%d" % (q * 100)] = percentile(latencies, q) if latencies else None
+    return result
+
+
+def newSchedule(args):
+    return py9kw.BackoffPollSchedule(
+        args.latency / 4, 1.5, max(args.latency / 2, 0.01)
+    )
+
+
+async def runAsync(simulator, args, concurrency, count):
+    client = py9kw.AsyncPy9kw(
+        "benchmark",
+        api_base=simulator.base_url,
+        pool=py9kw.AsyncHTTPConnectionPool(maxsize=concurrency),
+    )
+    client.setPollSchedule(newSchedule(args))
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def solveOne():
+        async with semaphore:
+            started = time.monotonic()
+            job = await client.solve(SMALL_IMAGE)
+            if job.answer is not None:
+                latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(solveOne() for i in range(count)))
+    elapsed = time.monotonic() - started
+    client.pool.close()
+    return summarize("e2e_async", concurrency, latencies, count - len(latencies), elapsed)
+
+
+def runThreads(simulator, args, concurrency, count):
+    client = py9kw.Py9kw(
+        "benchmark",
+        api_base=simulator.base_url,
+        pool=py9kw.HTTPConnectionPool(maxsize=concurrency),
+    )
+    client.setPollSchedule(newSchedule(args))
+
+    def solveOne(i):
+        started = time.monotonic()
+        job = client.solve(SMALL_IMAGE)
+        return time.monotonic() - started if job.answer is not None else None
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(solveOne, range(count)))
+    elapsed = time.monotonic() - started
+    client.pool.close()
+    latencies = [latency for latency in results if latency is not None]
+    return summarize("e2e_threads", concurrency, latencies, count - len(latencies), elapsed)
+
+
+def runEndToEnd(args):
+    results = []
+    with py9kw_simulator.Py9kwSimulator(
+        latency=py9kw_simulator.lognormalLatency(args.latency, 0.5), seed=1
+    ) as simulator, quiet():
+        for concurrency in args.concurrency:
+            count = max(concurrency * args.rounds, 10)
+            results.append(
+                asyncio.run(runAsync(simulator, args, concurrency, count))
+            )
+            if concurrency <= args.max_threads:
+                results.append(runThreads(simulator, args, concurrency, count))
+    return results
+
+
+def compare(results, baseline_path):
+    """Prints the change of every result compared to the given earlier run."""
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    old = {}
+    for result in baseline["micro"]:
+        old[result["name"]] = result["value"]
+    for result in baseline["e2e"]:
+        old["%s@%d" % (result["name"], result["concurrency"])] = result
+    for result in results["micro"]:
+        printChange(result["name"], old.get(result["name"]), result["value"])
+    for result in results["e2e"]:
+        name = "%s@%d" % (result["name"], result["concurrency"])
+        for key in ("captchas_per_second", "p50", "p95", "p99"):
+            printChange(
+                "%s %s" % (name, key), old.get(name, {}).get(key), result[key]
+            )
+
+
+def printChange(name, old, new):
+    if old is None or new is None or old == 0:
+        print("%-40s %12s -> %12s" % (name, old, new))
+        return
+    print("%-40s %12.3f -> %12.3f (%+.1f%%)" % (name, old, new, (new / old - 1) * 100))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks for py9kw")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100, 1000],
+        help="concurrency levels for the end-to-end benchmark",
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=3,
+        help="captchas per concurrency level = concurrency * rounds",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.2,
+        help="median simulated solve time in seconds",
+    )
+    parser.add_argument(
+        "--max-threads",
+        type=int,
+        default=100,
+        help="highest concurrency level which also gets benchmarked with threads",
+    )
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--compare", help="json file of an earlier run")
+    args = parser.parse_args(argv)
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "micro": runMicrobenchmarks(),
+        "e2e": [] if args.skip_e2e else runEndToEnd(args),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(output)
+    elif args.compare is None:
+        print(output)
+    if args.compare is not None:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -20,24 +20,69 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import argparse
+import asyncio
 import binascii
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import heapq
+import http.client
+import http.server
+import io
+import itertools
 import json
+import logging
+import mmap
+import os
+import pathlib
+import random
 import re
+import socket
+import sqlite3
+import ssl
+import sys
+import threading
 import time
-import urllib.request
-from base64 import b64encode, b64decode
+import urllib.error
+from base64 import b64encode
 from os import getenv
-from urllib.parse import urlencode
+from urllib.parse import unquote, urlencode, urljoin, urlsplit
+
+try:
+    # Optional: Only needed by ImageMinimizer
+    from PIL import Image, ImageChops
+except ImportError:
+    Image = None
+
+
+# All output goes through this logger. Nothing gets formatted as long as it is not enabled.
+logger = logging.getLogger("py9kw")
 
 
 def printInfo(msg):
-    print("[py9kw] %s" % msg)
+    logger.info(msg)
+
+
+def enableVerboseLogging(stream=None):
+    """Prints all log messages of this library including debug messages to stdout (or stream) like the verbose mode of older versions did.
+    Affects all instances in the process, as they share the 'py9kw' logger."""
+    if not any(getattr(handler, "py9kw_verbose", False) for handler in logger.handlers):
+        handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+        handler.setFormatter(logging.Formatter("[py9kw] %(message)s"))
+        handler.py9kw_verbose = True
+        logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
 
 
 # See API docs: https://www.9kw.eu/api.html
 API_BASE = "https://www.9kw.eu/index.cgi"
 # Parameter used as 'source' in all API requests
 API_SOURCE = "py9kw-api"
+USER_AGENT = "Python-urllib/3.x (py9kw-api)"
 # Values according to website 2020-01-25
 PARAM_MAX_PRIO = 20
 # -1 or 0 = do not send 'prio' parameter at all.
@@ -45,456 +90,3704 @@ PARAM_DEFAULT_PRIO = -1
 PARAM_MIN_MAXTIMEOUT = 60
 PARAM_MAX_MAXTIMEOUT = 3999
 PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA = 10
+UPLOAD_MODE_AUTO = "auto"
+UPLOAD_MODE_BASE64 = "base64"
+UPLOAD_MODE_MULTIPART = "multipart"
+# Images bigger than this (bytes) get uploaded as multipart/form-data in UPLOAD_MODE_AUTO
+PARAM_MULTIPART_THRESHOLD = 8 * 1024
+# sleepAndGetResult waits this many seconds longer than maxtimeout
+PARAM_WAIT_EXTRA_SECONDS = 10
+# Captcha images downloaded from websites may not be bigger (bytes) and take longer (seconds) than this
+PARAM_MAX_IMAGE_BYTES = 1024 * 1024
+PARAM_DOWNLOAD_TIMEOUT = 10
+# Downloads follow at most this many redirects
+PARAM_MAX_REDIRECTS = 5
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+# API returns errors as one String e.g. "0001 API key doesn't exist"
+ERROR_PATTERN = re.compile(r"^(\d{4}) (.+)")
+# Failed API requests which may be retried: Connection problems, http error status and malformed json
+REQUEST_ERRORS = (OSError, http.client.HTTPException, ValueError, asyncio.TimeoutError)
+# Only uploads cannot be sent twice safely, 9kw has no key to deduplicate them
+IDEMPOTENT_ACTIONS = ("usercaptchacorrectdata", "usercaptchacorrectback", "usercaptchaguthaben")
+# sleepAndGetResult keeps on polling after these errors
+WAIT_RETRY_ERRORS = (602, 606, 607)
+# First bytes of gif, png, jpg, bmp and webp images
+IMAGE_SIGNATURES = (b"GIF8", b"\x89PNG", b"\xff\xd8\xff", b"BM", b"RIFF")
+# The same base64 encoded
+BASE64_IMAGE_SIGNATURES = (b"R0lGO", b"iVBOR", b"/9j/", b"Qk", b"UklGR")
 
 
-class Py9kw:
-    def __init__(self, apikey, env_proxy=False, verbose=False):
-        """Initialize py9kw with a APIKEY and Optional verbose mode.
-        Verbose mode will print each step to stdout."""
-        logger_prefix = "[init] "
-        self.verbose = verbose
-        self.prio = PARAM_DEFAULT_PRIO
-        self.maxtimeout = PARAM_MIN_MAXTIMEOUT
-        self.apikey = apikey
-        self.captchaid = -1
-        self.credits = -1
-        self.extrauploaddata = None
-        # Custom errors also possible besides known API errorcodes e.g. 600 --> "ERROR_NO_USER" --> See README.md
-        self.errorint = -1
-        self.errormsg = None
-        if env_proxy:
-            self.proxy = getenv("http_proxy")
-            if self.proxy is None:
-                self.proxyhdl = urllib.request.ProxyHandler({})
-                if self.verbose:
-                    printInfo(
-                        logger_prefix
-                        + "Warning: You have set env_proxy=True, but http_proxy is not set!"
-                    )
-                    printInfo(logger_prefix + "I will countine without a Proxy.")
+def encodeMultipart(fields, files):
+    """Encodes fields and files as multipart/form-data. Returns the body as list of chunks (file contents are not copied) and the content type."""
+    boundary = "py9kw-%s" % binascii.hexlify(os.urandom(16)).decode("ascii")
+    chunks = []
+    for name, value in fields.items():
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            value = str(value).encode("utf-8")
+        chunks.append(
+            (
+                '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n'
+                % (boundary, name)
+            ).encode("utf-8")
+        )
+        chunks.append(value)
+        chunks.append(b"\r\n")
+    for name, value in files.items():
+        chunks.append(
+            (
+                '--%s\r\nContent-Disposition: form-data; name="%s"; filename="captcha"\r\nContent-Type: application/octet-stream\r\n\r\n'
+                % (boundary, name)
+            ).encode("utf-8")
+        )
+        chunks.append(value)
+        chunks.append(b"\r\n")
+    chunks.append(("--%s--\r\n" % boundary).encode("ascii"))
+    return chunks, "multipart/form-data; boundary=%s" % boundary
+
+
+class Base64Image:
+    """Image data which is already base64 encoded, e.g. taken from a data: URL. It gets uploaded as it is without encoding it again."""
+
+    def __init__(self, data):
+        if isinstance(data, str):
+            data = data.encode("ascii")
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+def loadImage(imagedata):
+    """Returns the given captcha image as bytes-like object, without copying it where possible: bytes, bytearray, memoryview and Base64Image
+    are used as they are, files given as path (os.PathLike e.g. pathlib.Path) get memory-mapped and binary file objects are read."""
+    if isinstance(imagedata, (bytes, bytearray, Base64Image)):
+        return imagedata
+    if isinstance(imagedata, memoryview):
+        return imagedata.cast("B")
+    if isinstance(imagedata, os.PathLike):
+        with open(imagedata, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            # The mapping stays valid after the file has been closed and gets unmapped together with the memoryview
+            return memoryview(
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+    if hasattr(imagedata, "read"):
+        return imagedata.read()
+    raise TypeError("Unsupported captcha image type: %s" % type(imagedata).__name__)
+
+
+def _looksBase64(imagedata):
+    """Guesses by the first bytes whether the given image data is base64 encoded."""
+    head = bytes(imagedata[:8])
+    if head.startswith(IMAGE_SIGNATURES):
+        return False
+    return head.startswith(BASE64_IMAGE_SIGNATURES)
+
+
+def _quoteBase64(data):
+    """URL-encodes base64 data. Only '+', '/' and '=' need to be escaped which is a lot faster than urlencode."""
+    if isinstance(data, str):
+        data = data.encode("ascii")
+    return (
+        bytes(data)
+        .replace(b"+", b"%2B")
+        .replace(b"/", b"%2F")
+        .replace(b"=", b"%3D")
+        .decode("ascii")
+    )
+
+
+def _isUrl(value):
+    parts = urlsplit(value)
+    return parts.scheme in ("http", "https") and bool(parts.netloc)
+
+
+class ImageMinimizer:
+    """Re-encodes captcha images before the upload to the smallest of GIF, PNG and (with jpeg_quality) JPEG without changing pixels. Requires Pillow."""
+
+    # Formats accepted by 9kw
+    FORMATS = ("GIF", "PNG", "JPEG")
+
+    def __init__(
+        self,
+        max_dimension=None,
+        crop=False,
+        jpeg_quality=None,
+        background=(255, 255, 255),
+    ):
+        if Image is None:
+            raise ImportError("ImageMinimizer requires Pillow: pip install pillow")
+        self.max_dimension = max_dimension
+        self.crop = crop
+        self.jpeg_quality = jpeg_quality
+        self.background = background
+        self._lock = threading.Lock()
+        self.images = 0
+        self.reencoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _open(self, imagedata):
+        """Returns the decoded image or None if it cannot or should not be re-encoded."""
+        try:
+            image = Image.open(io.BytesIO(imagedata))
+            image.load()
+        except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+            return None
+        if getattr(image, "n_frames", 1) > 1:
+            return None
+        return image
+
+    def _flatten(self, image):
+        """Returns the image as RGB or L without alpha channel."""
+        if image.mode == "P" and "transparency" in image.info:
+            image = image.convert("RGBA")
+        if image.mode in ("RGBA", "LA", "PA"):
+            flat = Image.new("RGB", image.size, self.background)
+            flat.paste(image, mask=image.getchannel("A"))
+            return flat
+        if image.mode in ("L", "RGB"):
+            return image
+        return image.convert("RGB")
+
+    def _cropBorder(self, image):
+        """Cuts off borders which have the same color as the top left pixel."""
+        border = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+        box = ImageChops.difference(image, border).getbbox()
+        if box is None or box == (0, 0) + image.size:
+            return image
+        return image.crop(box)
+
+    def _reduceColors(self, image):
+        """Returns the image as L or P if that does not change any pixel."""
+        if image.mode == "RGB":
+            r, g, b = image.split()
+            if (
+                ImageChops.difference(r, g).getbbox() is None
+                and ImageChops.difference(g, b).getbbox() is None
+            ):
+                image = r
+        colors = image.getcolors(256)
+        if colors is None or (image.mode == "L" and len(colors) > 16):
+            # Too many colors for a palette, a palette is only smaller than grayscale with few colors
+            return image
+        paletted = image.convert("P", palette=Image.ADAPTIVE, colors=len(colors))
+        diff = ImageChops.difference(paletted.convert(image.mode), image)
+        if diff.getbbox() is not None:
+            return image
+        return paletted
+
+    def _encode(self, image, format):
+        buffer = io.BytesIO()
+        if format == "JPEG":
+            image.save(buffer, format, quality=self.jpeg_quality, optimize=True)
+        else:
+            image.save(buffer, format, optimize=True)
+        return buffer.getvalue()
+
+    def minimize(self, imagedata):
+        """Returns the smallest encoding of the given image, see the class description. Base64Image is returned as it is."""
+        if isinstance(imagedata, Base64Image) or _looksBase64(imagedata):
+            return imagedata
+        size = len(imagedata)
+        image = self._open(imagedata)
+        best = imagedata
+        if image is not None:
+            # Only an unchanged image may be uploaded as it is
+            keep_original = image.format in self.FORMATS
+            image = self._flatten(image)
+            if self.crop:
+                cropped = self._cropBorder(image)
+                keep_original = keep_original and cropped is image
+                image = cropped
+            if self.max_dimension is not None and max(image.size) > self.max_dimension:
+                image = image.copy()
+                image.thumbnail(
+                    (self.max_dimension, self.max_dimension), Image.LANCZOS
+                )
+                keep_original = False
+            image = self._reduceColors(image)
+            candidates = ["PNG"]
+            if image.mode in ("L", "P"):
+                # GIF would lose colors of other images
+                candidates.append("GIF")
+            if self.jpeg_quality is not None and image.mode != "P":
+                candidates.append("JPEG")
+            encoded = [self._encode(image, format) for format in candidates]
+            if not keep_original:
+                best = min(encoded, key=len)
             else:
-                self.proxyhdl = urllib.request.ProxyHandler({"http", self.proxy})
-                if self.verbose:
-                    printInfo(
-                        logger_prefix + "Loaded http_proxy => {}".format(self.proxy)
+                best = min(encoded + [imagedata], key=len)
+        with self._lock:
+            self.images += 1
+            self.bytes_in += size
+            self.bytes_out += len(best)
+            if best is not imagedata:
+                self.reencoded += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[ImageMinimizer] %d bytes --> %d bytes" % (size, len(best)))
+        return best
+
+    def getStats(self):
+        """Returns how many images got re-encoded and how many bytes that saved."""
+        with self._lock:
+            return {
+                "images": self.images,
+                "reencoded": self.reencoded,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+            }
+
+
+class HTTPConnectionPool:
+    """Thread safe pool of HTTP/1.1 keep-alive connections, one set of idle connections per origin.
+    Connections idle for more than idle_timeout seconds are closed, at most maxsize idle connections are kept per origin."""
+
+    def __init__(self, maxsize=10, idle_timeout=30, timeout=60, proxy=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.proxy = None
+        self.proxy_headers = {}
+        if proxy:
+            # Proxy may be given without scheme e.g. "host:port" like urllib accepts it
+            self.proxy = urlsplit(proxy if "//" in proxy else "http://" + proxy)
+            if self.proxy.username is not None:
+                credentials = "%s:%s" % (
+                    unquote(self.proxy.username),
+                    unquote(self.proxy.password or ""),
+                )
+                self.proxy_headers["Proxy-Authorization"] = "Basic " + b64encode(
+                    credentials.encode()
+                ).decode("ascii")
+        self.ssl_context = ssl.create_default_context()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _newConnection(self, scheme, host, port):
+        if self.proxy is None:
+            if scheme == "https":
+                return http.client.HTTPSConnection(
+                    host, port, timeout=self.timeout, context=self.ssl_context
+                )
+            return http.client.HTTPConnection(host, port, timeout=self.timeout)
+        proxy_port = self.proxy.port or 80
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                self.proxy.hostname,
+                proxy_port,
+                timeout=self.timeout,
+                context=self.ssl_context,
+            )
+            conn.set_tunnel(host, port, headers=self.proxy_headers)
+            return conn
+        return http.client.HTTPConnection(
+            self.proxy.hostname, proxy_port, timeout=self.timeout
+        )
+
+    def _getConnection(self, origin):
+        """Returns (connection, reused) with reused = True if it is an idle keep-alive connection."""
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(origin)
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._newConnection(*origin), False
+
+    def _releaseConnection(self, origin, conn):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            # Evict connections which have been idle for too long, oldest first
+            while idle and now - idle[0][1] > self.idle_timeout:
+                idle.pop(0)[0].close()
+            if len(idle) < self.maxsize:
+                idle.append((conn, now))
+                return
+        conn.close()
+
+    def _open(self, url, method, body, headers, timeout):
+        """Sends one request and returns (origin, connection, response) once the response headers have been read."""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        origin = (parts.scheme, parts.hostname, port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        allheaders = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+        if self.proxy is not None and parts.scheme == "http":
+            target = url
+            allheaders.update(self.proxy_headers)
+        if isinstance(body, list):
+            # Body given as chunks --> Sent one after another without joining them
+            allheaders["Content-Length"] = str(sum(len(chunk) for chunk in body))
+        if headers is not None:
+            allheaders.update(headers)
+        while True:
+            conn, reused = self._getConnection(origin)
+            if timeout is not None:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, target, body=body, headers=allheaders)
+                return origin, conn, conn.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # Server may have closed an idle keep-alive connection in the meantime --> Retry once on a new one
+                if reused and isinstance(
+                    e, (http.client.RemoteDisconnected, ConnectionError)
+                ):
+                    continue
+                if isinstance(e, OSError):
+                    raise
+                raise urllib.error.URLError(e)
+
+    def _finish(self, origin, conn, response):
+        """Returns the connection of a completely read response to the pool."""
+        if response.will_close:
+            conn.close()
+            return
+        if conn.timeout != self.timeout:
+            conn.timeout = self.timeout
+            conn.sock.settimeout(self.timeout)
+        self._releaseConnection(origin, conn)
+
+    def request(self, url, method="GET", body=None, headers=None):
+        """Sends one request and returns the response body. Raises urllib.error.HTTPError on http error status like urlopen does."""
+        origin, conn, response = self._open(url, method, body, headers, None)
+        try:
+            data = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            if isinstance(e, OSError):
+                raise
+            raise urllib.error.URLError(e)
+        self._finish(origin, conn, response)
+        if response.status >= 400:
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.headers, None
+            )
+        return data
+
+    def fetch(
+        self,
+        url,
+        max_bytes=None,
+        timeout=None,
+        file=None,
+        chunk_size=64 * 1024,
+        max_redirects=PARAM_MAX_REDIRECTS,
+    ):
+        """Downloads url chunk by chunk and returns the body as bytearray. Every chunk is also written to file if given.
+        Redirects are followed up to max_redirects times.
+        Raises urllib.error.URLError if the body is bigger than max_bytes or the whole download takes longer than timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        redirects = 0
+        while True:
+            origin, conn, response = self._open(url, "GET", None, None, timeout)
+            location = response.getheader("Location")
+            if response.status not in REDIRECT_STATUS or location is None:
+                break
+            # Body of the redirect is not needed --> Closing is cheaper than reading it
+            conn.close()
+            if redirects >= max_redirects:
+                raise urllib.error.URLError(
+                    "%s redirected more than %d times" % (url, max_redirects)
+                )
+            if deadline is not None and time.monotonic() > deadline:
+                raise urllib.error.URLError(
+                    "Download of %s took longer than %s seconds" % (url, timeout)
+                )
+            redirects += 1
+            url = urljoin(url, location)
+        try:
+            if response.status >= 400:
+                raise urllib.error.HTTPError(
+                    url, response.status, response.reason, response.headers, None
+                )
+            length = response.getheader("Content-Length")
+            if max_bytes is not None and length is not None and int(length) > max_bytes:
+                raise urllib.error.URLError(
+                    "%s is bigger than %d bytes" % (url, max_bytes)
+                )
+            data = bytearray()
+            while True:
+                chunk = response.read1(chunk_size)
+                if not chunk:
+                    break
+                if max_bytes is not None and len(data) + len(chunk) > max_bytes:
+                    raise urllib.error.URLError(
+                        "%s is bigger than %d bytes" % (url, max_bytes)
                     )
-        else:
-            self.proxyhdl = urllib.request.ProxyHandler({})
-        self.opener = urllib.request.build_opener(self.proxyhdl)
-        self.opener.add_headers = [("User-Agent", "Python-urllib/3.x (py9kw-api)")]
-        urllib.request.install_opener(self.opener)
-        if self.verbose:
-            printInfo(
-                logger_prefix
-                + "Current cost for one captcha: %d" % self.getCaptchaCost()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise urllib.error.URLError(
+                        "Download of %s took longer than %s seconds" % (url, timeout)
+                    )
+                data += chunk
+                if file is not None:
+                    file.write(chunk)
+            # read1 does not mark a response with Content-Length as done --> Required before the connection can send the next request
+            response.close()
+        except (http.client.HTTPException, OSError) as e:
+            # Rest of the response is not read --> Connection cannot be reused
+            conn.close()
+            if isinstance(e, OSError):
+                raise
+            raise urllib.error.URLError(e)
+        self._finish(origin, conn, response)
+        return data
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, last_used in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+def _fetchToFile(pool, url, path, max_bytes, timeout):
+    """Downloads url with pool.fetch and writes it to path in the same pass. The partial file gets removed if the download fails."""
+    try:
+        with open(path, "wb") as file:
+            return pool.fetch(url, max_bytes, timeout, file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        raise
+
+
+class CaptchaFetcher:
+    """Downloads captcha images from websites in the background so that the download is done before the image gets uploaded.
+    Downloads are streamed through the given HTTPConnectionPool (keep-alive connections per origin) by worker threads.
+    Images bigger than max_bytes or taking longer than timeout seconds fail."""
+
+    def __init__(
+        self,
+        workers=8,
+        max_bytes=PARAM_MAX_IMAGE_BYTES,
+        timeout=PARAM_DOWNLOAD_TIMEOUT,
+        pool=None,
+    ):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.pool = pool if pool is not None else HTTPConnectionPool(maxsize=workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix="py9kw-fetcher"
+        )
+
+    def fetch(self, url, path=None):
+        """Downloads url and returns the image as bytearray, also saved to path if given. Raises IOError if the download fails."""
+        if path is None:
+            return self.pool.fetch(url, self.max_bytes, self.timeout)
+        return _fetchToFile(self.pool, url, path, self.max_bytes, self.timeout)
+
+    def prefetch(self, url, path=None):
+        """Starts downloading url in the background. Returns a concurrent.futures.Future which resolves to the image."""
+        return self._executor.submit(self.fetch, url, path)
+
+    def prefetchAll(self, urls, paths=None):
+        """Starts downloading all urls (optionally saved to the matching paths). Returns one Future per url in the same order."""
+        if paths is None:
+            paths = itertools.repeat(None)
+        return [self.prefetch(url, path) for url, path in zip(urls, paths)]
+
+    def close(self):
+        """Waits for running downloads and closes all idle connections."""
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PollSchedule:
+    """Decides how many seconds sleepAndGetResult waits before each poll. Subclass this to implement own policies."""
+
+    def getDelay(self, job, attempt):
+        """Returns the seconds to wait before poll number attempt + 1 of the given job."""
+        raise NotImplementedError
+
+    def observe(self, job):
+        """Gets called once for every job which got an answer. job.getSolveTime() is set at this point."""
+        pass
+
+
+class FixedPollSchedule(PollSchedule):
+    """Polls right away and then every wait_seconds like older versions of this library did."""
+
+    def __init__(self, wait_seconds=10):
+        self.wait_seconds = wait_seconds
+
+    def getDelay(self, job, attempt):
+        if attempt == 0:
+            return 0
+        return self.wait_seconds
+
+
+class BackoffPollSchedule(PollSchedule):
+    """Polls first after first_delay seconds and then waits factor times longer each time, but never longer than max_delay."""
+
+    def __init__(self, first_delay=3, factor=1.5, max_delay=10):
+        self.first_delay = first_delay
+        self.factor = factor
+        self.max_delay = max_delay
+
+    def getDelay(self, job, attempt):
+        return min(self.max_delay, self.first_delay * self.factor ** attempt)
+
+
+class LearnedPollSchedule(PollSchedule):
+    """Learns the solve times per prio and captcha type (extra upload parameters) and polls at their quantiles, fallback decides until min_samples are known."""
+
+    def __init__(
+        self,
+        fallback=None,
+        quantiles=(0.1, 0.25, 0.5, 0.75, 0.9, 0.95),
+        window=200,
+        min_samples=20,
+        min_delay=1,
+    ):
+        self.fallback = fallback if fallback is not None else BackoffPollSchedule()
+        self.quantiles = quantiles
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._samples = {}
+        self._pollTimes = {}
+        self._lock = threading.Lock()
+
+    def getKey(self, job):
+        params = tuple(sorted(job.params.items())) if job.params else ()
+        return job.prio, params
+
+    def _getPollTimes(self, key):
+        """Returns the sorted quantiles of the known solve times of the given type or None if there are not enough samples yet."""
+        with self._lock:
+            polltimes = self._pollTimes.get(key)
+            if polltimes is None:
+                samples = self._samples.get(key)
+                if samples is None or len(samples) < self.min_samples:
+                    return None
+                ordered = sorted(samples)
+                polltimes = sorted(
+                    {ordered[int(q * (len(ordered) - 1))] for q in self.quantiles}
+                )
+                self._pollTimes[key] = polltimes
+            return polltimes
+
+    def getDelay(self, job, attempt):
+        polltimes = self._getPollTimes(self.getKey(job))
+        if polltimes is None or job.uploaded_at is None:
+            return self.fallback.getDelay(job, attempt)
+        waited = time.time() - job.uploaded_at
+        for polltime in polltimes:
+            if polltime - waited >= self.min_delay:
+                return polltime - waited
+        return self.fallback.getDelay(job, attempt)
+
+    def observe(self, job):
+        self.fallback.observe(job)
+        key = self.getKey(job)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = collections.deque(maxlen=self.window)
+            samples.append(job.getSolveTime())
+            self._pollTimes.pop(key, None)
+
+
+class ResultCache:
+    """Remembers answers by a hash of the image bytes (and extra upload parameters) so that the same captcha does not have to be paid for twice.
+    Entries expire ttl seconds after they have been stored, at most maxsize entries are kept (least recently used ones get evicted first)."""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    @staticmethod
+    def getKey(imagedata, params=None):
+        digest = hashlib.sha256(imagedata)
+        if params:
+            digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached answer or None."""
+        raise NotImplementedError
+
+    def put(self, key, answer):
+        raise NotImplementedError
+
+    def evict(self, key):
+        raise NotImplementedError
+
+
+class MemoryResultCache(ResultCache):
+    """Thread safe in-memory ResultCache."""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        super().__init__(maxsize, ttl)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            answer, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return answer
+
+    def put(self, key, answer):
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteResultCache(ResultCache):
+    """ResultCache stored in a SQLite database so that it survives restarts and can be shared by multiple processes."""
+
+    def __init__(self, path, maxsize=100000, ttl=86400):
+        super().__init__(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, answer TEXT NOT NULL, stored REAL NOT NULL, used REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS results_used ON results (used)"
+            )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT answer FROM results WHERE key = ? AND stored > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE results SET used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, answer):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, answer, stored, used) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now),
+            )
+            self._db.execute(
+                "DELETE FROM results WHERE stored <= ? OR key IN (SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (now - self.ttl, self.maxsize),
+            )
+
+    def evict(self, key):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class MetricsHooks:
+    """Gets called by Py9kw with measurements of everything it does. All methods do nothing, override the ones you need."""
+
+    def onRequest(self, action, seconds, size, failed):
+        """One API request e.g. action 'usercaptchaupload' took seconds and sent size bytes. failed is True if it raised an exception."""
+        pass
+
+    def onPoll(self, job):
+        """The result of the given job has been polled, job.polls is the number of polls so far."""
+        pass
+
+    def onAnswer(self, job):
+        """The given job got its answer, see job.getSolveTime()."""
+        pass
+
+    def onError(self, errorint):
+        """An API or library errorcode has been set on a job."""
+        pass
+
+    def onCredits(self, credits):
+        """The API reported the current amount of credits."""
+        pass
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(
+                "%s_bucket{%s} %d" % (name, _labels(labels, le=repr(float(bucket))), cumulative)
+            )
+        lines.append('%s_bucket{%s} %d' % (name, _labels(labels, le="+Inf"), self.count))
+        lines.append("%s_sum%s %r" % (name, _braces(labels), self.sum))
+        lines.append("%s_count%s %d" % (name, _braces(labels), self.count))
+        return lines
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    return ",".join('%s="%s"' % (key, value) for key, value in items)
+
+
+def _braces(labels):
+    return "{%s}" % _labels(labels) if labels else ""
+
+
+class PrometheusMetrics(MetricsHooks):
+    """Thread safe MetricsHooks which collect request latency, upload bytes, polls per captcha, time-to-answer, errorcodes and credits.
+    render() returns them in the Prometheus text format (or OpenMetrics), serve() exports them via http."""
+
+    REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    ANSWER_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 300, 600)
+    POLL_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 20, 50)
+
+    def __init__(self, prefix="py9kw"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._failures = collections.Counter()
+        self._bytes = collections.Counter()
+        self._polls = collections.Counter()
+        self._answerPolls = _Histogram(self.POLL_BUCKETS)
+        self._answerTime = _Histogram(self.ANSWER_BUCKETS)
+        self._errors = collections.Counter()
+        self._credits = None
+
+    def onRequest(self, action, seconds, size, failed):
+        with self._lock:
+            histogram = self._requests.get(action)
+            if histogram is None:
+                histogram = self._requests[action] = _Histogram(self.REQUEST_BUCKETS)
+            histogram.observe(seconds)
+            self._bytes[action] += size
+            if failed:
+                self._failures[action] += 1
+
+    def onPoll(self, job):
+        with self._lock:
+            self._polls["all"] += 1
+
+    def onAnswer(self, job):
+        with self._lock:
+            self._answerPolls.observe(job.polls)
+            if job.getSolveTime() is not None:
+                self._answerTime.observe(job.getSolveTime())
+
+    def onError(self, errorint):
+        with self._lock:
+            self._errors[errorint] += 1
+
+    def onCredits(self, credits):
+        with self._lock:
+            self._credits = credits
+
+    def render(self, openmetrics=False):
+        """Returns all metrics as text in the Prometheus exposition format or in OpenMetrics format."""
+        prefix = self.prefix
+        lines = []
+
+        def counter(name, help, samples):
+            # OpenMetrics wants the family declared without the _total suffix, HELP and TYPE must use the same name
+            family = "%s_%s" % (prefix, name if openmetrics else name + "_total")
+            lines.append("# HELP %s %s" % (family, help))
+            lines.append("# TYPE %s counter" % family)
+            for labels, value in samples:
+                lines.append("%s_%s_total%s %d" % (prefix, name, _braces(labels), value))
+
+        with self._lock:
+            lines.append(
+                "# HELP %s_request_duration_seconds Duration of API requests" % prefix
+            )
+            lines.append("# TYPE %s_request_duration_seconds histogram" % prefix)
+            for action, histogram in sorted(self._requests.items()):
+                lines.extend(
+                    histogram.render(
+                        prefix + "_request_duration_seconds", [("action", action)]
+                    )
+                )
+            counter(
+                "request_failures",
+                "API requests which raised an exception",
+                [([("action", action)], value) for action, value in sorted(self._failures.items())],
+            )
+            counter(
+                "request_bytes",
+                "Bytes sent in API requests",
+                [([("action", action)], value) for action, value in sorted(self._bytes.items())],
+            )
+            counter("polls", "Result polls", [([], self._polls["all"])])
+            counter(
+                "errors",
+                "Errorcodes set on captchas",
+                [([("code", code)], value) for code, value in sorted(self._errors.items())],
+            )
+            lines.append("# HELP %s_polls_per_answer Polls needed per answer" % prefix)
+            lines.append("# TYPE %s_polls_per_answer histogram" % prefix)
+            lines.extend(self._answerPolls.render(prefix + "_polls_per_answer", []))
+            lines.append(
+                "# HELP %s_time_to_answer_seconds Time between upload and answer" % prefix
+            )
+            lines.append("# TYPE %s_time_to_answer_seconds histogram" % prefix)
+            lines.extend(self._answerTime.render(prefix + "_time_to_answer_seconds", []))
+            if self._credits is not None:
+                lines.append("# HELP %s_credits Credits reported by the API" % prefix)
+                lines.append("# TYPE %s_credits gauge" % prefix)
+                lines.append("%s_credits %d" % (prefix, self._credits))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Exports the metrics on http://host:port/metrics in a background thread. Returns the server, call shutdown() on it to stop."""
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                openmetrics = "application/openmetrics-text" in self.headers.get(
+                    "Accept", ""
+                )
+                body = metrics.render(openmetrics).encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type",
+                    "application/openmetrics-text; version=1.0.0; charset=utf-8"
+                    if openmetrics
+                    else "text/plain; version=0.0.4; charset=utf-8",
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="py9kw-metrics", daemon=True
+        ).start()
+        return server
+
+
+class CreditLedger:
+    """Local account of the credits of one apikey: Captchas are debited on upload and credited back when they cost nothing, see the README."""
+
+    def __init__(self, client=None, budget=None, reconcile_interval=60, wait_timeout=0):
+        self.client = client
+        self.budget = budget
+        self.reconcile_interval = reconcile_interval
+        self.wait_timeout = wait_timeout
+        # Last balance known from the API minus the captchas answered since then, None until known
+        self.balance = None
+        # Credits debited for uploaded captchas which have not been answered yet
+        self.pending = 0
+        self.spent = 0
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._reconcile = threading.Event()
+        self._closed = False
+        self._thread = None
+        if client is not None:
+            client.setCreditLedger(self)
+            self._thread = threading.Thread(
+                target=self._run, name="py9kw-ledger", daemon=True
+            )
+            self._thread.start()
+
+    def getAvailable(self):
+        """Returns the credits which may still be used for uploads or None if the balance is not known yet."""
+        with self._condition:
+            return self._getAvailable()
+
+    def _getAvailable(self):
+        if self.balance is None:
+            return None
+        return self.balance - self.pending
+
+    def _check(self, cost):
+        if self.budget is not None and self.spent + cost > self.budget:
+            return 605
+        available = self._getAvailable()
+        if available is not None and available < cost:
+            return 604
+        return -1
+
+    def reserve(self, job, timeout=None):
+        """Debits the cost of the given job if enough credits and budget are left, waiting up to timeout (default wait_timeout) seconds for them.
+        Returns -1 on success, 604 if there are not enough credits or 605 if the budget is exhausted."""
+        if timeout is None:
+            timeout = self.wait_timeout
+        cost = job.getCost()
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                errorint = self._check(cost)
+                remaining = deadline - time.monotonic()
+                if errorint == -1 or remaining <= 0 or self._closed:
+                    break
+                self._condition.wait(remaining)
+            if errorint == -1:
+                job.reserved = cost
+                self.pending += cost
+                self.spent += cost
+                # Captchas which were never polled are no longer pending once they expired
+                self._pending[job] = time.monotonic() + job.maxtimeout + PARAM_WAIT_EXTRA_SECONDS
+        return errorint
+
+    def charge(self, job, credits=None):
+        """The given job has been answered so the API charged its cost. credits is the balance if the answer contained it."""
+        with self._condition:
+            if self._pending.pop(job, None) is None:
+                return
+            self.pending -= job.reserved
+            if self.balance is not None:
+                self.balance -= job.reserved
+                # Answers of other captchas may be handled in a different order than they were charged --> Never go up here
+                if credits is not None:
+                    self.balance = min(self.balance, credits)
+
+    def refund(self, job):
+        """Credits back the cost of the given job, e.g. because it was aborted, answered wrong or not solved."""
+        with self._condition:
+            if job.reserved == 0:
+                return
+            if self._pending.pop(job, None) is not None:
+                self.pending -= job.reserved
+            elif self.balance is not None:
+                self.balance += job.reserved
+            self.spent -= job.reserved
+            job.reserved = 0
+            self._condition.notify_all()
+
+    def update(self, credits):
+        """Sets the balance reported by getcredits."""
+        with self._condition:
+            self.balance = credits
+            now = time.monotonic()
+            for job, expires in list(self._pending.items()):
+                if expires < now:
+                    del self._pending[job]
+                    self.pending -= job.reserved
+                    self.spent -= job.reserved
+                    job.reserved = 0
+            self._condition.notify_all()
+
+    def reconcile(self):
+        """Fetches the balance from the API now. Needs a client."""
+        try:
+            self.client.getcredits()
+        except IOError as e:
+            logger.warning("[CreditLedger] Failed to reconcile credits: %s", e)
+
+    def requestReconcile(self):
+        """Makes the background thread reconcile as soon as possible, e.g. after the API said the balance is insufficient."""
+        self._reconcile.set()
+
+    def _run(self):
+        while not self._closed:
+            self.reconcile()
+            self._reconcile.wait(self.reconcile_interval)
+            self._reconcile.clear()
+
+    def close(self):
+        """Stops reconciling and wakes up all waiting uploads."""
+        self._closed = True
+        self._reconcile.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RateLimiter:
+    """Token bucket for API requests which lets rate requests per second pass with bursts of up to burst, serving feedback before polls before uploads."""
+
+    LANE_FEEDBACK = 0
+    LANE_POLL = 1
+    LANE_UPLOAD = 2
+    LANES = {
+        "usercaptchacorrectback": LANE_FEEDBACK,
+        "usercaptchacorrectdata": LANE_POLL,
+        "usercaptchaguthaben": LANE_POLL,
+        "usercaptchaupload": LANE_UPLOAD,
+    }
+
+    def __init__(self, rate=20, burst=None):
+        self._lock = threading.Lock()
+        self._lanes = [collections.deque() for lane in range(3)]
+        self.rate = rate
+        self.burst = max(1, rate) if burst is None else burst
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def setRate(self, rate, burst=None):
+        """Changes the allowed requests per second, e.g. after the limits of the API changed."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = max(1, rate) if burst is None else burst
+
+    def _refill(self, now):
+        # Caller must hold self._lock
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _enter(self, action):
+        """Takes a token right away if nobody is waiting. Returns None in that case or the _Ticket to wait with."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1 and not any(self._lanes):
+                self._tokens -= 1
+                return None
+            ticket = _Ticket(self.LANES.get(action, self.LANE_POLL))
+            self._lanes[ticket.lane].append(ticket)
+            return ticket
+
+    def _tryAcquire(self, ticket):
+        """Takes a token if it is the turn of the given ticket. Returns 0 on success or the seconds to wait before trying again."""
+        with self._lock:
+            self._refill(time.monotonic())
+            lane = self._lanes[ticket.lane]
+            ahead = lane.index(ticket)
+            for other in self._lanes[: ticket.lane]:
+                ahead += len(other)
+            if ahead == 0 and self._tokens >= 1:
+                self._tokens -= 1
+                lane.popleft()
+                return 0
+            # Time until enough tokens for all tickets ahead and this one are there
+            return max((ahead + 1 - self._tokens) / self.rate, 0.001)
+
+    def _leave(self, ticket):
+        with self._lock:
+            try:
+                self._lanes[ticket.lane].remove(ticket)
+            except ValueError:
+                pass
+
+    def acquire(self, action):
+        """Blocks until a request for the given API action may be sent."""
+        ticket = self._enter(action)
+        if ticket is None:
+            return
+        try:
+            while True:
+                delay = self._tryAcquire(ticket)
+                if delay == 0:
+                    return
+                time.sleep(delay)
+        finally:
+            self._leave(ticket)
+
+    async def acquireAsync(self, action):
+        """Waits without blocking the event loop until a request for the given API action may be sent."""
+        ticket = self._enter(action)
+        if ticket is None:
+            return
+        try:
+            while True:
+                delay = self._tryAcquire(ticket)
+                if delay == 0:
+                    return
+                await asyncio.sleep(delay)
+        finally:
+            self._leave(ticket)
+
+    def getWaiting(self):
+        """Returns the number of waiting requests per lane."""
+        with self._lock:
+            return [len(lane) for lane in self._lanes]
+
+
+class _Ticket:
+    def __init__(self, lane):
+        self.lane = lane
+
+
+class RetryPolicy:
+    """Decides how often and after how long a failed API request is sent again. Delays use decorrelated jitter:
+    Each one is random between base and three times the previous one but at most cap seconds, so that many clients do not retry in sync."""
+
+    def __init__(self, attempts=3, base=0.5, cap=10, rng=None):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self._random = rng if rng is not None else random.Random()
+
+    @staticmethod
+    def isUnprocessed(error):
+        """Returns True if the given error means the request did not reach the API, so even uploads can be sent again."""
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code in (429, 503)
+        return isinstance(error, (ConnectionRefusedError, socket.gaierror))
+
+    def getDelay(self, attempt, previous, error, idempotent=True):
+        """Returns the seconds to wait before retrying after attempt (counting from 0) failed with error or None to give up.
+        Requests which are not idempotent are only retried if they did not reach the API."""
+        if attempt + 1 >= self.attempts:
+            return None
+        if not idempotent and not self.isUnprocessed(error):
+            return None
+        if previous is None:
+            previous = self.base
+        return min(self.cap, self._random.uniform(self.base, previous * 3))
+
+
+class CircuitBreaker:
+    """Fails requests with 607 CIRCUIT_OPEN after failure_threshold failures in a row, until a probe request after reset_timeout seconds succeeds."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a request may be sent now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened < self.reset_timeout:
+                return False
+            # Let one probe through, another one only if it does not report back in time
+            if self.state == self.OPEN:
+                logger.info("[CircuitBreaker] Probing whether the API is back")
+            self.state = self.HALF_OPEN
+            self._opened = time.monotonic()
+            return True
+
+    def onSuccess(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("[CircuitBreaker] API is back --> Closing circuit")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def onFailure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    "[CircuitBreaker] %d requests failed --> Opening circuit for %s seconds",
+                    self.failures,
+                    self.reset_timeout,
+                )
+                self.state = self.OPEN
+                self._opened = time.monotonic()
+
+
+class HedgePolicy:
+    """Opt-in for solve(): Uploads the image again with prio raised by prio_boost if there is no answer after quantile of the recent solve times, the slower captcha gets aborted."""
+
+    def __init__(
+        self,
+        quantile=0.9,
+        fallback_delay=30,
+        min_delay=5,
+        prio_boost=0,
+        window=200,
+        min_samples=20,
+    ):
+        self.quantile = quantile
+        self.fallback_delay = fallback_delay
+        self.min_delay = min_delay
+        self.prio_boost = prio_boost
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.solves = 0
+        self.hedged = 0
+        self.hedge_won = 0
+        self.extra_credits = 0
+
+    def getDelay(self, job):
+        """Returns the seconds after the upload of the given job at which it gets hedged."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return max(self.min_delay, self.fallback_delay)
+            ordered = sorted(self._samples)
+        return max(self.min_delay, ordered[int(self.quantile * (len(ordered) - 1))])
+
+    def getPrio(self, job):
+        """Returns the prio for the hedge of the given job."""
+        if self.prio_boost <= 0:
+            return job.prio
+        return min(PARAM_MAX_PRIO, max(job.prio, 0) + self.prio_boost)
+
+    def observe(self, job, hedge, winner, charged=()):
+        """Records one finished solve. hedge is None if it was not hedged, winner is None if nothing got solved.
+        charged are the losing captchas which cost credits anyway because they got solved or could not be aborted."""
+        with self._lock:
+            self.solves += 1
+            if winner is not None and winner.getSolveTime() is not None:
+                self._samples.append(winner.getSolveTime())
+            if hedge is None:
+                return
+            self.hedged += 1
+            if winner is hedge:
+                # An aborted first captcha costs nothing, only the higher prio of the hedge
+                self.hedge_won += 1
+                self.extra_credits += hedge.getCost() - job.getCost()
+            for loser in charged:
+                self.extra_credits += loser.getCost()
+
+    def getStats(self):
+        """Returns how often hedging fired, how often the hedge won and how many credits it cost in addition."""
+        with self._lock:
+            return {
+                "solves": self.solves,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.solves if self.solves else 0.0,
+                "hedge_won": self.hedge_won,
+                "extra_credits": self.extra_credits,
+            }
+
+
+class PriorityController:
+    """Chooses the prio of uploads without an explicit prio: The cheapest band in which quantile of the recent captchas were answered within target seconds."""
+
+    def __init__(
+        self,
+        target,
+        max_cost=None,
+        quantile=0.9,
+        bands=(0, 5, 10, 15, 20),
+        window=100,
+        max_age=600,
+        min_samples=10,
+        probe_rate=0.05,
+        rng=None,
+    ):
+        self.target = target
+        self.quantile = quantile
+        max_prio = PARAM_MAX_PRIO
+        if max_cost is not None:
+            max_prio = min(max_prio, max_cost - PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA)
+        self.bands = [band for band in sorted(bands) if band <= max_prio] or [0]
+        self.window = window
+        self.max_age = max_age
+        self.min_samples = min_samples
+        self.probe_rate = probe_rate
+        self._random = rng if rng is not None else random.Random()
+        self._samples = {band: collections.deque(maxlen=window) for band in self.bands}
+        self._lock = threading.Lock()
+
+    def getBand(self, prio):
+        """Returns the band the given prio belongs to."""
+        index = bisect.bisect_right(self.bands, max(prio, 0)) - 1
+        return self.bands[max(index, 0)]
+
+    def _meetsTarget(self, band, now):
+        """Returns True or False if the band is known to meet the target or None if there are not enough samples."""
+        samples = self._samples[band]
+        while samples and now - samples[0][0] > self.max_age:
+            samples.popleft()
+        if len(samples) < self.min_samples:
+            return None
+        fast = sum(1 for observed, seconds in samples if seconds <= self.target)
+        return fast >= self.quantile * len(samples)
+
+    def getPrio(self):
+        """Returns the prio for the next upload."""
+        now = time.monotonic()
+        with self._lock:
+            index = len(self.bands) - 1
+            for i, band in enumerate(self.bands):
+                if self._meetsTarget(band, now) is not False:
+                    index = i
+                    break
+            if index > 0 and self._random.random() < self.probe_rate:
+                index -= 1
+        return self.bands[index]
+
+    def observe(self, job):
+        """Records the solve time of the given job, float('inf') if it got no answer."""
+        seconds = job.getSolveTime()
+        if seconds is None:
+            seconds = float("inf")
+        with self._lock:
+            self._samples[self.getBand(job.prio)].append((time.monotonic(), seconds))
+
+    def getStats(self):
+        """Returns per band the number of recent samples and the share answered within target."""
+        now = time.monotonic()
+        stats = {}
+        with self._lock:
+            for band in self.bands:
+                self._meetsTarget(band, now)
+                samples = self._samples[band]
+                fast = sum(1 for observed, seconds in samples if seconds <= self.target)
+                stats[band] = {
+                    "samples": len(samples),
+                    "within_target": fast / len(samples) if samples else None,
+                }
+        return stats
+
+
+class CaptchaJob:
+    """Handle for one uploaded captcha. Holds its own captchaid, timing and error state so that one client can handle any number of captchas at the same time.
+    Unpacks to (captchaid, errorint, errormsg) like the tuple uploadcaptcha used to return."""
+
+    def __init__(
+        self, client, captchaid=-1, maxtimeout=PARAM_MIN_MAXTIMEOUT, prio=PARAM_DEFAULT_PRIO
+    ):
+        self.client = client
+        self.captchaid = captchaid
+        self.maxtimeout = maxtimeout
+        self.prio = prio
+        # Extra upload parameters e.g. {'numeric': '1'} which describe the type of this captcha
+        self.params = None
+        self.uploaded_at = None
+        self.solved_at = None
+        self.polls = 0
+        self.answer = None
+        # Set if the answer came from the ResultCache instead of 9kw
+        self.cached = False
+        self.cachekey = None
+        # Credits debited by the CreditLedger for this captcha
+        self.reserved = 0
+        # Upload as new captcha even if 9kw knows the image already
+        self.nomd5 = False
+        # Set if 9kw answered the abort of this captcha with an error, it may cost credits then
+        self.abort_failed = False
+        self.errorint = -1
+        self.errormsg = None
+
+    def setError(self, errorint, errormsg):
+        self.errorint = errorint
+        self.errormsg = errormsg
+
+    def getCost(self):
+        """Returns how much credits this captcha costs when it gets solved."""
+        return self.client.getCaptchaCost(self.prio)
+
+    def getSolveTime(self):
+        """Returns the seconds between upload and answer or None if there is no answer (yet)."""
+        if self.uploaded_at is None or self.solved_at is None:
+            return None
+        return self.solved_at - self.uploaded_at
+
+    def poll(self):
+        """Checks once for the answer, see Py9kw.getresult."""
+        return self.client.getresult(job=self)
+
+    def result(self, custom_timeout=None):
+        """Waits for the answer, see Py9kw.sleepAndGetResult."""
+        return self.client.sleepAndGetResult(custom_timeout, job=self)
+
+    def correct(self, iscorrect=True):
+        """Sends feedback whether the answer was correct."""
+        return self.client.captcha_correct(iscorrect, job=self)
+
+    def abort(self):
+        """Aborts this captcha. If no answer is available yet, no credits will be used."""
+        return self.client.captcha_correct_abort(job=self)
+
+    def __bool__(self):
+        return self.captchaid != -1 or self.cached
+
+    def __iter__(self):
+        return iter((self.captchaid, self.errorint, self.errormsg))
+
+    def __repr__(self):
+        return "CaptchaJob(captchaid=%d, errorint=%d)" % (self.captchaid, self.errorint)
+
+
+class Py9kw:
+    def __init__(
+        self, apikey, env_proxy=False, verbose=False, pool=None, api_base=API_BASE
+    ):
+        """Initialize py9kw with a APIKEY and Optional verbose mode.
+        Verbose mode will print each step to stdout, see enableVerboseLogging. It applies to the 'py9kw' logger and so to all instances in the process.
+        Without it messages go to the 'py9kw' logger only.
+        All requests go through the given HTTPConnectionPool which may be shared by multiple instances. A new one will be created if not given.
+        api_base can be changed e.g. to the base_url of a Py9kwSimulator."""
+        logger_prefix = "[init] "
+        self.verbose = verbose
+        if verbose:
+            enableVerboseLogging()
+        self.api_base = api_base
+        self.prio = PARAM_DEFAULT_PRIO
+        self.maxtimeout = PARAM_MIN_MAXTIMEOUT
+        self.apikey = apikey
+        # captchaid, errorint and errormsg always reflect the most recent call. Use the CaptchaJob returned by uploadcaptcha to handle multiple captchas at the same time.
+        self.captchaid = -1
+        self.job = None
+        self.credits = -1
+        self.extrauploaddata = None
+        self.upload_mode = UPLOAD_MODE_AUTO
+        self.multipart_threshold = PARAM_MULTIPART_THRESHOLD
+        self.poll_schedule = BackoffPollSchedule()
+        self.cache = None
+        self.metrics = None
+        self.ledger = None
+        self.limiter = None
+        self.retry_policy = RetryPolicy()
+        self.retry_policies = {}
+        self.breaker = CircuitBreaker()
+        self.hedge_policy = None
+        self.prio_controller = None
+        self.store = None
+        self.minimizer = None
+        self.feedback = None
+        self.max_image_bytes = PARAM_MAX_IMAGE_BYTES
+        self.download_timeout = PARAM_DOWNLOAD_TIMEOUT
+        # Custom errors also possible besides known API errorcodes e.g. 600 --> "ERROR_NO_USER" --> See README.md
+        self.errorint = -1
+        self.errormsg = None
+        self.proxy = None
+        if env_proxy:
+            self.proxy = getenv("http_proxy")
+            if self.proxy is None:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        logger_prefix
+                        + "Warning: You have set env_proxy=True, but http_proxy is not set!"
+                    )
+                    logger.debug(logger_prefix + "I will countine without a Proxy.")
+            else:
+                logger.debug(logger_prefix + "Loaded http_proxy => %s", self.proxy)
+        if pool is None:
+            pool = self._createPool()
+        self.pool = pool
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                logger_prefix
+                + "Current cost for one captcha: %d" % self.getCaptchaCost()
+            )
+
+    def _createPool(self):
+        return HTTPConnectionPool(proxy=self.proxy)
+
+    def resetSolver(self):
+        """ Call this to reset all runtime values if you e.g. want to re-use a previously created solver instance while keeping your settings (prio, maxtimeout and so on).  """
+        self.captchaid = -1
+        self.job = None
+        return
+
+    def _parseError(self, response, showStatus):
+        """Like checkError but without touching the state of this instance."""
+        error_plain = response.get("error", None)
+        if error_plain is None:
+            # No error found
+            if showStatus and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[checkError] OK - NO ERROR")
+            return -1, None
+        # Error found
+        if showStatus and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[checkError] Found error: Plain error: %s" % error_plain)
+        error_MatchObject = ERROR_PATTERN.search(str(error_plain))
+        if error_MatchObject is None:
+            # This should never happen
+            errormsg = "Error while parsing error number and message"
+            logger.warning(errormsg)
+            return 666, errormsg
+        errorint = int(error_MatchObject.group(1))
+        errormsg = error_MatchObject.group(2)
+        if showStatus and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "[checkError] Found error: Number: %d | Message: %s"
+                % (errorint, errormsg)
+            )
+        return errorint, errormsg
+
+    # Checks for errors in json response and returns error_code(int) and error_message(String) separated as API returns them both in one String.
+    def checkError(self, response, showStatus):
+        self.errorint, self.errormsg = self._parseError(response, showStatus)
+        return self.errorint, self.errormsg
+
+    def _setError(self, job, errorint, errormsg):
+        """Sets the error state of the given job and mirrors it into this instance."""
+        job.setError(errorint, errormsg)
+        self.errorint = errorint
+        self.errormsg = errormsg
+        if errorint > -1 and self.metrics is not None:
+            self.metrics.onError(errorint)
+
+    def _setCredits(self, credits):
+        self.credits = credits
+        if self.metrics is not None:
+            self.metrics.onCredits(credits)
+
+    def _saveJob(self, job, state):
+        if self.store is not None and job.captchaid != -1:
+            self.store.save(job, state)
+
+    def _refundCredits(self, job):
+        if self.ledger is not None:
+            self.ledger.refund(job)
+
+    def _currentJob(self, job=None):
+        """Returns the given job or the one belonging to self.captchaid for calls without job."""
+        if job is not None:
+            return job
+        if self.job is not None and self.job.captchaid == self.captchaid:
+            return self.job
+        return CaptchaJob(self, self.captchaid, self.maxtimeout, self.prio)
+
+    def getCaptchaCost(self, prio=None):
+        """Returns how much credits it would cost to solve one captcha with the current settings or the given prio."""
+        if prio is None:
+            prio = self.prio
+        captcha_cost = PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA
+        if prio > 0:
+            captcha_cost += prio
+        return captcha_cost
+
+    def _checkPriority(self, prio):
+        if prio > PARAM_MAX_PRIO:
+            logger.warning(
+                "Wished 'prio' value %d is higher than highest possible value %d --> Using highest value %d instead"
+                % (prio, PARAM_MAX_PRIO, PARAM_MAX_PRIO)
+            )
+            return PARAM_MAX_PRIO
+        # Either user defined prio value or default
+        return prio
+
+    def setPriority(self, prio):
+        self.prio = self._checkPriority(prio)
+        return
+
+    def setAdditionalCaptchaUploadParams(self, uploaddata):
+        """ Use this to add extra captcha upload parameters such as: 'case-sensitive':'1'. Be sure to always use Strings! """
+        if uploaddata is not None:
+            self.extrauploaddata = uploaddata
+        return
+
+    def setUploadMode(self, upload_mode, multipart_threshold=None):
+        """ Use UPLOAD_MODE_BASE64 to send images base64 encoded as GET parameter, UPLOAD_MODE_MULTIPART to send raw image bytes as multipart/form-data POST
+        or UPLOAD_MODE_AUTO (default) to use multipart for images bigger than multipart_threshold bytes. """
+        if upload_mode not in (UPLOAD_MODE_AUTO, UPLOAD_MODE_BASE64, UPLOAD_MODE_MULTIPART):
+            logger.warning("Unknown upload mode '%s' --> Ignoring it", upload_mode)
+            return
+        self.upload_mode = upload_mode
+        if multipart_threshold is not None:
+            self.multipart_threshold = multipart_threshold
+        return
+
+    def setMetrics(self, metrics):
+        """ Sets MetricsHooks (e.g. PrometheusMetrics) which get called with measurements of all API calls. """
+        self.metrics = metrics
+        return
+
+    def setCreditLedger(self, ledger):
+        """ Sets a CreditLedger which debits and refunds the cost of every captcha locally instead of relying on the last known credits. None disables it. """
+        self.ledger = ledger
+        return
+
+    def setRateLimiter(self, limiter):
+        """ Sets a RateLimiter which all API requests have to pass. Share one between all instances using the same API. None disables it. """
+        self.limiter = limiter
+        return
+
+    def setRetryPolicy(self, policy, action=None):
+        """ Sets the RetryPolicy for failed requests of the given API action e.g. 'usercaptchaupload' or of all actions without an own policy. None disables retries. """
+        if action is None:
+            self.retry_policy = policy
+        else:
+            self.retry_policies[action] = policy
+        return
+
+    def setCircuitBreaker(self, breaker):
+        """ Sets the CircuitBreaker which lets requests fail fast while the API is down. None disables it. """
+        self.breaker = breaker
+        return
+
+    def setHedgePolicy(self, policy):
+        """ Sets a HedgePolicy so that solve() uploads captchas which take too long a second time. None disables hedging. """
+        self.hedge_policy = policy
+        return
+
+    def setPriorityController(self, controller):
+        """ Sets a PriorityController which chooses the prio of every upload that does not pass its own prio. None goes back to the prio set via setPriority. """
+        self.prio_controller = controller
+        return
+
+    def setJobStore(self, store):
+        """ Sets a JobStore which records every uploaded captcha and its state, see JobStore.pollDue. None disables it. """
+        self.store = store
+        return
+
+    def setResultCache(self, cache):
+        """ Sets a ResultCache so that answers of images which have been solved before are returned without uploading them again. None disables caching. """
+        self.cache = cache
+        return
+
+    def setFeedbackDispatcher(self, dispatcher):
+        """ Sets a FeedbackDispatcher (AsyncFeedbackDispatcher for AsyncPy9kw) which sends captcha feedback in the background. None sends it right away. """
+        self.feedback = dispatcher
+        return
+
+    def setImageMinimizer(self, minimizer):
+        """ Sets an ImageMinimizer which re-encodes every image before it gets uploaded. None uploads images as they are. """
+        self.minimizer = minimizer
+        return
+
+    def setDownloadLimits(self, max_image_bytes=None, download_timeout=None):
+        """ Downloads in getCaptchaImageFromWebsite fail if the image is bigger than max_image_bytes or takes longer than download_timeout seconds. None keeps the current value. """
+        if max_image_bytes is not None:
+            self.max_image_bytes = max_image_bytes
+        if download_timeout is not None:
+            self.download_timeout = download_timeout
+        return
+
+    def setPollSchedule(self, poll_schedule):
+        """ Sets the PollSchedule which decides when sleepAndGetResult polls for the result. """
+        if poll_schedule is not None:
+            self.poll_schedule = poll_schedule
+        return
+
+    def _checkTimeout(self, maxtimeout):
+        if maxtimeout < PARAM_MIN_MAXTIMEOUT:
+            logger.warning(
+                "Wished 'maxtimeout' value %d is lower than lowest possible value %d --> Using lowest value %d instead"
+                % (maxtimeout, PARAM_MIN_MAXTIMEOUT, PARAM_MIN_MAXTIMEOUT)
+            )
+            maxtimeout = PARAM_MIN_MAXTIMEOUT
+        elif maxtimeout > PARAM_MAX_MAXTIMEOUT:
+            logger.warning(
+                "Wished 'maxtimeout' value %d is higher than highest possible value %d --> Using highest value %d instead"
+                % (maxtimeout, PARAM_MAX_MAXTIMEOUT, PARAM_MAX_MAXTIMEOUT)
+            )
+            maxtimeout = PARAM_MAX_MAXTIMEOUT
+        return maxtimeout
+
+    def setTimeout(self, maxtimeout):
+        self.maxtimeout = self._checkTimeout(maxtimeout)
+        return
+
+    def _imageDownloaded(self, imagefile):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[getCaptchaImageFromWebsite] [OK]")
+        return imagefile, -1, None
+
+    def _imageDownloadFailed(self):
+        logger.warning("[getCaptchaImageFromWebsite] [FAIL]")
+        self.errorint = 603
+        self.errormsg = "CAPTCHA_DOWNLOAD_FAILURE"
+        return None, self.errorint, self.errormsg
+
+    def getCaptchaImageFromWebsite(self, image_url, image_path=None):
+        """ Returns (captcha) image file obtained from website. And optionally saves it to <image_path> while downloading. """
+        try:
+            if image_path is None:
+                imagefile = self.pool.fetch(
+                    image_url, self.max_image_bytes, self.download_timeout
+                )
+            else:
+                imagefile = _fetchToFile(
+                    self.pool,
+                    image_url,
+                    image_path,
+                    self.max_image_bytes,
+                    self.download_timeout,
+                )
+        except IOError as e:
+            return self._imageDownloadFailed()
+        return self._imageDownloaded(imagefile)
+
+    def _buildRequest(self, getdata, files=None):
+        """Returns url, method, body and headers for one API request. Requests with files are sent as multipart/form-data POST."""
+        if files is None:
+            image = getdata.get("file-upload-01")
+            if image is None:
+                return "%s?%s" % (self.api_base, urlencode(getdata)), "GET", None, None
+            fields = dict(getdata)
+            del fields["file-upload-01"]
+            query = "%s&file-upload-01=%s" % (urlencode(fields), _quoteBase64(image))
+            return "%s?%s" % (self.api_base, query), "GET", None, None
+        body, content_type = encodeMultipart(getdata, files)
+        return self.api_base, "POST", body, {"Content-Type": content_type}
+
+    def _requestDone(self, request, action, started, failed):
+        """Reports one API request to the metrics hooks."""
+        if self.metrics is None:
+            return
+        url, method, body, headers = request
+        size = len(url)
+        if body is not None:
+            size += sum(len(chunk) for chunk in body)
+        self.metrics.onRequest(action, time.monotonic() - started, size, failed)
+
+    def _errorResponse(self, errorint, errormsg):
+        """Returns a response carrying one of our own errors the same way the API returns its errors."""
+        return {"error": "%04d %s" % (errorint, errormsg), "status": {"success": False}}
+
+    def _requestAllowed(self):
+        return self.breaker is None or self.breaker.allow()
+
+    def _requestSucceeded(self, request, action, started):
+        self._requestDone(request, action, started, False)
+        if self.breaker is not None:
+            self.breaker.onSuccess()
+
+    def _requestFailed(self, request, action, started, error, attempt, delay):
+        """Returns the seconds to wait before retrying the failed request or None to give up."""
+        self._requestDone(request, action, started, True)
+        if self.breaker is not None:
+            self.breaker.onFailure()
+        policy = self.retry_policies.get(action, self.retry_policy)
+        if policy is not None:
+            delay = policy.getDelay(attempt, delay, error, action in IDEMPOTENT_ACTIONS)
+            if delay is not None:
+                logger.info(
+                    "[%s] Request failed: %s --> Retrying in %.1f seconds", action, error, delay
+                )
+                return delay
+        logger.warning("[%s] Request failed: %s --> Giving up", action, error)
+        return None
+
+    def _apiRequest(self, getdata, files=None):
+        """Sends one request to the API and returns the decoded json response. Failed requests are retried according to the RetryPolicy,
+        if they still fail the response contains the error 606 API_REQUEST_FAILED or 607 CIRCUIT_OPEN."""
+        action = getdata["action"]
+        attempt = 0
+        delay = None
+        while True:
+            if not self._requestAllowed():
+                return self._errorResponse(607, "CIRCUIT_OPEN")
+            if self.limiter is not None:
+                self.limiter.acquire(action)
+            request = self._buildRequest(getdata, files)
+            started = time.monotonic()
+            try:
+                response = json.loads(
+                    self.pool.request(*request).decode("utf-8", "ignore")
+                )
+            except REQUEST_ERRORS as e:
+                delay = self._requestFailed(request, action, started, e, attempt, delay)
+                if delay is None:
+                    return self._errorResponse(606, "API_REQUEST_FAILED")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._requestSucceeded(request, action, started)
+            return response
+
+    def _prepareUpload(self, maxtimeout, prio):
+        """Returns a new job with the parameters for this upload."""
+        logger_prefix = "[uploadcaptcha] "
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(logger_prefix + "Attempting to upload captcha...")
+        # Optional parameters only apply to this upload so that the same instance can be used from multiple threads
+        if prio is None and self.prio_controller is not None:
+            prio = self.prio_controller.getPrio()
+        job = CaptchaJob(
+            self,
+            maxtimeout=self.maxtimeout
+            if maxtimeout is None
+            else self._checkTimeout(maxtimeout),
+            prio=self.prio if prio is None else self._checkPriority(prio),
+        )
+        self.job = job
+        self.captchaid = -1
+        self._setError(job, -1, None)
+        return job
+
+    def _checkCredits(self, job):
+        """Returns False and sets an error on the job if the user does not have enough credits."""
+        if self.ledger is not None:
+            return self._creditsReserved(job, self.ledger.reserve(job))
+        if self.credits > -1 and self.credits < job.getCost():
+            return self._creditsReserved(job, 604)
+        return True
+
+    def _creditsReserved(self, job, errorint):
+        if errorint == 604:
+            logger.warning("[uploadcaptcha] Not enough credits to solve a captcha")
+            self._setError(job, 604, "NOT_ENOUGH_CREDITS")
+            return False
+        if errorint == 605:
+            logger.warning("[uploadcaptcha] Spending budget is exhausted")
+            self._setError(job, 605, "BUDGET_EXHAUSTED")
+            return False
+        return True
+
+    def _checkCache(self, job, imagedata):
+        """Returns True if the answer for the given image is cached. The job will then contain the answer."""
+        if self.cache is None:
+            return False
+        job.cachekey = self.cache.getKey(
+            imagedata.data if isinstance(imagedata, Base64Image) else imagedata,
+            self.extrauploaddata,
+        )
+        answer = self.cache.get(job.cachekey)
+        if answer is None:
+            return False
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[uploadcaptcha] Found cached answer --> Not uploading")
+        job.answer = answer
+        job.cached = True
+        job.uploaded_at = job.solved_at = time.time()
+        return True
+
+    def _updateLedger(self, job, feedback_status):
+        """Credits back wrong answers and captchas aborted before they were answered."""
+        if feedback_status == 2 and job.solved_at is not None:
+            self._refundCredits(job)
+        elif feedback_status == 3 and job.solved_at is None:
+            self._refundCredits(job)
+
+    def _updateCache(self, job, feedback_status):
+        """Stores confirmed answers and removes wrong ones from the cache."""
+        if self.cache is None or job.cachekey is None:
+            return
+        if feedback_status == 1 and job.answer is not None:
+            self.cache.put(job.cachekey, job.answer)
+        elif feedback_status == 2:
+            self.cache.evict(job.cachekey)
+
+    def _useMultipart(self, size):
+        if self.upload_mode == UPLOAD_MODE_AUTO:
+            return size > self.multipart_threshold
+        return self.upload_mode == UPLOAD_MODE_MULTIPART
+
+    def _buildUploadData(self, job, imagedata):
+        """Returns all parameters needed to upload the given image and the files to send as multipart/form-data.
+        files is None if the upload should be sent as GET request."""
+        logger_prefix = "[uploadcaptcha] "
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                logger_prefix + "Check if the imagedata is already base64 encoded..."
+            )
+        if isinstance(imagedata, Base64Image):
+            is_base64 = True
+            imagedata = imagedata.data
+        else:
+            # Plain bytes may be base64 too, the first bytes tell
+            is_base64 = _looksBase64(imagedata)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                logger_prefix
+                + ("YES, already encoded" if is_base64 else "NO, encoding it now")
+            )
+        files = None
+        getdata = {
+            "action": "usercaptchaupload",
+            "apikey": self.apikey,
+            "maxtimeout": str(job.maxtimeout),
+            "source": API_SOURCE,
+            "json": "1"
+            # 			'selfsolve' : '1',	# For debugging, it's faster.
+            # 			'nomd5' : '1'		# always send a new imageid
+        }
+        if job.nomd5:
+            getdata["nomd5"] = "1"
+        if self._useMultipart(len(imagedata)):
+            files = {}
+        if is_base64 or files is None:
+            # base64 is only needed if the image is sent as a normal parameter
+            if not is_base64:
+                imagedata = b64encode(imagedata)
+            getdata["file-upload-01"] = imagedata
+            getdata["base64"] = "1"
+        else:
+            # Raw image bytes are sent as file without any further encoding
+            files["file-upload-01"] = imagedata
+        if job.prio > 0:
+            prio_str = str(job.prio)
+            getdata["prio"] = prio_str
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(logger_prefix + "Uploading captcha with prio %d" % job.prio)
+        else:
+            prio_str = "None"
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(logger_prefix + "Uploading captcha without prio")
+        if self.extrauploaddata is not None:
+            getdata.update(self.extrauploaddata)
+            job.params = dict(self.extrauploaddata)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                logger_prefix
+                + "Priority: %s of 10, Maxtimeout: %d of 3999s"
+                % (prio_str, job.maxtimeout)
+            )
+            logger.debug(
+                logger_prefix
+                + "Upload %d bytes to 9kw.eu%s..."
+                % (len(imagedata), " as multipart/form-data" if files is not None else "")
+            )
+        return getdata, files
+
+    def _handleUploadResponse(self, job, response):
+        logger_prefix = "[uploadcaptcha] "
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(logger_prefix + "json debug: " + json.dumps(response))
+        self._setError(job, *self._parseError(response, True))
+        job.captchaid = int(response.get("captchaid", -1))
+        job.uploaded_at = time.time()
+        if self.job is job:
+            self.captchaid = job.captchaid
+        if job.errorint > -1 or job.captchaid == -1:
+            logger.warning(
+                logger_prefix + "Error %d: %s", job.errorint, job.errormsg
+            )
+            self._refundCredits(job)
+            if job.errorint == 11 and self.ledger is not None:
+                # 0011 Balance insufficient --> Our balance is off
+                self.ledger.requestReconcile()
+            return job
+        self._saveJob(job, JobStore.WAITING)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(logger_prefix + "[DONE]")
+            logger.debug(logger_prefix + "Uploaded => Captcha-id: %d" % job.captchaid)
+        return job
+
+    def uploadcaptcha(
+        self, imagedata, store_image_path=None, maxtimeout=None, prio=None, nomd5=False
+    ):
+        """Upload the Captcha to 9kw.eu (gif/jpg/png). Returns a CaptchaJob which evaluates to False if the upload failed.
+        imagedata can be bytes, bytearray, memoryview, a path (os.PathLike), a binary file object, a Base64Image or an http(s) URL, see loadImage.
+        With nomd5 9kw creates a new captcha even if the same image has been uploaded before."""
+        logger_prefix = "[uploadcaptcha] "
+        # Step 1: Set optional parameters
+        job = self._prepareUpload(maxtimeout, prio)
+        job.nomd5 = nomd5
+        # Step 2: Prepare image data we want to upload
+        # First check if we have an URL --> Download image first
+        if isinstance(imagedata, str):
+            if not _isUrl(imagedata):
+                raise TypeError("Captcha image given as str must be an http(s) URL")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(logger_prefix + "Provided source is an URL: %s" % imagedata)
+            imagedata, erri, errm = self.getCaptchaImageFromWebsite(
+                imagedata, store_image_path
+            )
+            if erri > -1:
+                # Error during picture download
+                self._setError(job, erri, errm)
+                return job
+        imagedata = loadImage(imagedata)
+        # Known images are answered from the cache, all others need enough credits
+        if self._checkCache(job, imagedata):
+            return job
+        if self.minimizer is not None:
+            imagedata = self.minimizer.minimize(imagedata)
+        if not self._checkCredits(job):
+            return job
+        # Step 3: Prepare all other parameters we want to send
+        getdata, files = self._buildUploadData(job, imagedata)
+        # Step 4: Send data and return captchaid
+        try:
+            response = self._apiRequest(getdata, files)
+        except:
+            self._refundCredits(job)
+            raise
+        return self._handleUploadResponse(job, response)
+
+    def _getWaitTimeout(self, job, custom_timeout):
+        """Returns how many seconds sleepAndGetResult waits at most for the given job."""
+        logger_prefix = "[sleepAndGetResult] "
+        total_timeout = None
+        if custom_timeout is not None and custom_timeout >= PARAM_MIN_MAXTIMEOUT:
+            total_timeout = custom_timeout
+        else:
+            total_timeout = job.maxtimeout
+        total_timeout += PARAM_WAIT_EXTRA_SECONDS
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                logger_prefix
+                + "Waiting until the Captcha is solved or maxtimeout %d (includes %d extra seconds) has expired ..."
+                % (total_timeout, PARAM_WAIT_EXTRA_SECONDS)
+            )
+        logger.debug(logger_prefix + "Max. waittime: %s", total_timeout)
+        return total_timeout
+
+    def _getPollDelay(
+        self, job, attempt, response, waited, total_timeout, poll_schedule=None
+    ):
+        """Returns the seconds to wait before the next poll or None if that would exceed total_timeout."""
+        if poll_schedule is None:
+            poll_schedule = self.poll_schedule
+        delay = poll_schedule.getDelay(job, attempt)
+        try:
+            # Server may tell us how long to wait until the next try
+            try_again = int(response.get("try_again", 0)) if response else 0
+        except (TypeError, ValueError):
+            try_again = 0
+        if try_again > 1:
+            delay = max(delay, try_again)
+        if waited + delay > total_timeout:
+            return None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[sleepAndGetResult] Waiting %.1f seconds" % delay)
+        return delay
+
+    def _checkWaitLoop(self, job, result, response, total_time_waited):
+        """Evaluates one sleepAndGetResult loop. Returns True if waiting should stop."""
+        logger_prefix = "[sleepAndGetResult] "
+        server_says_try_again = response.get("try_again", False)
+        if result is not None:
+            # We've reached our goal :)
+            logger.debug(
+                logger_prefix + "Total seconds waited for result: %d", total_time_waited
+            )
+            return True
+        if job.errorint > -1 and job.errorint not in WAIT_RETRY_ERRORS:
+            # Retry only on 602 NO_ANSWER_YET or failed requests - step out of loop if any other error happens
+            logger.info(logger_prefix + "Error happened --> Giving up")
+            return True
+        elif server_says_try_again == 0 and job.errorint not in (606, 607):
+            # Responses of failed requests never contain try_again
+            logger.info(logger_prefix + "Server does not want us to try again --> Stopping")
+            return True
+        return False
+
+    def _waitTimedOut(self, job):
+        logger.info("[sleepAndGetResult] Time expired! Failed to find result!")
+        if job.uploaded_at is not None and time.time() > job.uploaded_at + job.maxtimeout:
+            # Expired on the server too, it will not be charged anymore
+            self._refundCredits(job)
+        if self.prio_controller is not None and job.errorint != 600:
+            # 600 has been recorded already
+            self.prio_controller.observe(job)
+        self._setError(job, 601, "ERROR_INTERNAL_TIMEOUT")
+        self._saveJob(job, JobStore.FAILED)
+        return None, job.errorint, job.errormsg
+
+    def sleepAndGetResult(self, custom_timeout=None, job=None):
+        """Wait until the Captcha is solved and return result. The time between polls is decided by the PollSchedule set via setPollSchedule."""
+        logger_prefix = "[sleepAndGetResult] "
+        job = self._currentJob(job)
+        if job.cached:
+            return job.answer, job.errorint, job.errormsg
+        total_timeout = self._getWaitTimeout(job, custom_timeout)
+        started = time.monotonic()
+        response = None
+        attempt = 0
+        while True:
+            delay = self._getPollDelay(
+                job, attempt, response, time.monotonic() - started, total_timeout
+            )
+            if delay is None:
+                break
+            time.sleep(delay)
+            attempt += 1
+            logger.debug(logger_prefix + "Wait-Loop %d", attempt)
+            result, response, erri, errm = self.getresult(job)
+            if self._checkWaitLoop(job, result, response, time.monotonic() - started):
+                if result is not None:
+                    return result, job.errorint, job.errormsg
+                break
+        return self._waitTimedOut(job)
+
+    def _buildResultData(self, job):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[getresult] Try to fetch the solved result from 9kw.eu...")
+        return {
+            "action": "usercaptchacorrectdata",
+            "id": job.captchaid,
+            "apikey": self.apikey,
+            "info": "1",
+            "source": API_SOURCE,
+            "json": "1",
+        }
+
+    def _handleResultResponse(self, job, response):
+        logger_prefix = "[getresult] "
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(response))
+        job.polls += 1
+        if self.metrics is not None:
+            self.metrics.onPoll(job)
+        self._setError(job, *self._parseError(response, True))
+        answer = response.get("answer", None)
+        nodata = response.get("nodata", -1)
+        thiscredits = response.get("credits", -1)
+        if thiscredits != -1:
+            # 2020-02-06: API might sometimes return this as a String although it is supposed to be a number
+            if isinstance(thiscredits, str):
+                thiscredits = int(thiscredits)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(logger_prefix + "Updated credits: %d" % thiscredits)
+            self._setCredits(thiscredits)
+        if nodata == 1:
+            logger.debug(logger_prefix + "No answer yet")
+            self._setError(job, 602, "NO_ANSWER_YET")
+            return None, response, job.errorint, job.errormsg
+        elif answer is not None and answer == "ERROR NO USER":
+            # Special: We need to set an error to make sure that our sleep handling would stop!
+            self._setError(job, 600, "ERROR_NO_USER")
+            self._refundCredits(job)
+            if self.prio_controller is not None:
+                self.prio_controller.observe(job)
+            self._saveJob(job, JobStore.FAILED)
+            logger.info(
+                logger_prefix
+                + "No users there to solve at this moment --> Or your timeout is too small OR you've aborted this captcha before"
+            )
+            return None, response, job.errorint, job.errormsg
+        elif job.errorint > -1:
+            logger.info(logger_prefix + "Error %d: %s", job.errorint, job.errormsg)
+            return None, response, job.errorint, job.errormsg
+        elif answer is None:
+            # Answer is not given but also we did not get any errormessage
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    logger_prefix
+                    + "[FAILURE] --> Failed to find answer --> Unknown failure"
+                )
+        else:
+            # Answer is given
+            job.answer = answer
+            if job.solved_at is None:
+                job.solved_at = time.time()
+                self.poll_schedule.observe(job)
+                if self.prio_controller is not None:
+                    self.prio_controller.observe(job)
+                if self.metrics is not None:
+                    self.metrics.onAnswer(job)
+                if self.ledger is not None:
+                    self.ledger.charge(
+                        job, thiscredits if thiscredits != -1 else None
+                    )
+                self._saveJob(job, JobStore.SOLVED)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(logger_prefix + "[SUCCESS]")
+                logger.debug(logger_prefix + "Captcha solved! String: '%s'" % answer)
+        return answer, response, job.errorint, job.errormsg
+
+    def getresult(
+        self, job=None
+    ) -> str:  # https://stackoverflow.com/questions/42127461/pycharm-function-doesnt-return-anything
+        """Get result from 9kw.eu. Use sleepAndGetResult for auto-wait handling! """
+        job = self._currentJob(job)
+        if job.cached:
+            return job.answer, {}, job.errorint, job.errormsg
+        return self._handleResultResponse(
+            job, self._apiRequest(self._buildResultData(job))
+        )
+
+    def captcha_correct(self, iscorrect, job=None):
+        """Send feedback, is the Captcha result correct or not?"""
+        logger_prefix = "[captcha_correct] "
+        if iscorrect:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    logger_prefix + "Sending POSITIVE captcha solved feedback ..."
+                )
+            feedback = 1
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    logger_prefix + "Sending NEGATIVE captcha solved feedback ..."
+                )
+            feedback = 2
+        return self.sendCaptchaFeedback(feedback, job)
+
+    def captcha_correct_abort(self, job=None):
+        """Send feedback, aborts the already sent captcha. If no answer is available yet, no credits will be used in this case!"""
+        return self.sendCaptchaFeedback(3, job)
+
+    def _buildFeedbackData(self, job, feedback_status):
+        """Returns the feedback parameters or None if there is no captcha to send feedback for."""
+        logger_prefix = "[sendCaptchaFeedback] "
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(logger_prefix + "Sending captcha feedback : %d" % feedback_status)
+        if job.cached:
+            # Answer did not come from 9kw --> Nothing to send
+            return None
+        if job.captchaid is None or job.captchaid == -1:
+            # This should only happen on wrong usage
+            logger.warning(
+                logger_prefix
+                + "Cannot send captcha feedback because captchaid is not given"
+            )
+            return None
+        return {
+            "action": "usercaptchacorrectback",
+            "correct": feedback_status,
+            "id": job.captchaid,
+            "apikey": self.apikey,
+            "source": API_SOURCE,
+            "json": "1",
+        }
+
+    def _applyFeedback(self, job, feedback_status):
+        """Updates cache, ledger and job store. Returns the feedback parameters to send right away or None if there is nothing to send
+        or the FeedbackDispatcher sends it."""
+        self._updateCache(job, feedback_status)
+        self._updateLedger(job, feedback_status)
+        self._saveJob(job, JobStore.ABORTED if feedback_status == 3 else JobStore.DONE)
+        getdata = self._buildFeedbackData(job, feedback_status)
+        if getdata is not None and self.feedback is not None:
+            if self.feedback.submit(job, feedback_status):
+                return None
+        return getdata
+
+    def _handleFeedbackResponse(self, job, feedback_status, response):
+        # Check for errors but do not handle them. If something does wrong here it is not so important!
+        self._setError(job, *self._parseError(response, True))
+        if feedback_status == 3:
+            job.abort_failed = job.errorint > -1
+        return job.errorint, job.errormsg
+
+    def _postFeedback(self, job, feedback_status):
+        """Sends the feedback request, also used by the FeedbackDispatcher."""
+        return self._handleFeedbackResponse(
+            job,
+            feedback_status,
+            self._apiRequest(self._buildFeedbackData(job, feedback_status)),
+        )
+
+    def sendCaptchaFeedback(self, feedback_status, job=None):
+        """Send feedback, is the Captcha result correct(=1) or not(=2) or does the user want to abort(=3)?
+        With a FeedbackDispatcher this returns (-1, None) right away and the feedback is sent in the background."""
+        job = self._currentJob(job)
+        getdata = self._applyFeedback(job, feedback_status)
+        if getdata is None:
+            # Nothing sent yet, the error of the job is still the one of its last poll
+            return -1, None
+        return self._handleFeedbackResponse(
+            job, feedback_status, self._apiRequest(getdata)
+        )
+
+    def _buildCreditsData(self):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[getcredits] Get available Credits...")
+        return {
+            "action": "usercaptchaguthaben",
+            "apikey": self.apikey,
+            "source": API_SOURCE,
+            "json": "1",
+        }
+
+    def _handleCreditsResponse(self, response):
+        logger_info = "[getcredits] "
+        errorint, errormsg = self.checkError(response, False)
+        if errorint > -1:
+            logger.warning(logger_info + "Error: %s", errormsg)
+            return None
+        usercredits = response.get("credits", -1)
+        if logger.isEnabledFor(logging.DEBUG):
+            cost_per_captcha = self.getCaptchaCost()
+            logger.debug(
+                logger_info
+                + "%d credits available | Cost per captcha (with current prio %d): %d | Enough to solve approximately %d captchas"
+                % (
+                    usercredits,
+                    self.prio,
+                    cost_per_captcha,
+                    (usercredits / cost_per_captcha),
+                )
+            )
+        self._setCredits(usercredits)
+        if self.ledger is not None:
+            self.ledger.update(usercredits)
+        return usercredits, errorint, errormsg
+
+    def getcredits(self):
+        """Get aviable Credits..."""
+        return self._handleCreditsResponse(self._apiRequest(self._buildCreditsData()))
+
+    def solve(self, imagedata, store_image_path=None, maxtimeout=None, prio=None):
+        """Uploads the given captcha and waits for its result. Returns the CaptchaJob: Its answer is None if solving failed."""
+        if self.hedge_policy is not None:
+            return self._solveHedged(imagedata, store_image_path, maxtimeout, prio)
+        job = self.uploadcaptcha(imagedata, store_image_path, maxtimeout, prio)
+        if job:
+            job.result()
+        return job
+
+    def _newHedgeEntry(self, job):
+        """Returns the _PollEntry to wait for the given job with."""
+        entry = _PollEntry(job, None, self._getWaitTimeout(job, None))
+        self._scheduleHedgePoll(entry, None)
+        return entry
+
+    def _scheduleHedgePoll(self, entry, response):
+        """Sets when the job of the given entry gets polled next. Returns False if its time is up."""
+        delay = self._getPollDelay(
+            entry.job,
+            entry.attempt,
+            response,
+            time.monotonic() - entry.started,
+            entry.total_timeout,
+        )
+        if delay is None:
+            self._waitTimedOut(entry.job)
+            return False
+        entry.due = time.monotonic() + delay
+        return True
+
+    def _hedgePolled(self, entry, response):
+        """Returns True if the job of the given entry has to be polled again."""
+        job = entry.job
+        entry.attempt += 1
+        if job.errorint > -1 and job.errorint not in WAIT_RETRY_ERRORS:
+            return False
+        if response.get("try_again", False) == 0 and job.errorint not in (606, 607):
+            self._waitTimedOut(job)
+            return False
+        return self._scheduleHedgePoll(entry, response)
+
+    def _hedgeSleep(self, entries, hedge_at):
+        wakeup = min([entry.due for entry in entries] + [hedge_at])
+        return max(0, wakeup - time.monotonic())
+
+    def _hedgeUploaded(self, job, hedge, entries):
+        """Returns the hedge if it got answered right away, adds it to entries if it has to be polled. Sets hedge to None if it is no new captcha."""
+        if not hedge or (hedge.captchaid == job.captchaid and not hedge.cached):
+            # Upload failed or the API returned the same captcha again
+            return None, None
+        if hedge.cached:
+            return hedge, hedge
+        entries.append(self._newHedgeEntry(hedge))
+        return hedge, None
+
+    def _hedgeDownloadFailed(self, maxtimeout, prio, errorint, errormsg):
+        """Returns the job for a hedged solve whose image could not be downloaded."""
+        job = self._prepareUpload(maxtimeout, prio)
+        self._setError(job, errorint, errormsg)
+        return job
+
+    def _hedgeDone(self, job, hedge, winner, entries):
+        """Returns the job to return from solve and the jobs which are still waiting and have to be aborted."""
+        if winner is None:
+            return job, []
+        self.job = winner
+        self.captchaid = winner.captchaid
+        return winner, [entry.job for entry in entries if entry.job is not winner]
+
+    def _solveHedged(self, imagedata, store_image_path, maxtimeout, prio):
+        """solve() with HedgePolicy: Polls the captcha and its hedge until the first answer arrives."""
+        logger_prefix = "[solve] "
+        policy = self.hedge_policy
+        if isinstance(imagedata, str) and _isUrl(imagedata):
+            # Downloaded once, the hedge uploads the same bytes
+            imagedata, erri, errm = self.getCaptchaImageFromWebsite(
+                imagedata, store_image_path
+            )
+            if erri > -1:
+                return self._hedgeDownloadFailed(maxtimeout, prio, erri, errm)
+        elif not isinstance(imagedata, str):
+            # Streams can only be read once but the hedge needs the image again
+            imagedata = loadImage(imagedata)
+        job = self.uploadcaptcha(imagedata, store_image_path, maxtimeout, prio)
+        if not job or job.cached:
+            return job
+        entries = [self._newHedgeEntry(job)]
+        hedge = winner = None
+        hedge_at = time.monotonic() + policy.getDelay(job)
+        while entries and winner is None:
+            time.sleep(self._hedgeSleep(entries, hedge_at))
+            if time.monotonic() >= hedge_at:
+                hedge_at = float("inf")
+                logger.info(
+                    logger_prefix + "No answer for captcha %d yet --> Hedging",
+                    job.captchaid,
+                )
+                hedge, winner = self._hedgeUploaded(
+                    job,
+                    self.uploadcaptcha(
+                        imagedata, None, job.maxtimeout, policy.getPrio(job), True
+                    ),
+                    entries,
+                )
+                if winner is not None:
+                    break
+            for entry in list(entries):
+                if entry.due > time.monotonic():
+                    continue
+                result, response, erri, errm = self.getresult(entry.job)
+                if result is not None:
+                    winner = entry.job
+                    break
+                if not self._hedgePolled(entry, response):
+                    entries.remove(entry)
+        result, losers = self._hedgeDone(job, hedge, winner, entries)
+        charged = []
+        for loser in losers:
+            self.captcha_correct_abort(loser)
+            if loser.solved_at is not None or loser.abort_failed:
+                charged.append(loser)
+        policy.observe(job, hedge, winner, charged)
+        return result
+
+
+class ResultPoller:
+    """Waits for the results of many captchas at the same time: One scheduler thread keeps all outstanding jobs ordered by their next poll time
+    and a few worker threads poll the ones which are due. Works with jobs of any (sync) Py9kw instance."""
+
+    def __init__(self, workers=4, poll_schedule=None):
+        """poll_schedule overrides the PollSchedule of the instances the jobs belong to."""
+        self.poll_schedule = poll_schedule
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix="py9kw-poller"
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="py9kw-poller-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, job, callback=None, custom_timeout=None):
+        """Starts waiting for the result of the given job. Returns a concurrent.futures.Future which resolves to the job once it got an answer
+        or a final error (e.g. 600 ERROR_NO_USER or 601 ERROR_INTERNAL_TIMEOUT). callback gets called with that future."""
+        future = concurrent.futures.Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        entry = _PollEntry(
+            job, future, job.client._getWaitTimeout(job, custom_timeout)
+        )
+        self._schedule(entry, None)
+        return future
+
+    def _schedule(self, entry, response):
+        delay = entry.job.client._getPollDelay(
+            entry.job,
+            entry.attempt,
+            response,
+            time.monotonic() - entry.started,
+            entry.total_timeout,
+            self.poll_schedule,
+        )
+        if delay is None:
+            entry.job.client._waitTimedOut(entry.job)
+            entry.future.set_result(entry.job)
+            return
+        with self._cond:
+            if self._closed:
+                entry.future.cancel()
+                return
+            heapq.heappush(
+                self._heap, (time.monotonic() + delay, next(self._counter), entry)
+            )
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (
+                    not self._heap or self._heap[0][0] > time.monotonic()
+                ):
+                    self._cond.wait(
+                        self._heap[0][0] - time.monotonic() if self._heap else None
+                    )
+                if self._closed:
+                    return
+                due, _, entry = heapq.heappop(self._heap)
+            self._executor.submit(self._poll, entry)
+
+    def _poll(self, entry):
+        job = entry.job
+        if entry.future.cancelled():
+            return
+        unsolved = job.solved_at is None
+        try:
+            result, response, erri, errm = job.client.getresult(job)
+        except Exception as e:
+            entry.future.set_exception(e)
+            return
+        entry.attempt += 1
+        if (
+            result is not None
+            and unsolved
+            and self.poll_schedule is not None
+            and self.poll_schedule is not job.client.poll_schedule
+        ):
+            # getresult only teaches the PollSchedule of the instance
+            self.poll_schedule.observe(job)
+        if result is not None or (
+            job.errorint > -1 and job.errorint not in WAIT_RETRY_ERRORS
+        ):
+            entry.future.set_result(job)
+        elif response.get("try_again", False) == 0 and job.errorint not in (606, 607):
+            job.client._waitTimedOut(job)
+            entry.future.set_result(job)
+        else:
+            self._schedule(entry, response)
+
+    def getPending(self):
+        """Returns the number of jobs which are waiting for their next poll."""
+        with self._cond:
+            return len(self._heap)
+
+    def close(self):
+        """Stops polling. Futures of jobs which are still waiting get cancelled."""
+        with self._cond:
+            self._closed = True
+            pending, self._heap = self._heap, []
+            self._cond.notify()
+        for due, _, entry in pending:
+            entry.future.cancel()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _PollEntry:
+    def __init__(self, job, future, total_timeout):
+        self.job = job
+        self.future = future
+        self.total_timeout = total_timeout
+        self.started = time.monotonic()
+        self.attempt = 0
+        self.due = self.started
+
+
+class KeyPool:
+    """Spreads uploads over Py9kw instances of several apikeys by remaining credits, error rate and captchas in flight, draining keys which fail."""
+
+    # API key unknown/invalid/deactivated, no user, balance insufficient and NOT_ENOUGH_CREDITS/BUDGET_EXHAUSTED of this lib
+    DRAIN_ERRORS = (1, 2, 3, 4, 5, 11, 604, 605)
+
+    def __init__(self, clients, drain_seconds=300, window=50):
+        self.drain_seconds = drain_seconds
+        self._keys = [_PoolKey(client, window) for client in clients]
+        self._lock = threading.Lock()
+
+    def _getRemaining(self, client):
+        if client.ledger is not None:
+            available = client.ledger.getAvailable()
+            if available is not None:
+                return available
+        return client.credits if client.credits > -1 else None
+
+    def _choose(self, tried):
+        """Returns the _PoolKey for the next upload or None if all keys are drained or have been tried."""
+        now = time.monotonic()
+        with self._lock:
+            keys = [
+                key
+                for key in self._keys
+                if key not in tried and key.drained_until <= now
+            ]
+            if not keys:
+                return None
+            remaining = [self._getRemaining(key.client) for key in keys]
+            known = [credits for credits in remaining if credits is not None]
+            # Keys with unknown credits count as average ones
+            default = sum(known) / len(known) if known else 1
+            best = max(
+                zip(keys, remaining),
+                key=lambda item: (
+                    max(default if item[1] is None else item[1], 0)
+                    * (1 - item[0].getErrorRate())
+                    / (1 + item[0].getInFlight())
+                ),
+            )[0]
+            best.uploading += 1
+            return best
+
+    def _uploaded(self, key, job):
+        """Records the outcome of one upload. Returns True if the key got drained and the upload should be tried with another key."""
+        with self._lock:
+            key.uploading -= 1
+            key.outcomes.append(not job)
+            if job:
+                key.jobs.append(job)
+                return False
+            if job.errorint not in self.DRAIN_ERRORS:
+                return False
+            logger.warning(
+                "[KeyPool] Draining apikey %s...: Error %d: %s",
+                key.client.apikey[:4],
+                job.errorint,
+                job.errormsg,
+            )
+            key.drained_until = time.monotonic() + self.drain_seconds
+            if key.client.ledger is not None:
+                key.client.ledger.requestReconcile()
+            return True
+
+    def _noKeyAvailable(self, maxtimeout, prio):
+        logger.warning("[KeyPool] No apikey available")
+        job = self._keys[0].client._prepareUpload(maxtimeout, prio)
+        self._keys[0].client._setError(job, 608, "NO_APIKEY_AVAILABLE")
+        return job
+
+    def uploadcaptcha(
+        self, imagedata, store_image_path=None, maxtimeout=None, prio=None
+    ):
+        """Uploads the captcha with the best key, see Py9kw.uploadcaptcha. Fails with 608 NO_APIKEY_AVAILABLE if all keys are drained."""
+        if not isinstance(imagedata, str):
+            # Streams can only be read once but the upload may be tried with other keys
+            imagedata = loadImage(imagedata)
+        tried = []
+        while True:
+            key = self._choose(tried)
+            if key is None:
+                return self._noKeyAvailable(maxtimeout, prio)
+            try:
+                job = key.client.uploadcaptcha(
+                    imagedata, store_image_path, maxtimeout, prio
+                )
+            except BaseException:
+                with self._lock:
+                    key.uploading -= 1
+                raise
+            if not self._uploaded(key, job):
+                return job
+            tried.append(key)
+
+    def solve(self, imagedata, store_image_path=None, maxtimeout=None, prio=None):
+        """Uploads the captcha with the best key and waits for its result, see Py9kw.solve."""
+        job = self.uploadcaptcha(imagedata, store_image_path, maxtimeout, prio)
+        if job:
+            job.result()
+        return job
+
+    def getStats(self):
+        """Returns per apikey the remaining credits, upload error rate, captchas in flight and whether it is drained."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key.client.apikey: {
+                    "credits": self._getRemaining(key.client),
+                    "error_rate": key.getErrorRate(),
+                    "in_flight": key.getInFlight(),
+                    "drained": key.drained_until > now,
+                }
+                for key in self._keys
+            }
+
+
+class _PoolKey:
+    def __init__(self, client, window):
+        self.client = client
+        self.jobs = []
+        self.uploading = 0
+        # True for every failed upload
+        self.outcomes = collections.deque(maxlen=window)
+        self.drained_until = 0
+
+    def getErrorRate(self):
+        if not self.outcomes:
+            return 0.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def getInFlight(self):
+        """Returns the number of captchas which are uploading or waiting for an answer."""
+        now = time.time()
+        self.jobs = [
+            job
+            for job in self.jobs
+            if job.answer is None
+            and job.errorint in WAIT_RETRY_ERRORS + (-1,)
+            and now < job.uploaded_at + job.maxtimeout + PARAM_WAIT_EXTRA_SECONDS
+        ]
+        return len(self.jobs) + self.uploading
+
+
+class AsyncKeyPool(KeyPool):
+    """KeyPool of AsyncPy9kw instances: uploadcaptcha and solve are coroutines."""
+
+    async def uploadcaptcha(
+        self, imagedata, store_image_path=None, maxtimeout=None, prio=None
+    ):
+        if not isinstance(imagedata, str):
+            imagedata = loadImage(imagedata)
+        tried = []
+        while True:
+            key = self._choose(tried)
+            if key is None:
+                return self._noKeyAvailable(maxtimeout, prio)
+            try:
+                job = await key.client.uploadcaptcha(
+                    imagedata, store_image_path, maxtimeout, prio
+                )
+            except BaseException:
+                with self._lock:
+                    key.uploading -= 1
+                raise
+            if not self._uploaded(key, job):
+                return job
+            tried.append(key)
+
+    async def solve(
+        self, imagedata, store_image_path=None, maxtimeout=None, prio=None
+    ):
+        job = await self.uploadcaptcha(imagedata, store_image_path, maxtimeout, prio)
+        if job:
+            await job.result()
+        return job
+
+
+class JobStore:
+    """Records every uploaded captcha in a SQLite database so that it survives restarts and worker processes can share polling via leases, see pollDue."""
+
+    WAITING = "waiting"
+    SOLVED = "solved"
+    FAILED = "failed"
+    ABORTED = "aborted"
+    # Feedback has been sent
+    DONE = "done"
+
+    def __init__(self, path, lease=60, worker=None):
+        self.lease = lease
+        self.worker = (
+            worker
+            if worker is not None
+            else "%s:%d" % (socket.gethostname(), os.getpid())
+        )
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (captchaid INTEGER PRIMARY KEY, apikey TEXT NOT NULL, state TEXT NOT NULL, "
+                "prio INTEGER NOT NULL, maxtimeout INTEGER NOT NULL, params TEXT, uploaded_at REAL, due REAL NOT NULL, "
+                "polls INTEGER NOT NULL, owner TEXT, lease_until REAL, answer TEXT, errorint INTEGER, errormsg TEXT)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, due)"
+            )
+
+    def save(self, job, state):
+        """Stores the current state of the given job and releases its lease."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (captchaid, apikey, state, prio, maxtimeout, params, uploaded_at, due, polls, answer, errorint, errormsg) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (captchaid) DO UPDATE SET state = excluded.state, "
+                "polls = excluded.polls, owner = NULL, lease_until = NULL, answer = excluded.answer, "
+                "errorint = excluded.errorint, errormsg = excluded.errormsg",
+                (
+                    job.captchaid,
+                    job.client.apikey,
+                    state,
+                    job.prio,
+                    job.maxtimeout,
+                    json.dumps(job.params) if job.params else None,
+                    job.uploaded_at,
+                    time.time(),
+                    job.polls,
+                    job.answer,
+                    job.errorint,
+                    job.errormsg,
+                ),
+            )
+
+    def _loadJob(self, client, row):
+        captchaid, prio, maxtimeout, params, uploaded_at, polls, answer, errorint, errormsg = row
+        job = CaptchaJob(client, captchaid, maxtimeout, prio)
+        job.params = json.loads(params) if params else None
+        job.uploaded_at = uploaded_at
+        job.polls = polls
+        job.answer = answer
+        job.setError(errorint, errormsg)
+        return job
+
+    def getJobs(self, client, state=WAITING):
+        """Returns CaptchaJobs of the apikey of the given client in the given state."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT captchaid, prio, maxtimeout, params, uploaded_at, polls, answer, errorint, errormsg FROM jobs "
+                "WHERE apikey = ? AND state = ? ORDER BY captchaid",
+                (client.apikey, state),
+            ).fetchall()
+        return [self._loadJob(client, row) for row in rows]
+
+    def getCounts(self):
+        """Returns the number of captchas per state."""
+        with self._lock:
+            return dict(
+                self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+            )
+
+    def claim(self, client, limit=10):
+        """Leases up to limit captchas of the apikey of the given client which are due to be polled to this worker and returns them as CaptchaJobs."""
+        now = time.time()
+        jobs = []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT captchaid, prio, maxtimeout, params, uploaded_at, polls, answer, errorint, errormsg FROM jobs "
+                "WHERE apikey = ? AND state = ? AND due <= ? AND (lease_until IS NULL OR lease_until < ?) ORDER BY due LIMIT ?",
+                (client.apikey, self.WAITING, now, now, limit),
+            ).fetchall()
+            for row in rows:
+                with self._db:
+                    # Another worker may have claimed it in the meantime
+                    claimed = self._db.execute(
+                        "UPDATE jobs SET owner = ?, lease_until = ? WHERE captchaid = ? AND state = ? AND (lease_until IS NULL OR lease_until < ?)",
+                        (self.worker, now + self.lease, row[0], self.WAITING, now),
+                    ).rowcount
+                if claimed:
+                    jobs.append(self._loadJob(client, row))
+        return jobs
+
+    def reschedule(self, job, delay):
+        """Releases the lease of the given job which is due to be polled again in delay seconds."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET due = ?, polls = ?, owner = NULL, lease_until = NULL WHERE captchaid = ?",
+                (time.time() + delay, job.polls, job.captchaid),
+            )
+
+    def pollDue(self, client, limit=10):
+        """Polls the captchas which are due once. Returns the jobs which got an answer or a final error."""
+        finished = []
+        for job in self.claim(client, limit):
+            result, response, erri, errm = client.getresult(job)
+            if result is None and job.errorint in WAIT_RETRY_ERRORS:
+                delay = client._getPollDelay(
+                    job,
+                    job.polls,
+                    response,
+                    time.time() - job.uploaded_at,
+                    client._getWaitTimeout(job, None),
+                )
+                if delay is not None and (
+                    response.get("try_again", False) != 0 or job.errorint in (606, 607)
+                ):
+                    self.reschedule(job, delay)
+                    continue
+                client._waitTimedOut(job)
+            elif result is None and job.errorint != 600:
+                # Any other error e.g. captcha not found
+                self.save(job, self.FAILED)
+            finished.append(job)
+        return finished
+
+    def resume(self, client):
+        """Makes all waiting captchas of the apikey of the given client due now, e.g. after a restart. Returns their number."""
+        with self._lock, self._db:
+            return self._db.execute(
+                "UPDATE jobs SET due = ?, owner = NULL, lease_until = NULL WHERE apikey = ? AND state = ?",
+                (time.time(), client.apikey, self.WAITING),
+            ).rowcount
+
+    def abortWaiting(self, client):
+        """Aborts all waiting captchas of the apikey of the given client so that they cost no credits. Returns their number."""
+        jobs = self.getJobs(client, self.WAITING)
+        for job in jobs:
+            client.captcha_correct_abort(job)
+        return len(jobs)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class FeedbackDispatcher:
+    """Sends captcha feedback in the background so that captcha_correct and captcha_correct_abort return right away, see Py9kw.setFeedbackDispatcher.
+    Feedback is queued per captcha: A newer verdict for a captcha whose feedback has not been sent yet replaces the older one.
+    Requests failing with 606 API_REQUEST_FAILED or 607 CIRCUIT_OPEN are sent again according to retry_policy by one of the worker threads.
+    With path the queue is also kept in a SQLite database, feedback not sent before close() or a crash gets sent after resume()."""
+
+    def __init__(self, workers=2, retry_policy=None, path=None):
+        self.retry_policy = (
+            retry_policy
+            if retry_policy is not None
+            else RetryPolicy(attempts=10, base=5, cap=300)
+        )
+        self._pending = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._busy = 0
+        self._closed = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS feedback (apikey TEXT NOT NULL, captchaid INTEGER NOT NULL, "
+                    "status INTEGER NOT NULL, PRIMARY KEY (apikey, captchaid))"
+                )
+        self._start(workers)
+
+    def _start(self, workers):
+        self._threads = [
+            threading.Thread(
+                target=self._run, name="py9kw-feedback-%d" % i, daemon=True
+            )
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _notify(self):
+        self._cond.notify_all()
+
+    def _queue(self, entry):
+        """Must be called with the lock held."""
+        heapq.heappush(self._heap, (entry.due, next(self._counter), entry.key, entry))
+        self._pending[entry.key] = entry
+        self._notify()
+
+    def submit(self, job, feedback_status):
+        """Queues feedback 1 (correct), 2 (wrong) or 3 (abort) for the given job. Returns False if this dispatcher is closed already."""
+        entry = _FeedbackEntry(job, feedback_status)
+        with self._cond:
+            if self._closed:
+                return False
+            self.submitted += 1
+            if entry.key in self._pending:
+                self.coalesced += 1
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO feedback (apikey, captchaid, status) VALUES (?, ?, ?)",
+                        entry.key + (feedback_status,),
+                    )
+            self._queue(entry)
+        return True
+
+    def resume(self, client):
+        """Queues the feedback stored for the apikey of the given client by an earlier run. Returns its number."""
+        if self._db is None:
+            return 0
+        count = 0
+        with self._cond:
+            rows = self._db.execute(
+                "SELECT captchaid, status FROM feedback WHERE apikey = ?",
+                (client.apikey,),
+            ).fetchall()
+            for captchaid, feedback_status in rows:
+                entry = _FeedbackEntry(CaptchaJob(client, captchaid), feedback_status)
+                if entry.key not in self._pending:
+                    self._queue(entry)
+                    count += 1
+        return count
+
+    def _takeDue(self):
+        """Returns (entry, None) for the next feedback to send or (None, seconds until the next one is due). Must be called with the lock held."""
+        while self._heap:
+            due, _, key, entry = self._heap[0]
+            if self._pending.get(key) is not entry:
+                # Replaced by a newer verdict
+                heapq.heappop(self._heap)
+                continue
+            wait = due - time.monotonic()
+            if wait > 0:
+                return None, wait
+            heapq.heappop(self._heap)
+            del self._pending[key]
+            self._busy += 1
+            return entry, None
+        return None, None
+
+    def _finished(self, entry, errorint, errormsg):
+        """Evaluates one sent feedback. Must be called with the lock held."""
+        self._busy -= 1
+        retry = errorint in (606, 607)
+        if errorint == -1:
+            self.sent += 1
+        elif not retry:
+            # Rejected by the API e.g. unknown captcha --> Sending it again does not help
+            self.failed += 1
+            logger.warning(
+                "[FeedbackDispatcher] Feedback for captcha %d failed: %d %s",
+                entry.job.captchaid,
+                errorint,
+                errormsg,
+            )
+        if entry.key in self._pending:
+            # A newer verdict for the same captcha is queued already and replaces this one
+            self._notify()
+            return
+        if retry:
+            delay = self.retry_policy.getDelay(entry.attempt, entry.delay, None)
+            if delay is not None:
+                entry.attempt += 1
+                entry.delay = delay
+                entry.due = time.monotonic() + delay
+                self.retried += 1
+                self._queue(entry)
+                return
+            self.failed += 1
+            logger.warning(
+                "[FeedbackDispatcher] Giving up feedback for captcha %d: %s",
+                entry.job.captchaid,
+                errormsg,
+            )
+            if self._db is not None:
+                # Stays in the database until resume()
+                self._notify()
+                return
+        if self._db is not None:
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM feedback WHERE apikey = ? AND captchaid = ?",
+                    entry.key,
+                )
+        self._notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    entry, wait = self._takeDue()
+                    if entry is not None:
+                        break
+                    self._cond.wait(wait)
+            try:
+                errorint, errormsg = entry.job.client._postFeedback(
+                    entry.job, entry.status
+                )
+            except Exception as e:
+                logger.exception("[FeedbackDispatcher] Sending feedback failed")
+                errorint, errormsg = 606, str(e)
+            with self._cond:
+                self._finished(entry, errorint, errormsg)
+
+    def getPending(self):
+        """Returns the number of feedbacks which are queued or being sent."""
+        with self._cond:
+            return len(self._pending) + self._busy
+
+    def getStats(self):
+        """Returns how many feedbacks were submitted, replaced by a newer verdict, sent, sent again and given up."""
+        with self._cond:
+            return {
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "pending": len(self._pending) + self._busy,
+            }
+
+    def flush(self, timeout=None):
+        """Waits until all queued feedback has been sent. Returns False if that takes longer than timeout seconds."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._busy, timeout
             )
 
-    def resetSolver(self):
-        """ Call this to reset all runtime values if you e.g. want to re-use a previously created solver instance while keeping your settings (prio, maxtimeout and so on).  """
-        self.captchaid = -1
-        return
+    def _stop(self):
+        with self._cond:
+            self._closed = True
+            left = len(self._pending)
+            self._notify()
+        if left:
+            logger.warning(
+                "[FeedbackDispatcher] %d feedbacks not sent%s",
+                left,
+                " --> Kept in database" if self._db is not None else "",
+            )
 
-    # Checks for errors in json response and returns error_code(int) and error_message(String) separated as API returns them both in one String.
-    def checkError(self, response, showStatus):
-        error_plain = response.get("error", None)
-        if error_plain is not None:
-            # Error found
-            if self.verbose or showStatus:
-                printInfo("[checkError] Found error: Plain error: %s" % error_plain)
+    def close(self, timeout=30):
+        """Sends the queued feedback for at most timeout seconds and stops the workers."""
+        self.flush(timeout)
+        self._stop()
+        for thread in self._threads:
+            thread.join()
+        if self._db is not None:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _FeedbackEntry:
+    def __init__(self, job, status):
+        self.job = job
+        self.status = status
+        self.key = (job.client.apikey, job.captchaid)
+        self.due = time.monotonic()
+        self.attempt = 0
+        self.delay = None
+
+
+class AsyncFeedbackDispatcher(FeedbackDispatcher):
+    """FeedbackDispatcher for AsyncPy9kw: Feedback is sent by worker tasks of the event loop which calls submit first.
+    flush and close are coroutines."""
+
+    def _start(self, workers):
+        self._workers = workers
+        self._tasks = []
+        self._changed = None
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    def _queue(self, entry):
+        if not self._tasks:
+            self._changed = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            self._tasks = [
+                loop.create_task(self._runAsync()) for i in range(self._workers)
+            ]
+        super()._queue(entry)
+
+    async def _wait(self, timeout):
+        """Waits until something changed or timeout seconds passed."""
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _runAsync(self):
+        while True:
+            if self._closed:
+                return
+            with self._cond:
+                entry, wait = self._takeDue()
+            if entry is None:
+                await self._wait(wait)
+                continue
             try:
-                error_MatchObject = re.compile(r"^(\d{4}) (.+)").search(error_plain)
-                self.errorint = int(error_MatchObject.group(1))
-                self.errormsg = error_MatchObject.group(2)
-                if self.verbose or showStatus:
-                    printInfo(
-                        "[checkError] Found error: Number: %d | Message: %s"
-                        % (self.errorint, self.errormsg)
-                    )
-            except:
-                # This should never happen
-                self.errormsg = "Error while parsing error number and message"
-                self.errorint = 666
-                printInfo(self.errormsg)
+                errorint, errormsg = await entry.job.client._postFeedback(
+                    entry.job, entry.status
+                )
+            except Exception as e:
+                logger.exception("[FeedbackDispatcher] Sending feedback failed")
+                errorint, errormsg = 606, str(e)
+            with self._cond:
+                self._finished(entry, errorint, errormsg)
+
+    async def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.getPending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await self._wait(None if deadline is None else deadline - time.monotonic())
+        return True
+
+    async def close(self, timeout=30):
+        await self.flush(timeout)
+        self._stop()
+        await asyncio.gather(*self._tasks)
+        if self._db is not None:
+            self._db.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+async def _readAsyncHead(reader, url):
+    """Reads status line and headers of one HTTP/1.1 response from the given stream. Returns (status, reason, headers)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed by %s" % url)
+    match = re.match(rb"HTTP/\d\.\d (\d{3}) ?(.*)", status_line)
+    if match is None:
+        raise IOError("Invalid HTTP response from %s" % url)
+    status = int(match.group(1))
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return status, match.group(2).decode("latin-1").strip(), headers
+
+
+async def _readAsyncBody(
+    reader, headers, url, max_bytes=None, file=None, chunk_size=64 * 1024
+):
+    """Reads the body of the response whose headers are given. Every chunk is also written to file if given.
+    Raises urllib.error.URLError if the body is bigger than max_bytes."""
+    body = bytearray()
+
+    def append(chunk):
+        if max_bytes is not None and len(body) + len(chunk) > max_bytes:
+            raise urllib.error.URLError("%s is bigger than %d bytes" % (url, max_bytes))
+        body.extend(chunk)
+        if file is not None:
+            file.write(chunk)
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Skip trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            while size > 0:
+                chunk = await reader.readexactly(min(size, chunk_size))
+                append(chunk)
+                size -= len(chunk)
+            await reader.readline()
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        if max_bytes is not None and remaining > max_bytes:
+            raise urllib.error.URLError("%s is bigger than %d bytes" % (url, max_bytes))
+        while remaining > 0:
+            chunk = await reader.readexactly(min(remaining, chunk_size))
+            append(chunk)
+            remaining -= len(chunk)
+    else:
+        # Body ends when the server closes the connection
+        headers["connection"] = "close"
+        while True:
+            chunk = await reader.read(chunk_size)
+            if not chunk:
+                break
+            append(chunk)
+    return body
+
+
+class AsyncHTTPConnectionPool:
+    """asyncio version of HTTPConnectionPool. Must only be used from one event loop. Proxies are not supported."""
+
+    def __init__(self, maxsize=100, idle_timeout=30, timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context()
+        self._idle = {}
+
+    async def _getConnection(self, origin):
+        now = time.monotonic()
+        idle = self._idle.get(origin)
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if now - last_used <= self.idle_timeout and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = origin
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port, ssl=self.ssl_context if scheme == "https" else None
+            ),
+            self.timeout,
+        )
+        return reader, writer, False
+
+    def _releaseConnection(self, origin, reader, writer):
+        now = time.monotonic()
+        idle = self._idle.setdefault(origin, [])
+        while idle and now - idle[0][2] > self.idle_timeout:
+            idle.pop(0)[1].close()
+        if len(idle) < self.maxsize:
+            idle.append((reader, writer, now))
         else:
-            # No error found
-            if self.verbose or showStatus:
-                printInfo("[checkError] OK - NO ERROR")
-            # Reset error state
-            self.errorint = -1
-            self.errormsg = None
-        return self.errorint, self.errormsg
+            writer.close()
 
-    def getCaptchaCost(self):
-        """Returns how much credits it would cost to solve one captcha with the current settings."""
-        captcha_cost = PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA
-        if self.prio > 0:
-            captcha_cost += self.prio
-        return captcha_cost
+    async def _open(self, url, method, body, headers):
+        """Sends one request and returns (origin, reader, writer, status, reason, headers) once the response headers have been read."""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        origin = (parts.scheme, parts.hostname, port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        allheaders = {
+            "Host": parts.netloc,
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "identity",
+        }
+        if body is None:
+            body = []
+        elif not isinstance(body, list):
+            body = [body]
+        allheaders["Content-Length"] = str(sum(len(chunk) for chunk in body))
+        if headers is not None:
+            allheaders.update(headers)
+        head = "%s %s HTTP/1.1\r\n%s\r\n" % (
+            method,
+            target,
+            "".join("%s: %s\r\n" % item for item in allheaders.items()),
+        )
+        while True:
+            reader, writer, reused = await self._getConnection(origin)
+            try:
+                writer.write(head.encode("latin-1"))
+                for chunk in body:
+                    writer.write(chunk)
+                await writer.drain()
+                status, reason, respheaders = await _readAsyncHead(reader, url)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                # Server may have closed an idle keep-alive connection in the meantime --> Retry once on a new one
+                if reused:
+                    continue
+                if isinstance(e, OSError):
+                    raise
+                raise urllib.error.URLError(e)
+            except BaseException:
+                writer.close()
+                raise
+            return origin, reader, writer, status, reason, respheaders
 
-    def setPriority(self, prio):
-        if prio > PARAM_MAX_PRIO:
-            printInfo(
-                "Wished 'prio' value %d is higher than highest possible value %d --> Using highest value %d instead"
-                % (prio, PARAM_MAX_PRIO, PARAM_MAX_PRIO)
+    async def _read(
+        self,
+        url,
+        method="GET",
+        body=None,
+        headers=None,
+        max_bytes=None,
+        file=None,
+        max_redirects=None,
+    ):
+        """Sends one request and returns the response body. GET requests follow up to max_redirects redirects if given."""
+        redirects = 0
+        while True:
+            origin, reader, writer, status, reason, respheaders = await self._open(
+                url, method, body, headers
             )
-            self.prio = PARAM_MAX_PRIO
+            location = respheaders.get("location")
+            if max_redirects is None or status not in REDIRECT_STATUS or location is None:
+                break
+            # Body of the redirect is not needed --> Closing is cheaper than reading it
+            writer.close()
+            if redirects >= max_redirects:
+                raise urllib.error.URLError(
+                    "%s redirected more than %d times" % (url, max_redirects)
+                )
+            redirects += 1
+            url = urljoin(url, location)
+        try:
+            if status >= 400 and file is not None:
+                # Error page must not end up in the file
+                raise urllib.error.HTTPError(url, status, reason, respheaders, None)
+            data = await _readAsyncBody(reader, respheaders, url, max_bytes, file)
+        except asyncio.IncompleteReadError as e:
+            writer.close()
+            raise urllib.error.URLError(e)
+        except BaseException:
+            # Rest of the response is not read --> Connection cannot be reused
+            writer.close()
+            raise
+        if respheaders.get("connection", "").lower() == "close":
+            writer.close()
         else:
-            # Either user defined prio value or default
-            self.prio = prio
-        return
+            self._releaseConnection(origin, reader, writer)
+        if status >= 400:
+            raise urllib.error.HTTPError(url, status, reason, respheaders, None)
+        return data
 
-    def setAdditionalCaptchaUploadParams(self, uploaddata):
-        """ Use this to add extra captcha upload parameters such as: 'case-sensitive':'1'. Be sure to always use Strings! """
-        if uploaddata is not None:
-            self.extrauploaddata = uploaddata
-        return
+    async def request(self, url, method="GET", body=None, headers=None):
+        """Sends one request and returns the response body. Raises urllib.error.HTTPError on http error status."""
+        return bytes(
+            await asyncio.wait_for(self._read(url, method, body, headers), self.timeout)
+        )
 
-    def setTimeout(self, maxtimeout):
-        if maxtimeout < PARAM_MIN_MAXTIMEOUT:
-            printInfo(
-                "Wished 'maxtimeout' value %d is lower than lowest possible value %d --> Using lowest value %d instead"
-                % (maxtimeout, PARAM_MIN_MAXTIMEOUT, PARAM_MIN_MAXTIMEOUT)
-            )
-            maxtimeout = PARAM_MIN_MAXTIMEOUT
-        elif maxtimeout > PARAM_MAX_MAXTIMEOUT:
-            printInfo(
-                "Wished 'maxtimeout' value %d is higher than highest possible value %d --> Using highest value %d instead"
-                % (maxtimeout, PARAM_MAX_MAXTIMEOUT, PARAM_MAX_MAXTIMEOUT)
+    async def fetch(
+        self,
+        url,
+        max_bytes=None,
+        timeout=None,
+        file=None,
+        max_redirects=PARAM_MAX_REDIRECTS,
+    ):
+        """Downloads url chunk by chunk and returns the body as bytearray. Every chunk is also written to file if given.
+        Redirects are followed up to max_redirects times.
+        Raises urllib.error.URLError if the body is bigger than max_bytes and asyncio.TimeoutError after timeout seconds."""
+        return await asyncio.wait_for(
+            self._read(
+                url, max_bytes=max_bytes, file=file, max_redirects=max_redirects
+            ),
+            self.timeout if timeout is None else timeout,
+        )
+
+    def close(self):
+        """Closes all idle connections."""
+        for idle in self._idle.values():
+            for reader, writer, last_used in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncPy9kw(Py9kw):
+    """asyncio version of Py9kw: All API methods are coroutines and waiting for results does not block the event loop.
+    Settings, parameters and errorcodes are the same as in Py9kw."""
+
+    def __init__(
+        self, apikey, env_proxy=False, verbose=False, pool=None, api_base=API_BASE
+    ):
+        """Same as Py9kw but pool must be an AsyncHTTPConnectionPool."""
+        super().__init__(apikey, env_proxy, verbose, pool, api_base)
+        if self.proxy is not None:
+            logger.warning(
+                "[init] Warning: AsyncPy9kw does not support proxies, continuing without %s"
+                % self.proxy
             )
-            maxtimeout = PARAM_MAX_MAXTIMEOUT
-        self.maxtimeout = maxtimeout
-        return
 
-    def getCaptchaImageFromWebsite(self, image_url, image_path=None):
-        """ Returns (captcha) image file obtained from website. And optionally saves it to <image_path>. """
-        imagefile = None
+    def _createPool(self):
+        return AsyncHTTPConnectionPool()
+
+    async def _apiRequest(self, getdata, files=None):
+        action = getdata["action"]
+        attempt = 0
+        delay = None
+        while True:
+            if not self._requestAllowed():
+                return self._errorResponse(607, "CIRCUIT_OPEN")
+            if self.limiter is not None:
+                await self.limiter.acquireAsync(action)
+            request = self._buildRequest(getdata, files)
+            started = time.monotonic()
+            try:
+                response = json.loads(
+                    (await self.pool.request(*request)).decode("utf-8", "ignore")
+                )
+            except REQUEST_ERRORS as e:
+                delay = self._requestFailed(request, action, started, e, attempt, delay)
+                if delay is None:
+                    return self._errorResponse(606, "API_REQUEST_FAILED")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._requestSucceeded(request, action, started)
+            return response
+
+    async def getCaptchaImageFromWebsite(self, image_url, image_path=None):
+        """ Returns (captcha) image file obtained from website. And optionally saves it to <image_path> while downloading. """
+        file = None
         try:
-            imagefile = urllib.request.urlopen(image_url).read()
-            # Save file only if path is given
             if image_path is not None:
-                with open(image_path, "wb") as file:
-                    file.write(imagefile)
+                file = open(image_path, "wb")
+            imagefile = await self.pool.fetch(
+                image_url, self.max_image_bytes, self.download_timeout, file
+            )
+        except (IOError, asyncio.TimeoutError) as e:
+            if file is not None:
                 file.close()
+                with contextlib.suppress(OSError):
+                    os.remove(image_path)
+            return self._imageDownloadFailed()
+        if file is not None:
+            file.close()
+        return self._imageDownloaded(imagefile)
 
-            if self.verbose:
-                printInfo("[getCaptchaImageFromWebsite] [OK]")
-        except IOError as e:
-            printInfo("[getCaptchaImageFromWebsite] [FAIL]")
-            self.errorint = 603
-            self.errormsg = "CAPTCHA_DOWNLOAD_FAILURE"
-        return imagefile, self.errorint, self.errormsg
-
-    def uploadcaptcha(
-        self, imagedata, store_image_path=None, maxtimeout=None, prio=None
+    async def uploadcaptcha(
+        self, imagedata, store_image_path=None, maxtimeout=None, prio=None, nomd5=False
     ):
-        """Upload the Captcha to 9kw.eu (gif/jpg/png)."""
-        logger_prefix = "[uploadcaptcha] "
-        # Step 1: Set optional parameters and check if user has enough credits
-        if self.verbose:
-            printInfo(logger_prefix + "Attempting to upload captcha...")
-        if maxtimeout is not None:
-            self.setTimeout(maxtimeout)
-        if prio is not None:
-            self.setPriority(prio)
-        if self.credits > -1 and self.credits < PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA:
-            printInfo(logger_prefix + "Not enough credits to solve a captcha")
-            return None
-        # Step 2: Prepare image data we want to upload
-        # First check if we have an URL --> Download image first
-        if isinstance(imagedata, str) and validators.url(imagedata):
-            if self.verbose:
-                printInfo(logger_prefix + "Provided source is an URL: %s" % imagedata)
-            imagedata, erri, errm = self.getCaptchaImageFromWebsite(
+        """Upload the Captcha to 9kw.eu (gif/jpg/png). Returns a CaptchaJob which evaluates to False if the upload failed."""
+        job = self._prepareUpload(maxtimeout, prio)
+        job.nomd5 = nomd5
+        if isinstance(imagedata, str):
+            if not _isUrl(imagedata):
+                raise TypeError("Captcha image given as str must be an http(s) URL")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[uploadcaptcha] Provided source is an URL: %s" % imagedata)
+            imagedata, erri, errm = await self.getCaptchaImageFromWebsite(
                 imagedata, store_image_path
             )
-            if self.errorint > -1:
-                # Error during picture download
-                return self.captchaid, self.errorint, self.errormsg
+            if erri > -1:
+                self._setError(job, erri, errm)
+                return job
+        imagedata = loadImage(imagedata)
+        if self._checkCache(job, imagedata):
+            return job
+        if self.minimizer is not None:
+            # Re-encoding takes milliseconds of CPU --> Not in the event loop
+            imagedata = await asyncio.get_running_loop().run_in_executor(
+                None, self.minimizer.minimize, imagedata
+            )
+        if not await self._checkCredits(job):
+            return job
+        getdata, files = self._buildUploadData(job, imagedata)
         try:
-            if self.verbose:
-                printInfo(
-                    logger_prefix
-                    + "Check if the imagedata is already base64 encoded..."
-                )
-            if b64encode(b64decode(imagedata)) == imagedata:
-                if self.verbose:
-                    printInfo(logger_prefix + "YES, already encoded")
-                imagedata = imagedata
-            else:
-                if self.verbose:
-                    printInfo(logger_prefix + "NO, encoding it now")
-                imagedata = b64encode(imagedata)
-        except binascii.Error as e:
-            imagedata = b64encode(imagedata)
-        # Step 3: Prepare all other parameters we want to send
-        getdata = {
-            "action": "usercaptchaupload",
-            "apikey": self.apikey,
-            "file-upload-01": imagedata,
-            "base64": "1",
-            "maxtimeout": str(self.maxtimeout),
-            "source": API_SOURCE,
-            "json": "1"
-            # 			'selfsolve' : '1',	# For debugging, it's faster.
-            # 			'nomd5' : '1'		# always send a new imageid
-        }
-        if self.prio > 0:
-            prio_str = str(self.prio)
-            getdata["prio"] = prio
-            if self.verbose:
-                printInfo(logger_prefix + "Uploading captcha with prio %d" % self.prio)
-        else:
-            prio_str = "None"
-            if self.verbose:
-                printInfo(logger_prefix + "Uploading captcha without prio")
-        if self.extrauploaddata is not None:
-            if self.verbose:
-                getdata.update(self.extrauploaddata)
+            response = await self._apiRequest(getdata, files)
+        except:
+            self._refundCredits(job)
+            raise
+        return self._handleUploadResponse(job, response)
 
-        # Step 4: Send data and return captchaid
-        if self.verbose:
-            printInfo(
-                logger_prefix
-                + "Priority: %s of 10, Maxtimeout: %d of 3999s"
-                % (prio_str, self.maxtimeout)
-            )
-            printInfo(logger_prefix + "Upload %d bytes to 9kw.eu..." % len(imagedata))
-        json_plain = (
-            urllib.request.urlopen("%s?%s" % (API_BASE, urlencode(getdata)))
-            .read()
-            .decode("utf-8", "ignore")
-        )
-        if self.verbose:
-            printInfo(logger_prefix + "json debug: " + json_plain)
-        response = json.loads(json_plain)
-        self.checkError(response, True)
-        self.captchaid = int(response.get("captchaid", -1))
-        if self.errorint > -1 or self.captchaid == -1:
-            printInfo(logger_prefix + "Error ...")
-            return None
-        if self.verbose:
-            printInfo(logger_prefix + "[DONE]")
-        if self.verbose:
-            printInfo(logger_prefix + "Uploaded => Captcha-id: %d" % self.captchaid)
-        return self.captchaid, self.errorint, self.errormsg
-
-    def sleepAndGetResult(self, custom_timeout=None):
-        """Wait until the Captcha is solved and return result."""
+    async def _checkCredits(self, job):
+        """Like Py9kw._checkCredits but waits for credits of the CreditLedger without blocking the event loop."""
+        if self.ledger is None or self.ledger.wait_timeout <= 0:
+            return super()._checkCredits(job)
+        deadline = time.monotonic() + self.ledger.wait_timeout
+        while True:
+            errorint = self.ledger.reserve(job, 0)
+            remaining = deadline - time.monotonic()
+            if errorint == -1 or remaining <= 0:
+                return self._creditsReserved(job, errorint)
+            await asyncio.sleep(min(remaining, 0.5))
+
+    async def sleepAndGetResult(self, custom_timeout=None, job=None):
+        """Wait until the Captcha is solved and return result. The time between polls is decided by the PollSchedule set via setPollSchedule."""
         logger_prefix = "[sleepAndGetResult] "
-        wait_seconds_inbetween = 10
-        total_timeout = None
-        if custom_timeout is not None and custom_timeout >= PARAM_MIN_MAXTIMEOUT:
-            total_timeout = custom_timeout
-        else:
-            total_timeout = self.maxtimeout
-        total_timeout += wait_seconds_inbetween
-        if self.verbose:
-            printInfo(
-                logger_prefix
-                + "Waiting until the Captcha is solved or maxtimeout %d (includes %d extra seconds) has expired ..."
-                % (total_timeout, wait_seconds_inbetween)
-            )
-        total_time_waited = 0
-        maxloops = int(total_timeout / 10)
-        printInfo(logger_prefix + "Waiting for captcha result")
-        printInfo(
-            logger_prefix
-            + "Max. waittime: %s | Number of loops: %d" % (total_timeout, maxloops)
-        )
-        for i in range(maxloops):
-            printInfo(logger_prefix + "Wait-Loop %d / %d" % (i + 1, maxloops))
-            result, response, erri, errm = self.getresult()
-            server_says_try_again = response.get("try_again", False)
-            if result is not None:
-                # We've reached our goal :)
-                printInfo(
-                    logger_prefix
-                    + "Total seconds waited for result: %d" % total_time_waited
-                )
-                return result, self.errorint, self.errormsg
-            if self.errorint > -1 and self.errorint != 602:
-                # Retry only on 602 NO_ANSWER_YET - step out of loop if any other error happens
-                printInfo(logger_prefix + "Error happened --> Giving up")
+        job = self._currentJob(job)
+        if job.cached:
+            return job.answer, job.errorint, job.errormsg
+        total_timeout = self._getWaitTimeout(job, custom_timeout)
+        started = time.monotonic()
+        response = None
+        attempt = 0
+        while True:
+            delay = self._getPollDelay(
+                job, attempt, response, time.monotonic() - started, total_timeout
+            )
+            if delay is None:
                 break
-            elif server_says_try_again == 0:
-                printInfo(
-                    logger_prefix + "Server does not want us to try again --> Stopping"
-                )
+            await asyncio.sleep(delay)
+            attempt += 1
+            logger.debug(logger_prefix + "Wait-Loop %d", attempt)
+            result, response, erri, errm = await self.getresult(job)
+            if self._checkWaitLoop(job, result, response, time.monotonic() - started):
+                if result is not None:
+                    return result, job.errorint, job.errormsg
                 break
-            if self.verbose:
-                printInfo(logger_prefix + "Waiting %d seconds" % wait_seconds_inbetween)
-            time.sleep(wait_seconds_inbetween)
-            total_time_waited += wait_seconds_inbetween
-        printInfo(logger_prefix + "Time expired! Failed to find result!")
-        self.errorint = 601
-        self.errormsg = "ERROR_INTERNAL_TIMEOUT"
-        return None, self.errorint, self.errormsg
+        return self._waitTimedOut(job)
 
-    def getresult(
-        self
-    ) -> str:  # https://stackoverflow.com/questions/42127461/pycharm-function-doesnt-return-anything
+    async def getresult(self, job=None):
         """Get result from 9kw.eu. Use sleepAndGetResult for auto-wait handling! """
-        logger_prefix = "[getresult] "
-        answer = None
-        getdata = {
-            "action": "usercaptchacorrectdata",
-            "id": self.captchaid,
-            "apikey": self.apikey,
-            "info": "1",
-            "source": API_SOURCE,
-            "json": "1",
-        }
-        if self.verbose:
-            printInfo(logger_prefix + "Try to fetch the solved result from 9kw.eu...")
-        plain_json = (
-            urllib.request.urlopen("%s?%s" % (API_BASE, urlencode(getdata)))
-            .read()
-            .decode("utf-8", "ignore")
+        job = self._currentJob(job)
+        if job.cached:
+            return job.answer, {}, job.errorint, job.errormsg
+        return self._handleResultResponse(
+            job, await self._apiRequest(self._buildResultData(job))
         )
-        if self.verbose:
-            printInfo(plain_json)
-        response = json.loads(plain_json)
-        self.checkError(response, True)
-        answer = response.get("answer", None)
-        nodata = response.get("nodata", -1)
-        thiscredits = response.get("credits", -1)
-        if thiscredits != -1:
-            # 2020-02-06: API might sometimes return this as a String although it is supposed to be a number
-            if isinstance(thiscredits, str):
-                thiscredits = int(thiscredits)
-            if self.verbose:
-                print(logger_prefix + "Updated credits: %d" % thiscredits)
-            self.credits = thiscredits
-        if nodata == 1:
-            printInfo(logger_prefix + "No answer yet")
-            self.errorint = 602
-            self.errormsg = "NO_ANSWER_YET"
-            return None, response, self.errorint, self.errormsg
-        elif answer is not None and answer == "ERROR NO USER":
-            # Special: We need to set an error to make sure that our sleep handling would stop!
-            self.errorint = 600
-            self.errormsg = "ERROR_NO_USER"
-            printInfo(
-                logger_prefix
-                + "No users there to solve at this moment --> Or your timeout is too small OR you've aborted this captcha before"
-            )
-            return None, response, self.errorint, self.errormsg
-        elif self.errorint > -1:
-            printInfo(logger_prefix + "Error %d: %s" % (self.errorint, self.errormsg))
-            return None, response, self.errorint, self.errormsg
-        elif answer is None:
-            # Answer is not given but also we did not get any errormessage
-            if self.verbose:
-                printInfo(
-                    logger_prefix
-                    + "[FAILURE] --> Failed to find answer --> Unknown failure"
-                )
-        else:
-            # Answer is given
-            if self.verbose:
-                printInfo(logger_prefix + "[SUCCESS]")
-                printInfo(logger_prefix + "Captcha solved! String: '%s'" % answer)
-        return answer, response, self.errorint, self.errormsg
-
-    def captcha_correct(self, iscorrect):
-        """Send feedback, is the Captcha result correct or not?"""
-        logger_prefix = "[captcha_correct] "
-        if iscorrect:
-            if self.verbose:
-                printInfo(
-                    logger_prefix + "Sending POSITIVE captcha solved feedback ..."
-                )
-            feedback = 1
-        else:
-            if self.verbose:
-                printInfo(
-                    logger_prefix + "Sending NEGATIVE captcha solved feedback ..."
-                )
-            feedback = 2
-        return self.sendCaptchaFeedback(feedback)
 
-    def captcha_correct_abort(self):
-        """Send feedback, aborts the already sent captcha. If no answer is available yet, no credits will be used in this case!"""
-        return self.sendCaptchaFeedback(3)
+    async def _postFeedback(self, job, feedback_status):
+        return self._handleFeedbackResponse(
+            job,
+            feedback_status,
+            await self._apiRequest(self._buildFeedbackData(job, feedback_status)),
+        )
 
-    def sendCaptchaFeedback(self, feedback_status):
-        """Send feedback, is the Captcha result correct(=1) or not(=2) or does the user want to abort(=3)?"""
-        logger_prefix = "[sendCaptchaFeedback] "
-        if self.verbose:
-            printInfo(logger_prefix + "Sending captcha feedback : %d" % feedback_status)
-        if self.captchaid is None or self.captchaid == -1:
-            # This should only happen on wrong usage
-            printInfo(
-                logger_prefix
-                + "Cannot send captcha feedback because captchaid is not given"
-            )
-            return self.errorint, self.errormsg
-        getdata = {
-            "action": "usercaptchacorrectback",
-            "correct": feedback_status,
-            "id": self.captchaid,
-            "apikey": self.apikey,
-            "source": API_SOURCE,
-            "json": "1",
-        }
-        try:
-            response = json.loads(
-                urllib.request.urlopen("%s?%s" % (API_BASE, urlencode(getdata)))
-                .read()
-                .decode("utf-8", "ignore")
-            )
-            # Check for errors but do not handle them. If something does wrong here it is not so important!
-            self.checkError(response, True)
-        except:
-            printInfo(logger_prefix + "Error in captcha_correct")
-        return self.errorint, self.errormsg
+    async def sendCaptchaFeedback(self, feedback_status, job=None):
+        """Send feedback, is the Captcha result correct(=1) or not(=2) or does the user want to abort(=3)?
+        With an AsyncFeedbackDispatcher this returns (-1, None) right away and the feedback is sent in the background."""
+        job = self._currentJob(job)
+        getdata = self._applyFeedback(job, feedback_status)
+        if getdata is None:
+            # Nothing sent yet, the error of the job is still the one of its last poll
+            return -1, None
+        return self._handleFeedbackResponse(
+            job, feedback_status, await self._apiRequest(getdata)
+        )
 
-    def getcredits(self):
+    async def getcredits(self):
         """Get aviable Credits..."""
-        logger_info = "[getcredits] "
-        if self.verbose:
-            printInfo(logger_info + "Get available Credits...")
-        getdata = {
-            "action": "usercaptchaguthaben",
-            "apikey": self.apikey,
-            "source": API_SOURCE,
-            "json": "1",
-        }
-
-        response = json.loads(
-            urllib.request.urlopen("%s?%s" % (API_BASE, urlencode(getdata)))
-            .read()
-            .decode("utf-8", "ignore")
+        return self._handleCreditsResponse(
+            await self._apiRequest(self._buildCreditsData())
         )
-        self.checkError(response, False)
-        if self.errorint > -1:
-            printInfo(logger_info + "Error: %s" % self.errormsg)
-            return None
-        usercredits = response.get("credits", -1)
-        if self.verbose:
-            cost_per_captcha = self.getCaptchaCost()
-            printInfo(
-                logger_info
-                + "%d credits available | Cost per captcha (with current prio %d): %d | Enough to solve approximately %d captchas"
-                % (
-                    usercredits,
-                    self.prio,
-                    cost_per_captcha,
-                    (usercredits / cost_per_captcha),
-                )
-            )
-        self.credits = usercredits
-        return self.credits, self.errorint, self.errormsg
 
+    async def solve(
+        self, imagedata, store_image_path=None, maxtimeout=None, prio=None
+    ):
+        """Uploads the given captcha and waits for its result. Returns the CaptchaJob: Its answer is None if solving failed."""
+        if self.hedge_policy is not None:
+            return await self._solveHedged(
+                imagedata, store_image_path, maxtimeout, prio
+            )
+        job = await self.uploadcaptcha(imagedata, store_image_path, maxtimeout, prio)
+        if job:
+            await job.result()
+        return job
 
-if __name__ == "__main__":
-    from sys import argv
+    async def _solveHedged(self, imagedata, store_image_path, maxtimeout, prio):
+        logger_prefix = "[solve] "
+        policy = self.hedge_policy
+        if isinstance(imagedata, str) and _isUrl(imagedata):
+            imagedata, erri, errm = await self.getCaptchaImageFromWebsite(
+                imagedata, store_image_path
+            )
+            if erri > -1:
+                return self._hedgeDownloadFailed(maxtimeout, prio, erri, errm)
+        elif not isinstance(imagedata, str):
+            imagedata = loadImage(imagedata)
+        job = await self.uploadcaptcha(imagedata, store_image_path, maxtimeout, prio)
+        if not job or job.cached:
+            return job
+        entries = [self._newHedgeEntry(job)]
+        hedge = winner = None
+        hedge_at = time.monotonic() + policy.getDelay(job)
+        while entries and winner is None:
+            await asyncio.sleep(self._hedgeSleep(entries, hedge_at))
+            if time.monotonic() >= hedge_at:
+                hedge_at = float("inf")
+                logger.info(
+                    logger_prefix + "No answer for captcha %d yet --> Hedging",
+                    job.captchaid,
+                )
+                hedge, winner = self._hedgeUploaded(
+                    job,
+                    await self.uploadcaptcha(
+                        imagedata, None, job.maxtimeout, policy.getPrio(job), True
+                    ),
+                    entries,
+                )
+                if winner is not None:
+                    break
+            for entry in list(entries):
+                if entry.due > time.monotonic():
+                    continue
+                result, response, erri, errm = await self.getresult(entry.job)
+                if result is not None:
+                    winner = entry.job
+                    break
+                if not self._hedgePolled(entry, response):
+                    entries.remove(entry)
+        result, losers = self._hedgeDone(job, hedge, winner, entries)
+        charged = []
+        for loser in losers:
+            await self.captcha_correct_abort(loser)
+            if loser.solved_at is not None or loser.abort_failed:
+                charged.append(loser)
+        policy.observe(job, hedge, winner, charged)
+        return result
 
-    if len(argv) != 3:
-        printInfo("Usage: " + argv[0] + " <APIKEY> <TIME TO SOLVE>")
-        exit(0)
 
-    captchaSolver = Py9kw(argv[1], True, True)
+def _selftest(apikey, maxtimeout):
+    """Solves a sample captcha with the real 9kw API."""
+    captchaSolver = Py9kw(apikey, True, True)
     # Get a Sample-Captcha    image_data =
     sample_captcha_url = "https://confluence.atlassian.com/download/attachments/216957808/captcha.png?version=1&modificationDate=1272411042125&api=v2"
     test_image_data, erri, errm = captchaSolver.getCaptchaImageFromWebsite(
@@ -502,24 +3795,24 @@ if __name__ == "__main__":
     )
     if erri > -1:
         print("[py9kw-test] Captcha download failure")
-        exit(1)
+        return 1
 
     testcredits, erri, errm = captchaSolver.getcredits() or (None, None, None)
     if testcredits == None:
         print("[py9kw-test] Error: Invalid API-Key-Config!")
-        exit(1)
+        return 1
     if testcredits < PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA:
         print(
             "[py9kw-test] Not enough Credits! < %d"
             % PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA
         )
-        exit(0)
+        return 0
     print("[py9kw-test] Credits: {}".format(testcredits))
 
     # Upload it
     try:
         test_captchaid, erri, errm = captchaSolver.uploadcaptcha(
-            test_image_data, True, int(argv[2]), 10
+            test_image_data, True, maxtimeout, 10
         )
     except IOError as e:
         print("[py9kw-test] Error while uploading the Captcha!")
@@ -527,13 +3820,13 @@ if __name__ == "__main__":
             print("[py9kw-test]", e.args[0])
         else:
             print("[py9kw-test]", e.filename, ":", e.strerror, ".")
-        exit(1)
+        return 1
     # Sleep and get result
     result, erri, errm = captchaSolver.sleepAndGetResult()
     # Evaluate Result
     if result is None:
         printInfo("[py9kw-test] Error while getting the Result!")
-        exit(1)
+        return 1
     printInfo("[py9kw-test] String returned!")
     printInfo('[py9kw-test] Checking if the received string is "viearer"...')
     if result.lower() == "viearer":
@@ -545,4 +3838,212 @@ if __name__ == "__main__":
         printInfo("[py9kw-test] Returned String: %s" % result)
         captchaSolver.captcha_correct(False)
     printInfo("[py9kw-test] [!DONE!]")
-    exit(0)
+    return 0
+
+
+# Files in directories given to the batch command which get solved
+BATCH_IMAGE_EXTENSIONS = (".gif", ".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def _batchInputs(sources, stdin):
+    """Yields (id, image) for every captcha of the batch command. image is a path or an http(s) URL."""
+    for source in sources:
+        if source == "-":
+            for line in stdin:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    logger.warning("[batch] Skipping invalid JSON line: %s", line)
+                    continue
+                if isinstance(item, str):
+                    yield item, item
+                elif isinstance(item, dict):
+                    image = item.get("image") or item.get("url") or item.get("path")
+                    yield str(item.get("id", image)), image
+                else:
+                    logger.warning(
+                        "[batch] Skipping JSON line which is no string or object: %s",
+                        line,
+                    )
+        elif _isUrl(source):
+            yield source, source
+        elif os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                path = os.path.join(source, name)
+                if name.lower().endswith(BATCH_IMAGE_EXTENSIONS) and os.path.isfile(
+                    path
+                ):
+                    yield path, path
+        elif glob.has_magic(source):
+            for path in sorted(glob.glob(source, recursive=True)):
+                if os.path.isfile(path):
+                    yield path, path
+        else:
+            yield source, source
+
+
+def _batchDone(output):
+    """Returns the ids which already got an answer according to the given output file of an earlier run."""
+    done = set()
+    if output is None or not os.path.exists(output):
+        return done
+    with open(output) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line of an interrupted run may be incomplete
+                continue
+            if record.get("answer") is not None:
+                done.add(record["id"])
+    return done
+
+
+def _batchSolve(client, captcha_id, image, args):
+    """Solves one captcha of the batch command and returns its output record."""
+    started = time.monotonic()
+    job = None
+    try:
+        if not _isUrl(str(image)):
+            image = pathlib.Path(image)
+        job = client.solve(image, maxtimeout=args.timeout, prio=args.prio)
+    except (OSError, TypeError) as e:
+        # Image file missing or unreadable
+        errorint, errormsg = 603, str(e)
+    else:
+        errorint, errormsg = job.errorint, job.errormsg
+    answered = job is not None and job.answer is not None
+    return {
+        "id": captcha_id,
+        "image": None if image is None else str(image),
+        "answer": job.answer if job is not None else None,
+        "captchaid": job.captchaid if job is not None else -1,
+        "latency": round(time.monotonic() - started, 3),
+        "errorint": errorint,
+        "errormsg": errormsg,
+        "credits": job.getCost() if answered and not job.cached else 0,
+    }
+
+
+def main(argv=None):
+    """Command line interface, see python3 -m py9kw --help. Returns the exit status."""
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) == 2 and argv[1].isdigit() and not argv[0].startswith("-"):
+        # Old usage: py9kw.py <APIKEY> <TIME TO SOLVE>
+        return _selftest(argv[0], int(argv[1]))
+    parser = argparse.ArgumentParser(
+        prog="python3 -m py9kw",
+        description="Solves captchas with 9kw.eu and writes one JSON line per captcha: "
+        "id, image, answer, captchaid, latency, errorint, errormsg and credits spent.",
+        epilog="Test the API with a sample captcha: python3 -m py9kw <APIKEY> <TIME TO SOLVE>",
+    )
+    parser.add_argument(
+        "sources",
+        nargs="+",
+        help="image files, directories, glob patterns, http(s) URLs or - to read JSON lines "
+        'like {"id": "1", "image": "captcha.png"} from stdin',
+    )
+    parser.add_argument(
+        "--apikey",
+        default=getenv("PY9KW_APIKEY"),
+        help="9kw apikey, default: environment variable PY9KW_APIKEY",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="captchas solved at the same time"
+    )
+    parser.add_argument("--prio", type=int, default=None, help="prio of every captcha")
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=None,
+        help="maxtimeout of every captcha in seconds (%d-%d)"
+        % (PARAM_MIN_MAXTIMEOUT, PARAM_MAX_MAXTIMEOUT),
+    )
+    parser.add_argument(
+        "--output",
+        help="append results to this file instead of writing them to stdout. "
+        "Captchas which already got an answer in this file are skipped, so an interrupted run can be resumed",
+    )
+    parser.add_argument(
+        "--api-base", default=API_BASE, help="API URL e.g. of a Py9kwSimulator"
+    )
+    parser.add_argument(
+        "--env-proxy", action="store_true", help="use the proxy set in http_proxy"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if not args.apikey:
+        parser.error("--apikey or PY9KW_APIKEY is required")
+    if args.verbose:
+        # stdout is reserved for the JSON lines
+        enableVerboseLogging(sys.stderr)
+    client = Py9kw(
+        args.apikey,
+        args.env_proxy,
+        False,
+        HTTPConnectionPool(
+            maxsize=args.concurrency,
+            proxy=getenv("http_proxy") if args.env_proxy else None,
+        ),
+        args.api_base,
+    )
+    done = _batchDone(args.output)
+    inputs = (
+        item for item in _batchInputs(args.sources, sys.stdin) if item[0] not in done
+    )
+    output = sys.stdout if args.output is None else open(args.output, "a")
+    lock = threading.Lock()
+    stop = threading.Event()
+    # Released by every worker when it is done. Thread.join cannot be used: It may return too early after it got interrupted
+    finished = threading.Semaphore(0)
+    failed = 0
+
+    def worker():
+        nonlocal failed
+        try:
+            while not stop.is_set():
+                with lock:
+                    item = next(inputs, None)
+                if item is None:
+                    return
+                record = _batchSolve(client, item[0], item[1], args)
+                with lock:
+                    if record["answer"] is None:
+                        failed += 1
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+        finally:
+            finished.release()
+
+    workers = [
+        threading.Thread(target=worker, name="py9kw-batch-%d" % i)
+        for i in range(max(1, args.concurrency))
+    ]
+    for thread in workers:
+        thread.start()
+    running = len(workers)
+    try:
+        while running:
+            finished.acquire()
+            running -= 1
+    except KeyboardInterrupt:
+        # No new uploads, but captchas already paid for get their results written
+        logger.warning("[batch] Interrupted, waiting for the captchas in flight...")
+        stop.set()
+        while running:
+            finished.acquire()
+            running -= 1
+        return 130
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        client.pool.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
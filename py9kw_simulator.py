@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_simulator.py - Local stand-in for the 9kw.eu API to test py9kw without spending credits
+#
+#    Copyright (C) 2014 by Jan Helbling <jan.helbling@mailbox.org>
+#    Updted 2020-01-25 by over_nine_thousand
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import collections
+import email.parser
+import http.server
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from base64 import b64decode
+from urllib.parse import parse_qsl, urlsplit
+
+from py9kw import PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA, PARAM_MIN_MAXTIMEOUT
+
+
+def fixedLatency(seconds):
+    """Solve latency distribution for Py9kwSimulator: Every captcha takes the given seconds."""
+    return lambda rnd: seconds
+
+
+def uniformLatency(low, high):
+    """Solve latency distribution for Py9kwSimulator: Uniformly distributed between low and high seconds."""
+    return lambda rnd: rnd.uniform(low, high)
+
+
+def lognormalLatency(median, sigma=0.5):
+    """Solve latency distribution for Py9kwSimulator: Log-normal distribution with the given median in seconds, has a long tail like real solve times."""
+    return lambda rnd: rnd.lognormvariate(math.log(median), sigma)
+
+
+class _SimulatedCaptcha:
+    def __init__(self, apikey, answer, cost, expires, solve_at):
+        self.apikey = apikey
+        self.answer = answer
+        self.cost = cost
+        self.expires = expires
+        self.solve_at = solve_at
+        self.charged = False
+        self.aborted = False
+
+
+class Py9kwSimulator:
+    """Local stand-in for the 9kw API to test and load-test without spending credits. Answers the same json as the real API for
+    usercaptchaupload, usercaptchacorrectdata, usercaptchacorrectback and usercaptchaguthaben. Use base_url as api_base of Py9kw.
+
+    latency: Distribution of solve times e.g. lognormalLatency(15). Captchas which are not solved within their maxtimeout get 'ERROR NO USER'.
+    answer: Function returning the answer for the given image bytes.
+    no_user_rate: Probability that a captcha is never solved.
+    error_rate: Probability that a request gets answered with error_message.
+    http_error_rate: Probability that a request gets answered with http status 503.
+    apikeys: Credits per valid apikey. Any apikey is valid and gets the given credits if not set."""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=None,
+        answer=None,
+        credits=100000,
+        apikeys=None,
+        no_user_rate=0.0,
+        error_rate=0.0,
+        error_message="0099 Simulated error",
+        http_error_rate=0.0,
+        seed=None,
+    ):
+        self.latency = latency if latency is not None else lognormalLatency(10)
+        self.answer = answer if answer is not None else (lambda imagedata: "py9kw")
+        self.credits = credits
+        self.apikeys = dict(apikeys) if apikeys is not None else None
+        self.no_user_rate = no_user_rate
+        self.error_rate = error_rate
+        self.error_message = error_message
+        self.http_error_rate = http_error_rate
+        self.requests = collections.Counter()
+        self._random = random.Random(seed)
+        self._captchas = {}
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._server = _SimulatorServer((host, port), _SimulatorRequestHandler)
+        self._server.simulator = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d/index.cgi" % (host, port)
+
+    def start(self):
+        """Starts answering requests in a background thread."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="py9kw-simulator", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def getCredits(self, apikey):
+        with self._lock:
+            if self.apikeys is None:
+                return self.credits
+            return self.apikeys.get(apikey)
+
+    def _changeCredits(self, apikey, amount):
+        # Caller must hold self._lock
+        if self.apikeys is None:
+            self.credits += amount
+        else:
+            self.apikeys[apikey] += amount
+
+    def handle(self, params):
+        """Returns (http status, json response) for the given request parameters."""
+        action = params.get("action")
+        with self._lock:
+            self.requests[action] += 1
+            if self._random.random() < self.http_error_rate:
+                return 503, None
+            if self._random.random() < self.error_rate:
+                return 200, self._error(self.error_message)
+            apikey = params.get("apikey")
+            if self.apikeys is not None and apikey not in self.apikeys:
+                return 200, self._error("0002 API key not found")
+            if action == "usercaptchaupload":
+                return 200, self._upload(apikey, params)
+            if action == "usercaptchacorrectdata":
+                return 200, self._result(params)
+            if action == "usercaptchacorrectback":
+                return 200, self._feedback(params)
+            if action == "usercaptchaguthaben":
+                return 200, self._ok(credits=self._getCredits(apikey))
+            return 200, self._error("0099 Unknown action")
+
+    def _getCredits(self, apikey):
+        return self.credits if self.apikeys is None else self.apikeys[apikey]
+
+    def _ok(self, **response):
+        response.update({"status": {"success": True, "https": 1}, "message": "OK"})
+        return response
+
+    def _error(self, error):
+        return {"status": {"success": False, "https": 1}, "error": error}
+
+    def _upload(self, apikey, params):
+        imagedata = params.get("file-upload-01")
+        if not imagedata:
+            return self._error("0009 No image file uploaded")
+        if params.get("base64") == "1":
+            imagedata = b64decode(imagedata)
+        try:
+            prio = int(params.get("prio", 0))
+            maxtimeout = int(params.get("maxtimeout", PARAM_MIN_MAXTIMEOUT))
+        except ValueError:
+            return self._error("0099 Invalid parameter")
+        cost = PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA + max(prio, 0)
+        if self._getCredits(apikey) < cost:
+            return self._error("0011 Balance insufficient")
+        now = time.monotonic()
+        if self._random.random() < self.no_user_rate:
+            solve_at = None
+        else:
+            solve_at = now + max(0, self.latency(self._random))
+        captchaid = next(self._ids)
+        self._captchas[captchaid] = _SimulatedCaptcha(
+            apikey, self.answer(imagedata), cost, now + maxtimeout, solve_at
+        )
+        return self._ok(captchaid=str(captchaid))
+
+    def _getCaptcha(self, params):
+        try:
+            return self._captchas.get(int(params.get("id")))
+        except (TypeError, ValueError):
+            return None
+
+    def _result(self, params):
+        captcha = self._getCaptcha(params)
+        if captcha is None:
+            return self._error("0008 Captcha not found")
+        now = time.monotonic()
+        if captcha.aborted or (
+            now > captcha.expires
+            and (captcha.solve_at is None or captcha.solve_at > captcha.expires)
+        ):
+            return self._ok(answer="ERROR NO USER")
+        if captcha.solve_at is None or now < captcha.solve_at:
+            return self._ok(answer="NO DATA", nodata=1, try_again=1, info=1)
+        if not captcha.charged:
+            captcha.charged = True
+            self._changeCredits(captcha.apikey, -captcha.cost)
+        return self._ok(
+            answer=captcha.answer, credits=str(self._getCredits(captcha.apikey))
+        )
+
+    def _feedback(self, params):
+        captcha = self._getCaptcha(params)
+        if captcha is None:
+            return self._error("0008 Captcha not found")
+        correct = str(params.get("correct"))
+        if correct == "2" and captcha.charged:
+            # Wrong answers get refunded
+            captcha.charged = False
+            self._changeCredits(captcha.apikey, captcha.cost)
+        elif correct == "3" and not captcha.charged:
+            captcha.aborted = True
+        return self._ok()
+
+
+class _SimulatorServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once
+    request_queue_size = 1024
+
+
+class _SimulatorRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._answer(self._getQueryParams())
+
+    def do_POST(self):
+        params = self._getQueryParams()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+            )
+            for part in message.get_payload():
+                value = part.get_payload(decode=True)
+                if part.get_filename() is None:
+                    value = value.decode("utf-8", "ignore")
+                params[part.get_param("name", header="content-disposition")] = value
+        else:
+            params.update(parse_qsl(body.decode("utf-8", "ignore")))
+        self._answer(params)
+
+    def _getQueryParams(self):
+        return dict(parse_qsl(urlsplit(self.path).query))
+
+    def _answer(self, params):
+        status, response = self.server.simulator.handle(params)
+        body = json.dumps(response).encode("utf-8") if response is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -13,5 +13,5 @@ setup(name='python3-py9kw',
       author2_email=None,
       author2_url='https://github.com/farOverNinethousand',
       url='https://github.com/JanHelbling/py9kw',
-      py_modules=['py9kw'], requires=['validators']
+      py_modules=['py9kw', 'py9kw_simulator']
       )
@@ -0,0 +1,110 @@
+import hashlib
+import http.server
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import py9kw
+from py9kw_simulator import Py9kwSimulator, fixedLatency
+
+
+def md5Answer(imagedata):
+    """Answer of the simulator: Proves that the image arrived unchanged."""
+    return hashlib.md5(imagedata).hexdigest()
+
+
+@pytest.fixture
+def image():
+    return b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+@pytest.fixture
+def simulator():
+    with Py9kwSimulator(latency=fixedLatency(0.05), answer=md5Answer, seed=1) as simulator:
+        yield simulator
+
+
+@pytest.fixture
+def client(simulator):
+    client = py9kw.Py9kw("test", api_base=simulator.base_url)
+    client.setPollSchedule(py9kw.FixedPollSchedule(0.02))
+    yield client
+    client.pool.close()
+
+
+class WebsiteHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if self.path == "/image.png":
+            body = self.server.image
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+        elif self.path.startswith("/hop/"):
+            hops = int(self.path[5:])
+            body = b"<html>Moved</html>"
+            self.send_response(302)
+            self.send_header(
+                "Location", "/image.png" if hops == 0 else "/hop/%d" % (hops - 1)
+            )
+        elif self.path == "/absolute":
+            body = b""
+            self.send_response(301)
+            self.send_header("Location", "%s/hop/0" % self.server.base_url)
+        elif self.path == "/loop":
+            body = b""
+            self.send_response(307)
+            self.send_header("Location", "/loop")
+        elif self.path == "/stream.png":
+            # No Content-Length: The image ends when the connection gets closed
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(self.server.image)
+            self.close_connection = True
+            return
+        elif self.path == "/slow.png":
+            # Sends the image in 10 parts within 2 seconds
+            image = self.server.image
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(image)))
+            self.end_headers()
+            part = len(image) // 10 + 1
+            try:
+                for offset in range(0, len(image), part):
+                    self.wfile.write(image[offset : offset + part])
+                    self.wfile.flush()
+                    time.sleep(0.2)
+            except ConnectionError:
+                # Client gave up
+                self.close_connection = True
+            return
+        else:
+            body = b"Not found"
+            self.send_response(404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def website(image):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), WebsiteHandler)
+    server.daemon_threads = True
+    server.image = image
+    server.hits = []
+    server.base_url = "http://127.0.0.1:%d" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
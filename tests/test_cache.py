@@ -0,0 +1,53 @@
+import py9kw
+
+
+def test_confirmed_answer_is_cached(client, simulator, image):
+    client.setResultCache(py9kw.MemoryResultCache())
+    first = client.solve(image)
+    first.correct(True)
+    second = client.solve(image)
+    assert second.cached
+    assert second.answer == first.answer
+    assert simulator.requests["usercaptchaupload"] == 1
+
+
+def test_wrong_answer_is_evicted(client, simulator, image):
+    client.setResultCache(py9kw.MemoryResultCache())
+    client.solve(image).correct(True)
+    cached = client.solve(image)
+    assert cached.cached
+    cached.correct(False)
+    job = client.solve(image)
+    assert not job.cached
+    assert simulator.requests["usercaptchaupload"] == 2
+
+
+def test_sqlite_cache(client, simulator, image, tmp_path):
+    cache = py9kw.SQLiteResultCache(str(tmp_path / "cache.sqlite"))
+    client.setResultCache(cache)
+    client.solve(image).correct(True)
+    cache.close()
+    client.setResultCache(py9kw.SQLiteResultCache(str(tmp_path / "cache.sqlite")))
+    assert client.solve(image).cached
+
+
+def test_lru_and_ttl():
+    cache = py9kw.MemoryResultCache(maxsize=2, ttl=0.05)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    py9kw.time.sleep(0.06)
+    assert cache.get("a") is None
+
+
+def test_unconfirmed_answer_is_not_cached(client, simulator, image):
+    cache = py9kw.MemoryResultCache()
+    client.setResultCache(cache)
+    job = client.solve(image)
+    assert job.answer is not None
+    assert cache.get(job.cachekey) is None
+    assert not client.solve(image).cached
+    assert simulator.requests["usercaptchaupload"] == 2
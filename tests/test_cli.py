@@ -0,0 +1,95 @@
+import io
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import py9kw
+
+
+def test_batch_inputs_skip_invalid_lines(caplog):
+    stdin = io.StringIO(
+        '\n'.join(
+            [
+                '"https://example.com/a.png"',
+                '{"id": "b", "path": "b.png"}',
+                "null",
+                "42",
+                '["c.png"]',
+                "{broken",
+                '{"url": "https://example.com/d.png"}',
+            ]
+        )
+    )
+    with caplog.at_level(logging.WARNING, logger="py9kw"):
+        items = list(py9kw._batchInputs(["-"], stdin))
+    assert items == [
+        ("https://example.com/a.png", "https://example.com/a.png"),
+        ("b", "b.png"),
+        ("https://example.com/d.png", "https://example.com/d.png"),
+    ]
+    assert len(caplog.records) == 4
+
+
+def test_verbose_logs_go_to_stderr(simulator, image, tmp_path, capsys):
+    path = tmp_path / "captcha.png"
+    path.write_bytes(image)
+    try:
+        status = py9kw.main(
+            [
+                "--apikey",
+                "test",
+                "--api-base",
+                simulator.base_url,
+                "--verbose",
+                str(path),
+            ]
+        )
+    finally:
+        for handler in list(py9kw.logger.handlers):
+            if getattr(handler, "py9kw_verbose", False):
+                py9kw.logger.removeHandler(handler)
+        py9kw.logger.setLevel(logging.NOTSET)
+    out, err = capsys.readouterr()
+    assert status == 0
+    records = [json.loads(line) for line in out.splitlines()]
+    assert [record["id"] for record in records] == [str(path)]
+    assert records[0]["answer"] is not None
+    assert "[py9kw]" in err
+
+
+def test_interrupt_finishes_captchas_in_flight(simulator, image, tmp_path):
+    for i in range(20):
+        (tmp_path / ("%02d.png" % i)).write_bytes(image + bytes([i]))
+    output = tmp_path / "results.jsonl"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "py9kw",
+            "--apikey",
+            "test",
+            "--api-base",
+            simulator.base_url,
+            "--concurrency",
+            "2",
+            "--output",
+            str(output),
+            str(tmp_path / "*.png"),
+        ],
+        cwd=os.path.dirname(py9kw.__file__),
+        stderr=subprocess.PIPE,
+    )
+    deadline = time.monotonic() + 10
+    while simulator.requests["usercaptchaupload"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    process.send_signal(signal.SIGINT)
+    assert process.wait(timeout=15) == 130
+    process.stderr.close()
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    # Every captcha uploaded before the interrupt got its answer written, no others were uploaded
+    assert len(records) == simulator.requests["usercaptchaupload"] == 2
+    assert all(record["answer"] is not None for record in records)
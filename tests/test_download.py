@@ -0,0 +1,56 @@
+import asyncio
+import urllib.error
+
+import pytest
+
+import py9kw
+
+
+@pytest.mark.parametrize("path", ["/image.png", "/hop/0", "/hop/4", "/absolute"])
+def test_fetch_follows_redirects(website, image, path):
+    pool = py9kw.HTTPConnectionPool()
+    assert pool.fetch(website.base_url + path) == image
+    pool.close()
+
+
+def test_fetch_too_many_redirects(website):
+    pool = py9kw.HTTPConnectionPool()
+    with pytest.raises(urllib.error.URLError):
+        pool.fetch(website.base_url + "/loop")
+    with pytest.raises(urllib.error.URLError):
+        pool.fetch(website.base_url + "/hop/1", max_redirects=1)
+    pool.close()
+
+
+def test_fetch_error_status(website):
+    pool = py9kw.HTTPConnectionPool()
+    with pytest.raises(urllib.error.HTTPError):
+        pool.fetch(website.base_url + "/missing.png")
+    pool.close()
+
+
+def test_redirect_is_not_written_to_file(website, image, tmp_path):
+    path = tmp_path / "captcha.png"
+    client = py9kw.Py9kw("test")
+    imagefile, errorint, errormsg = client.getCaptchaImageFromWebsite(
+        website.base_url + "/hop/2", str(path)
+    )
+    assert errorint == -1
+    assert imagefile == image
+    assert path.read_bytes() == image
+
+
+def test_async_fetch_follows_redirects(website, image):
+    async def fetch(path, **kwargs):
+        pool = py9kw.AsyncHTTPConnectionPool()
+        try:
+            return await pool.fetch(website.base_url + path, **kwargs)
+        finally:
+            pool.close()
+
+    assert asyncio.run(fetch("/hop/3")) == image
+    assert asyncio.run(fetch("/absolute")) == image
+    with pytest.raises(urllib.error.URLError):
+        asyncio.run(fetch("/loop"))
+    with pytest.raises(urllib.error.URLError):
+        asyncio.run(fetch("/hop/1", max_redirects=1))
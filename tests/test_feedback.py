@@ -0,0 +1,91 @@
+import asyncio
+
+import py9kw
+from py9kw_simulator import fixedLatency
+
+
+def test_feedback_is_sent_in_background(client, simulator, image):
+    dispatcher = py9kw.FeedbackDispatcher()
+    client.setFeedbackDispatcher(dispatcher)
+    jobs = [client.solve(image) for i in range(5)]
+    for job in jobs:
+        assert job.correct(True) == (-1, None)
+    assert dispatcher.flush(5)
+    dispatcher.close()
+    assert simulator.requests["usercaptchacorrectback"] == 5
+    assert dispatcher.getStats()["sent"] == 5
+
+
+def test_verdicts_are_coalesced(client, simulator, image):
+    dispatcher = py9kw.FeedbackDispatcher()
+    client.setFeedbackDispatcher(dispatcher)
+    job = client.solve(image)
+    # Keep the workers from sending before all verdicts are queued
+    with dispatcher._cond:
+        job.abort()
+        job.correct(False)
+        job.correct(True)
+    assert dispatcher.flush(5)
+    dispatcher.close()
+    stats = dispatcher.getStats()
+    assert stats["coalesced"] == 2
+    assert stats["sent"] == 1
+    assert simulator.requests["usercaptchacorrectback"] == 1
+
+
+def test_failed_feedback_is_retried(client, simulator, image):
+    client.setRetryPolicy(py9kw.RetryPolicy(attempts=1))
+    client.setCircuitBreaker(None)
+    dispatcher = py9kw.FeedbackDispatcher(
+        retry_policy=py9kw.RetryPolicy(attempts=50, base=0.01, cap=0.02)
+    )
+    client.setFeedbackDispatcher(dispatcher)
+    jobs = [client.solve(image) for i in range(5)]
+    simulator.http_error_rate = 0.5
+    for job in jobs:
+        job.correct(True)
+    assert dispatcher.flush(10)
+    dispatcher.close()
+    stats = dispatcher.getStats()
+    assert stats["sent"] == 5
+    assert stats["retried"] > 0
+
+
+def test_unsent_feedback_is_resumed(client, simulator, image, tmp_path):
+    path = str(tmp_path / "feedback.sqlite")
+    simulator.latency = fixedLatency(10)
+    client.setRetryPolicy(py9kw.RetryPolicy(attempts=1))
+    client.setCircuitBreaker(None)
+    dispatcher = py9kw.FeedbackDispatcher(
+        retry_policy=py9kw.RetryPolicy(attempts=1), path=path
+    )
+    client.setFeedbackDispatcher(dispatcher)
+    jobs = [client.uploadcaptcha(image) for i in range(3)]
+    simulator.http_error_rate = 1.0
+    for job in jobs:
+        job.abort()
+    dispatcher.flush(5)
+    dispatcher.close()
+    assert simulator.requests["usercaptchacorrectback"] == 3
+    simulator.http_error_rate = 0.0
+    dispatcher = py9kw.FeedbackDispatcher(path=path)
+    assert dispatcher.resume(client) == 3
+    assert dispatcher.flush(5)
+    dispatcher.close()
+    assert simulator.requests["usercaptchacorrectback"] == 6
+
+
+def test_async_dispatcher(simulator, image):
+    async def run():
+        client = py9kw.AsyncPy9kw("test", api_base=simulator.base_url)
+        client.setPollSchedule(py9kw.FixedPollSchedule(0.02))
+        async with py9kw.AsyncFeedbackDispatcher() as dispatcher:
+            client.setFeedbackDispatcher(dispatcher)
+            for job in await asyncio.gather(*(client.solve(image) for i in range(5))):
+                await job.correct(True)
+            assert await dispatcher.flush(5)
+        client.pool.close()
+        return dispatcher.getStats()
+
+    assert asyncio.run(run())["sent"] == 5
+    assert simulator.requests["usercaptchacorrectback"] == 5
@@ -0,0 +1,76 @@
+import asyncio
+import time
+import urllib.error
+
+import pytest
+
+import py9kw
+
+
+@pytest.mark.parametrize("path", ["/image.png", "/stream.png"])
+def test_size_cap(website, image, path):
+    pool = py9kw.HTTPConnectionPool()
+    assert pool.fetch(website.base_url + path, max_bytes=len(image)) == image
+    with pytest.raises(urllib.error.URLError, match="bigger than"):
+        pool.fetch(website.base_url + path, max_bytes=len(image) - 1)
+    pool.close()
+
+
+def test_timeout(website):
+    client = py9kw.Py9kw("test")
+    client.setDownloadLimits(download_timeout=0.5)
+    started = time.monotonic()
+    imagefile, errorint, errormsg = client.getCaptchaImageFromWebsite(
+        website.base_url + "/slow.png"
+    )
+    assert imagefile is None
+    assert errorint == 603
+    assert time.monotonic() - started < 1.5
+
+
+def test_partial_file_is_removed(website, image, tmp_path):
+    path = tmp_path / "captcha.png"
+    client = py9kw.Py9kw("test")
+    client.setDownloadLimits(max_image_bytes=len(image) // 2)
+    imagefile, errorint, errormsg = client.getCaptchaImageFromWebsite(
+        website.base_url + "/stream.png", str(path)
+    )
+    assert errorint == 603
+    assert not path.exists()
+
+
+def test_async_size_cap_and_timeout(website, image):
+    async def download(path, max_image_bytes=None, download_timeout=None):
+        client = py9kw.AsyncPy9kw("test")
+        client.setDownloadLimits(max_image_bytes, download_timeout)
+        try:
+            return await client.getCaptchaImageFromWebsite(website.base_url + path)
+        finally:
+            client.pool.close()
+
+    assert asyncio.run(download("/stream.png"))[0] == image
+    assert asyncio.run(download("/stream.png", len(image) - 1))[1] == 603
+    started = time.monotonic()
+    assert asyncio.run(download("/slow.png", download_timeout=0.5))[1] == 603
+    assert time.monotonic() - started < 1.5
+
+
+def test_captcha_fetcher(website, image, tmp_path):
+    paths = [str(tmp_path / ("%d.png" % i)) for i in range(3)]
+    urls = [website.base_url + "/image.png"] * 3
+    with py9kw.CaptchaFetcher(workers=2, timeout=5) as fetcher:
+        futures = fetcher.prefetchAll(urls, paths)
+        failed = fetcher.prefetch(website.base_url + "/missing.png")
+        assert [future.result(5) for future in futures] == [image] * 3
+        with pytest.raises(urllib.error.HTTPError):
+            failed.result(5)
+    assert all(open(path, "rb").read() == image for path in paths)
+
+
+def test_captcha_fetcher_limits(website, image):
+    with py9kw.CaptchaFetcher(max_bytes=len(image) - 1, timeout=0.5) as fetcher:
+        with pytest.raises(urllib.error.URLError, match="bigger than"):
+            fetcher.fetch(website.base_url + "/image.png")
+        fetcher.max_bytes = None
+        with pytest.raises(IOError):
+            fetcher.fetch(website.base_url + "/slow.png")
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import itertools
+
+import py9kw
+
+
+def slowThenFast():
+    """Latency of the simulator: The first captcha is not answered in time, all later ones are."""
+    calls = itertools.count()
+    return lambda rng: 30 if next(calls) == 0 else 0.05
+
+
+def hedgingClient(client):
+    policy = py9kw.HedgePolicy(fallback_delay=0.1, min_delay=0.1)
+    client.setHedgePolicy(policy)
+    return policy
+
+
+def test_hedge_wins(client, simulator, image):
+    simulator.latency = slowThenFast()
+    policy = hedgingClient(client)
+    job = client.solve(image)
+    assert job.answer == hashlib.md5(image).hexdigest()
+    assert simulator.requests["usercaptchaupload"] == 2
+    assert policy.getStats()["hedge_won"] == 1
+
+
+def test_url_is_downloaded_once(client, simulator, website, image, tmp_path):
+    simulator.latency = slowThenFast()
+    hedgingClient(client)
+    path = tmp_path / "captcha.png"
+    job = client.solve(website.base_url + "/hop/0", str(path))
+    assert job.answer == hashlib.md5(image).hexdigest()
+    assert simulator.requests["usercaptchaupload"] == 2
+    assert website.hits == ["/hop/0", "/image.png"]
+    assert path.read_bytes() == image
+
+
+def test_failed_download(client, simulator, website):
+    hedgingClient(client)
+    job = client.solve(website.base_url + "/missing.png")
+    assert not job
+    assert job.errorint == 603
+    assert simulator.requests["usercaptchaupload"] == 0
+
+
+def test_async_url_is_downloaded_once(simulator, website, image):
+    simulator.latency = slowThenFast()
+
+    async def solve():
+        client = py9kw.AsyncPy9kw("test", api_base=simulator.base_url)
+        client.setPollSchedule(py9kw.FixedPollSchedule(0.02))
+        hedgingClient(client)
+        job = await client.solve(website.base_url + "/image.png")
+        client.pool.close()
+        return job
+
+    job = asyncio.run(solve())
+    assert job.answer == hashlib.md5(image).hexdigest()
+    assert website.hits == ["/image.png"]
+
+
+def test_extra_credits_of_charged_loser(client):
+    policy = py9kw.HedgePolicy(prio_boost=10)
+    job = py9kw.CaptchaJob(client, 1, prio=0)
+    hedge = py9kw.CaptchaJob(client, 2, prio=10)
+    # Hedge won and the first captcha got aborted in time: Only the higher prio costs extra
+    policy.observe(job, hedge, hedge)
+    assert policy.getStats()["extra_credits"] == 10
+    # First captcha could not be aborted anymore: It costs as well
+    policy.observe(job, hedge, hedge, [job])
+    assert policy.getStats()["extra_credits"] == 10 + 20
+    # First captcha won but the hedge got solved too
+    policy.observe(job, hedge, job, [hedge])
+    assert policy.getStats()["extra_credits"] == 10 + 20 + 20
+    assert policy.getStats()["hedge_won"] == 2
+
+
+def test_failed_abort_counts_as_charged(client, simulator, image):
+    simulator.latency = slowThenFast()
+    policy = hedgingClient(client)
+    client.setRetryPolicy(py9kw.RetryPolicy(attempts=1))
+    client.setCircuitBreaker(None)
+    send = client.sendCaptchaFeedback
+
+    def failingAbort(feedback_status, job=None):
+        simulator.http_error_rate = 1.0
+        try:
+            return send(feedback_status, job)
+        finally:
+            simulator.http_error_rate = 0.0
+
+    client.sendCaptchaFeedback = failingAbort
+    job = client.solve(image)
+    assert job.answer is not None
+    assert policy.getStats()["extra_credits"] == job.getCost()
+
+
+def test_hedge_with_feedback_dispatcher(client, simulator, image):
+    simulator.latency = slowThenFast()
+    policy = hedgingClient(client)
+    dispatcher = py9kw.FeedbackDispatcher()
+    client.setFeedbackDispatcher(dispatcher)
+    job = client.solve(image)
+    assert dispatcher.flush(5)
+    dispatcher.close()
+    assert job.answer is not None
+    # The first captcha got aborted in the background and costs nothing
+    assert policy.getStats()["extra_credits"] == 0
+    assert simulator.requests["usercaptchacorrectback"] == 1
+
+
+def test_failed_abort_is_recorded_on_the_job(client, simulator, image):
+    simulator.latency = slowThenFast()
+    client.setRetryPolicy(py9kw.RetryPolicy(attempts=1))
+    client.setCircuitBreaker(None)
+    job = client.uploadcaptcha(image)
+    simulator.http_error_rate = 1.0
+    job.abort()
+    assert job.abort_failed
+    simulator.http_error_rate = 0.0
+    job.abort()
+    assert not job.abort_failed
@@ -0,0 +1,56 @@
+import time
+
+import py9kw
+from py9kw_simulator import fixedLatency
+
+
+def test_upload_is_recorded(client, image, tmp_path):
+    store = py9kw.JobStore(str(tmp_path / "jobs.sqlite"))
+    client.setJobStore(store)
+    job = client.uploadcaptcha(image)
+    assert [waiting.captchaid for waiting in store.getJobs(client)] == [job.captchaid]
+    job.result()
+    assert store.getCounts() == {py9kw.JobStore.SOLVED: 1}
+    job.correct(True)
+    assert store.getCounts() == {py9kw.JobStore.DONE: 1}
+
+
+def test_claim_leases_to_one_worker(client, simulator, image, tmp_path):
+    simulator.latency = fixedLatency(10)
+    path = str(tmp_path / "jobs.sqlite")
+    first = py9kw.JobStore(path, lease=0.2, worker="first")
+    second = py9kw.JobStore(path, lease=0.2, worker="second")
+    client.setJobStore(first)
+    job = client.uploadcaptcha(image)
+    assert [claimed.captchaid for claimed in first.claim(client)] == [job.captchaid]
+    assert second.claim(client) == []
+    # Lease of a crashed worker runs out --> Another one takes over
+    time.sleep(0.25)
+    assert [claimed.captchaid for claimed in second.claim(client)] == [job.captchaid]
+
+
+def test_poll_due_finishes_jobs(client, simulator, image, tmp_path):
+    store = py9kw.JobStore(str(tmp_path / "jobs.sqlite"))
+    client.setJobStore(store)
+    captchaids = {client.uploadcaptcha(image).captchaid for i in range(3)}
+    finished = {}
+    deadline = time.monotonic() + 5
+    while len(finished) < 3 and time.monotonic() < deadline:
+        for job in store.pollDue(client):
+            finished[job.captchaid] = job.answer
+        time.sleep(0.02)
+    assert set(finished) == captchaids
+    assert all(answer is not None for answer in finished.values())
+
+
+def test_resume_after_restart(client, simulator, image, tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    store = py9kw.JobStore(path)
+    client.setJobStore(store)
+    client.uploadcaptcha(image)
+    store.close()
+    restarted = py9kw.JobStore(path)
+    client.setJobStore(restarted)
+    assert restarted.resume(client) == 1
+    assert restarted.abortWaiting(client) == 1
+    assert restarted.getCounts() == {py9kw.JobStore.ABORTED: 1}
@@ -0,0 +1,63 @@
+import hashlib
+
+import pytest
+
+import py9kw
+from py9kw_simulator import Py9kwSimulator, fixedLatency
+
+
+@pytest.fixture
+def accounts():
+    with Py9kwSimulator(
+        latency=fixedLatency(0.05),
+        answer=lambda imagedata: hashlib.md5(imagedata).hexdigest(),
+        apikeys={"poor": 5, "rich1": 1000, "rich2": 1000},
+    ) as simulator:
+        yield simulator
+
+
+def newPool(simulator, apikeys):
+    clients = []
+    for apikey in apikeys:
+        client = py9kw.Py9kw(apikey, api_base=simulator.base_url)
+        client.setPollSchedule(py9kw.FixedPollSchedule(0.02))
+        clients.append(client)
+    return py9kw.KeyPool(clients)
+
+
+def test_key_is_drained_after_balance_insufficient(accounts, image):
+    pool = newPool(accounts, ["poor", "rich1", "rich2"])
+    job = pool.solve(image)
+    assert job.answer == hashlib.md5(image).hexdigest()
+    assert job.client.apikey != "poor"
+    stats = pool.getStats()
+    assert stats["poor"]["drained"]
+    assert stats["poor"]["error_rate"] == 1.0
+    assert not stats["rich1"]["drained"] and not stats["rich2"]["drained"]
+
+
+def test_uploads_go_to_the_remaining_keys(accounts, image):
+    pool = newPool(accounts, ["poor", "rich1", "rich2"])
+    jobs = [pool.uploadcaptcha(image) for i in range(6)]
+    assert all(jobs)
+    assert {job.client.apikey for job in jobs} == {"rich1", "rich2"}
+    # The drained key got asked only once
+    assert accounts.requests["usercaptchaupload"] == 7
+    # Polls go to the key which owns the captcha
+    for job in jobs:
+        assert job.result()[0] is not None
+    assert accounts.getCredits("poor") == 5
+    assert accounts.getCredits("rich1") + accounts.getCredits("rich2") == 2000 - 60
+
+
+def test_all_keys_exhausted(image):
+    with Py9kwSimulator(apikeys={"poor1": 5, "poor2": 5}) as simulator:
+        pool = newPool(simulator, ["poor1", "poor2"])
+        job = pool.uploadcaptcha(image)
+        assert not job
+        assert job.errorint == 608
+        assert job.errormsg == "NO_APIKEY_AVAILABLE"
+        assert simulator.requests["usercaptchaupload"] == 2
+        # Drained keys are not asked again
+        assert pool.uploadcaptcha(image).errorint == 608
+        assert simulator.requests["usercaptchaupload"] == 2
@@ -0,0 +1,55 @@
+import py9kw
+from py9kw_simulator import fixedLatency
+
+
+def newLedger(client, simulator, budget=None):
+    ledger = py9kw.CreditLedger(budget=budget)
+    client.setCreditLedger(ledger)
+    ledger.update(simulator.credits)
+    return ledger
+
+
+def test_upload_reserves_and_answer_charges(client, simulator, image):
+    ledger = newLedger(client, simulator)
+    job = client.uploadcaptcha(image)
+    assert ledger.pending == job.getCost()
+    job.result()
+    assert ledger.pending == 0
+    assert ledger.balance == simulator.credits
+
+
+def test_abort_refunds(client, simulator, image):
+    simulator.latency = fixedLatency(10)
+    ledger = newLedger(client, simulator)
+    job = client.uploadcaptcha(image)
+    job.abort()
+    assert ledger.pending == 0
+    assert ledger.spent == 0
+    assert ledger.getAvailable() == simulator.credits
+
+
+def test_wrong_answer_refunds(client, simulator, image):
+    ledger = newLedger(client, simulator)
+    job = client.solve(image)
+    assert ledger.balance == simulator.credits
+    job.correct(False)
+    assert ledger.spent == 0
+    # The simulator refunds wrong answers too
+    assert ledger.balance == simulator.credits
+
+
+def test_budget_exhausted(client, simulator, image):
+    newLedger(client, simulator, budget=25)
+    assert client.uploadcaptcha(image, prio=5)
+    job = client.uploadcaptcha(image, prio=5)
+    assert not job
+    assert job.errorint == 605
+    assert simulator.requests["usercaptchaupload"] == 1
+
+
+def test_not_enough_credits(client, simulator, image):
+    ledger = newLedger(client, simulator)
+    ledger.update(5)
+    job = client.uploadcaptcha(image)
+    assert job.errorint == 604
+    assert simulator.requests["usercaptchaupload"] == 0
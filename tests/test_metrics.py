@@ -0,0 +1,24 @@
+import py9kw
+
+
+def test_prometheus_metrics(client, simulator, image):
+    metrics = py9kw.PrometheusMetrics()
+    client.setMetrics(metrics)
+    client.solve(image)
+    client.getcredits()
+    text = metrics.render()
+    assert "# HELP py9kw_polls_total Result polls" in text
+    assert "# TYPE py9kw_polls_total counter" in text
+    assert "py9kw_credits %d" % simulator.credits in text
+    assert 'py9kw_request_duration_seconds_count{action="usercaptchaupload"} 1' in text
+
+
+def test_help_and_type_use_the_same_name():
+    metrics = py9kw.PrometheusMetrics()
+    metrics.onError(600)
+    for openmetrics in (False, True):
+        lines = metrics.render(openmetrics).splitlines()
+        helps = [line.split()[2] for line in lines if line.startswith("# HELP")]
+        types = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+        assert helps == types
+    assert metrics.render(True).endswith("# EOF\n")
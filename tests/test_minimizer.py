@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import py9kw
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+requiresPillow = pytest.mark.skipif(Image is None, reason="Pillow is not installed")
+
+
+def encode(image, format="PNG"):
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+
+def decode(imagedata):
+    image = Image.open(io.BytesIO(imagedata))
+    image.load()
+    return image
+
+
+def samePixels(a, b):
+    return a.convert("RGB").tobytes() == b.convert("RGB").tobytes()
+
+
+@requiresPillow
+def test_gray_rgb_becomes_grayscale_without_loss():
+    original = Image.new("RGB", (60, 20))
+    original.putdata([(v, v, v) for v in range(256)] * 4 + [(7, 7, 7)] * 176)
+    minimized = decode(py9kw.ImageMinimizer().minimize(encode(original, "BMP")))
+    assert minimized.mode in ("L", "P")
+    assert samePixels(minimized, original)
+
+
+@requiresPillow
+def test_few_colors_get_a_palette_without_loss():
+    colors = [(255, 0, 0), (0, 128, 0), (0, 0, 255), (250, 250, 10)]
+    original = Image.new("RGB", (80, 30))
+    original.putdata([colors[(x * 7 + x // 80) % 4] for x in range(80 * 30)])
+    imagedata = encode(original)
+    minimized = decode(py9kw.ImageMinimizer().minimize(imagedata))
+    assert minimized.mode == "P"
+    assert samePixels(minimized, original)
+
+
+@requiresPillow
+def test_crop_border():
+    original = Image.new("L", (100, 50), 255)
+    original.paste(Image.new("L", (30, 10), 0), (20, 15))
+    minimized = decode(py9kw.ImageMinimizer(crop=True).minimize(encode(original)))
+    assert minimized.size == (30, 10)
+    assert decode(py9kw.ImageMinimizer().minimize(encode(original))).size == (100, 50)
+
+
+@requiresPillow
+def test_max_dimension():
+    original = Image.new("RGB", (400, 100), (10, 20, 30))
+    minimized = decode(
+        py9kw.ImageMinimizer(max_dimension=100).minimize(encode(original))
+    )
+    assert minimized.size == (100, 25)
+
+
+@requiresPillow
+def test_stats():
+    minimizer = py9kw.ImageMinimizer()
+    big = encode(Image.new("RGB", (200, 200), (1, 2, 3)), "BMP")
+    small = minimizer.minimize(big)
+    # Unreadable --> Uploaded as it is
+    tiny = b"\x00no image\xff"
+    assert minimizer.minimize(tiny) is tiny
+    stats = minimizer.getStats()
+    assert stats == {
+        "images": 2,
+        "reencoded": 1,
+        "bytes_in": len(big) + len(tiny),
+        "bytes_out": len(small) + len(tiny),
+        "bytes_saved": len(big) - len(small),
+    }
+
+
+@requiresPillow
+def test_unreadable_and_base64_images_are_kept():
+    minimizer = py9kw.ImageMinimizer()
+    garbage = b"\x00no image\xff" * 10
+    assert minimizer.minimize(garbage) is garbage
+    encoded = py9kw.Base64Image(py9kw.b64encode(garbage))
+    assert minimizer.minimize(encoded) is encoded
+    assert minimizer.getStats()["reencoded"] == 0
+
+
+@requiresPillow
+def test_upload_minimized_image(client, simulator):
+    original = encode(Image.new("RGB", (200, 200), (1, 2, 3)), "BMP")
+    client.setImageMinimizer(py9kw.ImageMinimizer())
+    job = client.solve(original)
+    minimized = py9kw.ImageMinimizer().minimize(original)
+    assert job.answer == hashlib.md5(minimized).hexdigest()
+    assert len(minimized) < len(original)
+
+
+def test_pillow_missing():
+    # Block the import of Pillow in a fresh interpreter
+    code = (
+        "import sys; sys.modules['PIL'] = None; import py9kw\n"
+        "assert py9kw.Image is None\n"
+        "try:\n"
+        "    py9kw.ImageMinimizer()\n"
+        "except ImportError as e:\n"
+        "    assert 'Pillow' in str(e)\n"
+        "else:\n"
+        "    raise AssertionError('ImportError expected')\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(py9kw.__file__), check=True
+    )
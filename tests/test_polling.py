@@ -0,0 +1,76 @@
+import py9kw
+from py9kw_simulator import fixedLatency
+
+
+def test_poll_until_answer(client, simulator, image):
+    simulator.latency = fixedLatency(0.2)
+    job = client.uploadcaptcha(image)
+    answer, errorint, errormsg = job.result()
+    assert answer == job.answer
+    assert errorint == -1
+    assert job.polls > 1
+    assert job.getSolveTime() >= 0.2
+
+
+def test_poll_without_answer(client, simulator, image):
+    simulator.latency = fixedLatency(10)
+    job = client.uploadcaptcha(image)
+    answer, response, errorint, errormsg = job.poll()
+    assert answer is None
+    assert errorint == 602
+
+
+def test_aborted_captcha_has_no_user(client, simulator, image):
+    simulator.latency = fixedLatency(10)
+    job = client.uploadcaptcha(image)
+    job.abort()
+    answer, response, errorint, errormsg = job.poll()
+    assert answer is None
+    assert errorint == 600
+
+
+def test_backoff_schedule():
+    schedule = py9kw.BackoffPollSchedule(first_delay=2, factor=2, max_delay=10)
+    assert [schedule.getDelay(None, attempt) for attempt in range(5)] == [2, 4, 8, 10, 10]
+
+
+def test_learned_schedule_polls_at_quantiles(client):
+    schedule = py9kw.LearnedPollSchedule(
+        fallback=py9kw.FixedPollSchedule(7), quantiles=(0.5, 0.9), min_samples=10
+    )
+    job = py9kw.CaptchaJob(client, 1)
+    job.uploaded_at = py9kw.time.time()
+    assert schedule.getDelay(job, 1) == 7
+    for seconds in range(10, 20):
+        sample = py9kw.CaptchaJob(client, 2)
+        sample.uploaded_at = 0
+        sample.solved_at = seconds
+        schedule.observe(sample)
+    assert 13.5 < schedule.getDelay(job, 0) <= 14
+    job.uploaded_at -= 15
+    assert 2.5 < schedule.getDelay(job, 1) <= 3
+    # After the last quantile the fallback takes over
+    job.uploaded_at -= 10
+    assert schedule.getDelay(job, 2) == 7
+
+
+def test_result_poller(client, simulator, image):
+    with py9kw.ResultPoller(workers=2) as poller:
+        futures = [poller.add(client.uploadcaptcha(image)) for i in range(20)]
+        jobs = [future.result(timeout=10) for future in futures]
+    assert all(job.answer is not None for job in jobs)
+    assert len({job.captchaid for job in jobs}) == 20
+
+
+def test_result_poller_schedule_learns(client, simulator, image):
+    schedule = py9kw.LearnedPollSchedule(
+        fallback=py9kw.FixedPollSchedule(0.02), min_samples=3
+    )
+    with py9kw.ResultPoller(workers=2, poll_schedule=schedule) as poller:
+        futures = [poller.add(client.uploadcaptcha(image)) for i in range(5)]
+        for future in futures:
+            future.result(timeout=10)
+    samples = schedule._samples[schedule.getKey(futures[0].result())]
+    assert len(samples) == 5
+    # uploaded_at is taken after the upload answer arrived, so a sample may be a bit below the latency of the simulator
+    assert all(0.02 < sample < 5 for sample in samples)
@@ -0,0 +1,66 @@
+import py9kw
+
+
+def solvedJob(client, prio, seconds):
+    job = py9kw.CaptchaJob(client, 1, prio=prio)
+    job.uploaded_at = 0
+    job.solved_at = seconds
+    return job
+
+
+def newController(**kwargs):
+    return py9kw.PriorityController(
+        target=2, bands=(0, 5, 10), min_samples=3, probe_rate=0, **kwargs
+    )
+
+
+def test_lowest_band_meeting_the_target(client):
+    controller = newController()
+    # No samples yet --> Cheapest band gets tried first
+    assert controller.getPrio() == 0
+    for i in range(3):
+        controller.observe(solvedJob(client, 0, 5))
+    assert controller.getPrio() == 5
+    for i in range(3):
+        controller.observe(solvedJob(client, 5, 1))
+    assert controller.getPrio() == 5
+    # Captchas without answer count as too slow
+    for i in range(3):
+        controller.observe(py9kw.CaptchaJob(client, 1, prio=7))
+    assert controller.getPrio() == 10
+    stats = controller.getStats()
+    assert stats[0] == {"samples": 3, "within_target": 0.0}
+    assert stats[5] == {"samples": 6, "within_target": 0.5}
+
+
+def test_faster_band_is_chosen_again(client):
+    controller = newController()
+    for i in range(3):
+        controller.observe(solvedJob(client, 0, 5))
+    assert controller.getPrio() == 5
+    for i in range(30):
+        controller.observe(solvedJob(client, 0, 1))
+    assert controller.getPrio() == 0
+
+
+def test_max_cost(client):
+    controller = newController(max_cost=15)
+    for band in (0, 5):
+        for i in range(3):
+            controller.observe(solvedJob(client, band, 5))
+    assert controller.getPrio() == 5
+
+
+def test_prio_of_uploads(client, simulator, image):
+    controller = newController()
+    client.setPriorityController(controller)
+    for i in range(3):
+        controller.observe(solvedJob(client, 0, 5))
+    job = client.solve(image)
+    assert job.prio == 5
+    assert simulator._captchas[job.captchaid].cost == 15
+    # The answer got observed in its band
+    assert controller.getStats()[5]["samples"] == 1
+    # An explicit prio is used as it is
+    job = client.solve(image, prio=10)
+    assert simulator._captchas[job.captchaid].cost == 20
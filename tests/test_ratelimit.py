@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+
+import py9kw
+
+
+def test_burst_does_not_wait():
+    limiter = py9kw.RateLimiter(rate=10, burst=5)
+    started = time.monotonic()
+    for i in range(5):
+        limiter.acquire("usercaptchaupload")
+    assert time.monotonic() - started < 0.05
+
+
+def test_tokens_refill_at_rate():
+    limiter = py9kw.RateLimiter(rate=20, burst=1)
+    started = time.monotonic()
+    for i in range(11):
+        limiter.acquire("usercaptchacorrectdata")
+    # First token is there, the other 10 take 1/20 second each
+    assert 0.45 <= time.monotonic() - started < 0.8
+
+
+def test_lanes_serve_feedback_before_polls_before_uploads():
+    limiter = py9kw.RateLimiter(rate=10, burst=1)
+    limiter.acquire("usercaptchaupload")
+    order = []
+    threads = []
+    for action in (
+        "usercaptchaupload",
+        "usercaptchacorrectdata",
+        "usercaptchacorrectback",
+    ):
+        thread = threading.Thread(
+            target=lambda action=action: (limiter.acquire(action), order.append(action))
+        )
+        thread.start()
+        threads.append(thread)
+        # Wait until the request is queued in its lane
+        while sum(limiter.getWaiting()) < len(threads):
+            time.sleep(0.001)
+    assert limiter.getWaiting() == [1, 1, 1]
+    for thread in threads:
+        thread.join()
+    assert order == [
+        "usercaptchacorrectback",
+        "usercaptchacorrectdata",
+        "usercaptchaupload",
+    ]
+    assert limiter.getWaiting() == [0, 0, 0]
+
+
+def test_async_acquire_does_not_block_the_event_loop():
+    limiter = py9kw.RateLimiter(rate=5, burst=1)
+    limiter.acquire("usercaptchaupload")
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ticker = asyncio.ensure_future(tick())
+        started = time.monotonic()
+        await limiter.acquireAsync("usercaptchaupload")
+        waited = time.monotonic() - started
+        ticker.cancel()
+        return waited
+
+    waited = asyncio.run(run())
+    assert waited >= 0.15
+    assert ticks >= 10
+
+
+def test_client_requests_are_limited(client, simulator):
+    client.setRateLimiter(py9kw.RateLimiter(rate=20, burst=1))
+    started = time.monotonic()
+    for i in range(6):
+        client.getcredits()
+    assert time.monotonic() - started >= 0.25
+    assert simulator.requests["usercaptchaguthaben"] == 6
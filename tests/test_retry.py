@@ -0,0 +1,69 @@
+import urllib.error
+
+import py9kw
+
+
+def fastRetries(attempts):
+    return py9kw.RetryPolicy(attempts=attempts, base=0.01, cap=0.02)
+
+
+def test_idempotent_requests_are_retried(client, simulator):
+    client.setRetryPolicy(fastRetries(3))
+    client.setCircuitBreaker(None)
+    simulator.http_error_rate = 1.0
+    assert client.getcredits() is None
+    assert client.errorint == 606
+    assert simulator.requests["usercaptchaguthaben"] == 3
+
+
+def test_retry_succeeds_after_failures(client, simulator):
+    client.setRetryPolicy(fastRetries(20))
+    client.setCircuitBreaker(None)
+    simulator.http_error_rate = 0.5
+    credits, errorint, errormsg = client.getcredits()
+    assert credits == simulator.credits
+    assert errorint == -1
+
+
+def test_uploads_are_only_retried_if_unprocessed():
+    policy = fastRetries(3)
+    assert policy.getDelay(0, None, ValueError("malformed json"), idempotent=False) is None
+    unavailable = urllib.error.HTTPError("url", 503, "Unavailable", {}, None)
+    assert policy.getDelay(0, None, unavailable, idempotent=False) is not None
+    assert policy.getDelay(2, None, unavailable, idempotent=True) is None
+
+
+def test_failed_upload_gets_606(client, simulator, image):
+    client.setRetryPolicy(fastRetries(1))
+    simulator.http_error_rate = 1.0
+    job = client.uploadcaptcha(image)
+    assert not job
+    assert job.errorint == 606
+
+
+def test_circuit_opens_and_recovers(client, simulator):
+    client.setRetryPolicy(fastRetries(1))
+    breaker = py9kw.CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    client.setCircuitBreaker(breaker)
+    simulator.http_error_rate = 1.0
+    client.getcredits()
+    client.getcredits()
+    assert simulator.requests["usercaptchaguthaben"] == 2
+    # Open circuit --> Fails without sending a request
+    assert client.getcredits() is None
+    assert client.errorint == 607
+    assert simulator.requests["usercaptchaguthaben"] == 2
+    simulator.http_error_rate = 0.0
+    py9kw.time.sleep(0.15)
+    credits, errorint, errormsg = client.getcredits()
+    assert errorint == -1
+    assert breaker.allow()
+
+
+def test_sleep_and_get_result_polls_through_failures(client, simulator, image):
+    client.setRetryPolicy(fastRetries(1))
+    client.setCircuitBreaker(None)
+    job = client.uploadcaptcha(image)
+    simulator.http_error_rate = 0.5
+    answer, errorint, errormsg = job.result()
+    assert answer is not None
@@ -0,0 +1,28 @@
+import py9kw
+from py9kw_simulator import Py9kwSimulator
+
+
+def test_answer_is_charged_and_wrong_answer_refunded(client, simulator, image):
+    credits = simulator.credits
+    job = client.solve(image)
+    assert simulator.credits == credits - job.getCost()
+    job.correct(False)
+    assert simulator.credits == credits
+
+
+def test_unknown_apikey(image):
+    with Py9kwSimulator(apikeys={"valid": 100}) as simulator:
+        client = py9kw.Py9kw("invalid", api_base=simulator.base_url)
+        assert client.getcredits() is None
+        assert "API key not found" in client.errormsg
+        client = py9kw.Py9kw("valid", api_base=simulator.base_url)
+        assert client.getcredits()[0] == 100
+
+
+def test_simulated_errors(client, simulator, image):
+    client.setRetryPolicy(py9kw.RetryPolicy(attempts=1))
+    simulator.error_rate = 1.0
+    job = client.uploadcaptcha(image)
+    assert not job
+    assert "Simulated error" in job.errormsg
+    assert simulator.requests["usercaptchaupload"] == 1
@@ -0,0 +1,62 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+import py9kw
+
+
+def test_upload_base64(client, simulator, image):
+    client.setUploadMode(py9kw.UPLOAD_MODE_BASE64)
+    job = client.solve(image)
+    assert job.answer == hashlib.md5(image).hexdigest()
+    assert job.errorint == -1
+
+
+def test_upload_multipart(client, simulator, image):
+    client.setUploadMode(py9kw.UPLOAD_MODE_MULTIPART)
+    job = client.solve(image)
+    assert job.answer == hashlib.md5(image).hexdigest()
+
+
+def test_upload_returns_job_tuple(client, image):
+    captchaid, errorint, errormsg = client.uploadcaptcha(image)
+    assert captchaid >= 1000
+    assert errorint == -1
+
+
+def test_async_upload(simulator, image):
+    async def solve():
+        client = py9kw.AsyncPy9kw("test", api_base=simulator.base_url)
+        client.setPollSchedule(py9kw.FixedPollSchedule(0.02))
+        jobs = await asyncio.gather(*(client.solve(image) for i in range(10)))
+        client.pool.close()
+        return jobs
+
+    jobs = asyncio.run(solve())
+    assert [job.answer for job in jobs] == [hashlib.md5(image).hexdigest()] * 10
+    assert simulator.requests["usercaptchaupload"] == 10
+
+
+def test_upload_base64_image(client, simulator, image):
+    job = client.solve(py9kw.Base64Image(py9kw.b64encode(image)))
+    assert job.answer == hashlib.md5(image).hexdigest()
+
+
+def test_upload_path(client, simulator, image, tmp_path):
+    path = tmp_path / "captcha.png"
+    path.write_bytes(image)
+    job = client.solve(path)
+    assert job.answer == hashlib.md5(image).hexdigest()
+
+
+def test_upload_rejects_str_which_is_no_url(client):
+    with pytest.raises(TypeError):
+        client.uploadcaptcha("captcha.png")
+
+
+def test_upload_memoryview_and_stream(client, simulator, image):
+    expected = hashlib.md5(image).hexdigest()
+    assert client.solve(memoryview(image)).answer == expected
+    assert client.solve(io.BytesIO(image)).answer == expected